@@ -174,6 +174,34 @@ CORS_ALLOW_CREDENTIALS = True
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 GLOBAL_LEXICON_OWNER_ID = int(os.getenv("GLOBAL_LEXICON_OWNER_ID", "1"))
 
+# Rules engine: in-process lexicon snapshot cache (LRU by approximate size)
+LEXICON_CACHE_MAX_BYTES = int(os.getenv("LEXICON_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Rules engine: worker processes for multi-owner admin batches (0 = cpu count, 1 = serial)
+RULES_MAX_WORKERS = int(os.getenv("RULES_MAX_WORKERS", "0"))
+# Rules engine: worker processes for admin batches started from a web request (1 = serial in the request)
+RULES_WEB_MAX_WORKERS = int(os.getenv("RULES_WEB_MAX_WORKERS", "1"))
+# Rules engine: dotted path to hook(timings, context) receiving per-stage timings (enables them when set)
+RULES_TIMINGS_HOOK = os.getenv("RULES_TIMINGS_HOOK", "")
+# Rules engine: per-run memo of results for identical dish texts (entries), optionally persisted in DB
+RULES_MEMO_MAX_ENTRIES = int(os.getenv("RULES_MEMO_MAX_ENTRIES", "50000"))
+RULES_MEMO_PERSIST = os.getenv("RULES_MEMO_PERSIST", "0") == "1"
+# Rules engine: split German compounds ("sesambroetchen" → sesam) into known single-word lexemes
+RULES_DECOMPOUND = os.getenv("RULES_DECOMPOUND", "1") == "1"
+# Rules engine: typo-tolerant lookup for unmatched words (max edit distance 1–2; 0 = off)
+RULES_FUZZY_MAX_DISTANCE = int(os.getenv("RULES_FUZZY_MAX_DISTANCE", "0"))
+# Rules engine: match plain terms per chunk through a token posting map instead of per dish
+RULES_BATCH_MATCHING = os.getenv("RULES_BATCH_MATCHING", "0") == "1"
+
+# LLM: prompt-hash response cache (in-memory LRU entries + LLMResponseCache table with TTL/size pruning)
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "1") == "1"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "50000"))
+# LLM: max concurrent requests in the batch fallback (keep <= OPENAI_HTTP_POOL_SIZE; 1 = serial)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# LLM: pack several dishes / all distinct terms of a batch into one prompt (split by token budget)
+LLM_BATCH_PROMPTS = os.getenv("LLM_BATCH_PROMPTS", "1") == "1"
+
 # ------------------------------------------------------------------
 # Django 3.2+ default pk type
 # ------------------------------------------------------------------
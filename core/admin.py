@@ -5,8 +5,9 @@
 
 from __future__ import annotations
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
 from .models import (
@@ -17,7 +18,7 @@ from .models import (
 )
 
 # ✅ نماذج القاموس
-from .dictionary_models import KeywordLexeme, NegationCue, normalize_text
+from .dictionary_models import KeywordLexeme, NegationCue, LexiconVersion, normalize_text
 
 
 # ===================== User =====================
@@ -185,14 +186,22 @@ class MenuDisplaySettingsAdmin(admin.ModelAdmin):
 
 # ===================== Dictionary: KeywordLexeme =====================
 
+def _bump_lexicon_versions(queryset):
+    """queryset.update() لا يرسل إشارات؛ نرفع إصدار القاموس يدويًا لكل مالك متأثّر."""
+    owner_ids = set(queryset.values_list("owner_id", flat=True).distinct())
+    LexiconVersion.bump(*(LexiconVersion.scope_for_owner(o) for o in owner_ids))
+
+
 @admin.action(description=_("Activate selected lexemes"))
 def activate_lexemes(modeladmin, request, queryset):
     queryset.update(is_active=True)
+    _bump_lexicon_versions(queryset)
 
 
 @admin.action(description=_("Deactivate selected lexemes"))
 def deactivate_lexemes(modeladmin, request, queryset):
     queryset.update(is_active=False)
+    _bump_lexicon_versions(queryset)
 
 
 @admin.action(description=_("Normalize terms"))
@@ -201,15 +210,36 @@ def normalize_terms(modeladmin, request, queryset):
     يعيد حساب normalized_term (دون تغيير term نفسه).
     مفيد عندما تُعدّل سياسة التطبيع أو تُستورد بيانات خام.
     """
-    changed = 0
+    changed = rejected = 0
     for lx in queryset:
         norm = normalize_text(lx.term or "")
         if lx.normalized_term != norm:
             lx.normalized_term = norm
-            lx.save(update_fields=["normalized_term"])
+            try:
+                lx.save(update_fields=["normalized_term"])
+            except ValidationError:
+                # نمط regex مرفوض (انظر عمود Regex check)
+                rejected += 1
+                continue
             changed += 1
     if changed:
         modeladmin.message_user(request, _(f"Normalized {changed} term(s)."))
+    if rejected:
+        modeladmin.message_user(request, _(f"Skipped {rejected} rejected regex pattern(s)."), level=messages.WARNING)
+
+
+@admin.action(description=_("Recompute dishes affected by selected lexemes"))
+def recompute_affected_dishes(modeladmin, request, queryset):
+    """إعادة حساب الأطباق المتأثّرة فقط (عبر فهرس DishToken) بدل تشغيل الدفعة كاملة."""
+    from core.services.dish_index import changes_for_lexemes, recompute_affected
+
+    langs = set(queryset.values_list("lang", flat=True).distinct())
+    affected = changed = 0
+    for lang in langs:
+        res = recompute_affected(changes_for_lexemes(queryset.filter(lang=lang)), lang=lang, dry_run=False)
+        affected += res["affected"]
+        changed += res["changed"]
+    modeladmin.message_user(request, _(f"Recomputed {affected} dish(es); {changed} changed."))
 
 
 @admin.register(KeywordLexeme)
@@ -228,6 +258,7 @@ class KeywordLexemeAdmin(admin.ModelAdmin):
         "term",
         "normalized_term",
         "is_regex",
+        "regex_check",
         "is_active",
         "priority",
         "weight",
@@ -247,7 +278,7 @@ class KeywordLexemeAdmin(admin.ModelAdmin):
     )
     readonly_fields = ("normalized_term", "created_at", "updated_at")
     ordering = ("owner_id", "lang", "-priority", "-weight", "id")
-    actions = (activate_lexemes, deactivate_lexemes, normalize_terms)
+    actions = (activate_lexemes, deactivate_lexemes, normalize_terms, recompute_affected_dishes)
     autocomplete_fields = ("ingredient", "owner")
     filter_horizontal = ("allergens",)
     list_select_related = ("ingredient", "owner")
@@ -282,17 +313,30 @@ class KeywordLexemeAdmin(admin.ModelAdmin):
     def ingredient_codes(self, obj: KeywordLexeme) -> str:
         return _codes_str(obj.ingredient.allergens.all()) if obj.ingredient_id else ""
 
+    @admin.display(description=_("Regex check"))
+    def regex_check(self, obj: KeywordLexeme) -> str:
+        """
+        ok / invalid / risky (+ السبب) — الأنماط غير ok لا تدخل المطابقة.
+        الفحص الثابت فقط (مخزّن مؤقتًا): الفحص الديناميكي يجري عند الحفظ، لا لكل صف في القائمة.
+        """
+        if not obj.is_regex:
+            return ""
+        verdict = obj.regex_verdict(dynamic=False)
+        return verdict.status if verdict.ok else f"{verdict.status}: {verdict.reason}"
+
 
 # ===================== Dictionary: NegationCue =====================
 
 @admin.action(description=_("Activate selected negation cues"))
 def activate_cues(modeladmin, request, queryset):
     queryset.update(is_active=True)
+    _bump_lexicon_versions(queryset)
 
 
 @admin.action(description=_("Deactivate selected negation cues"))
 def deactivate_cues(modeladmin, request, queryset):
     queryset.update(is_active=False)
+    _bump_lexicon_versions(queryset)
 
 
 @admin.register(NegationCue)
@@ -6,45 +6,22 @@
 
 from __future__ import annotations
 
-import re
-import unicodedata
 from typing import Optional
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import IntegrityError, models
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # مراجع إلى موديلات موجودة في core.models
 from core.models import Allergen, Ingredient
-
-
-# -----------------------------
-# أدوات تطبيع نص متّسقة وبسيطة
-# -----------------------------
-_AR_DIACRITICS_RE = re.compile(r"[\u064B-\u0652]")
-_NON_ALNUM_RE = re.compile(r"[^\w\s]", flags=re.UNICODE)
-
-def normalize_text(value: str) -> str:
-    """
-    NFKD + إزالة العلامات (accents)، تبسيط الألمانية، إزالة التشكيل العربي،
-    إزالة الرموز غير الألفانوميرية (نبقي المسافات)، lowercase + دمج المسافات.
-    متوافقة مع services/allergen_rules.normalize_text
-    """
-    if not value:
-        return ""
-    x = unicodedata.normalize("NFKD", str(value))
-    x = "".join(ch for ch in x if not unicodedata.combining(ch))
-    x = (
-        x.replace("ä", "ae")
-         .replace("ö", "oe")
-         .replace("ü", "ue")
-         .replace("ß", "ss")
-    )
-    x = _AR_DIACRITICS_RE.sub("", x)
-    x = _NON_ALNUM_RE.sub(" ", x)
-    x = " ".join(x.strip().lower().split())
-    return x
+# التطبيع: المصدر الوحيد services/text_normalize (يُعاد تصديره لـ admin والأوامر القديمة)
+from core.services.text_normalize import normalize_text
+from core.services.regex_guard import RegexVerdict, check_regex
 
 
 # ============================================================
@@ -179,13 +156,23 @@ class KeywordLexeme(models.Model):
     def clean(self):
         """
         نضمن التطبيع قبل فحص قيود Unique (خاصةً في admin/bulk).
+        أنماط Regex المفعّلة تُفحص عند الحفظ (services/regex_guard): نمط خاطئ أو
+        معرّض للتراجع الكارثي يُرفض بـValidationError. التعطيل (is_active=False) مسموح دائمًا.
         """
         self.normalized_term = normalize_text(self.term or "")
         if self.lang:
             self.lang = (normalize_text(self.lang) or "de").replace(" ", "")
+        if self.is_regex and self.is_active:
+            verdict = self.regex_verdict()
+            if not verdict.ok:
+                raise ValidationError({"term": f"Regex rejected ({verdict.status}): {verdict.reason}"})
+
+    def regex_verdict(self, dynamic: bool = True) -> RegexVerdict:
+        """نتيجة فحص النمط؛ dynamic=False = الفحص الثابت فقط (ما يطبّقه المحرك عند بناء اللقطة)."""
+        return check_regex(self.term or "", dynamic=dynamic)
 
     def save(self, *args, **kwargs):
-        # تطبيع قبل الحفظ
+        # تطبيع + فحص النمط قبل الحفظ
         self.clean()
         super().save(*args, **kwargs)
 
@@ -198,6 +185,7 @@ class NegationCue(models.Model):
     تُستخدم لتعطيل مطابقة lexeme إذا ظهرت عبارة نفي قريبة منها، مثل:
       "ohne sesam", "without nuts", "بدون سمسم"
     نافذة الكلمات (before/after) تحدّد عدد الكلمات المتأثّرة بالنفي.
+    النافذتان = 0: العبارة حدّ جملة ("mit", "aber") لا تعبره نوافذ النفي الأخرى.
     """
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -287,6 +275,162 @@ class NegationCue(models.Model):
         super().save(*args, **kwargs)
 
 
+# ============================================================
+# LexiconVersion: عدّاد إصدار القاموس لكل نطاق (عام / مالك)
+# ============================================================
+class LexiconVersion(models.Model):
+    """
+    عدّاد يُرفع تلقائيًا (عبر الإشارات أدناه) كلما تغيّر القاموس فعليًا.
+    يُستخدم كجزء من مفتاح كاش اللقطات في services/lexicon_cache:
+      - scope="global": القاموس العام (owner=NULL أو GLOBAL_LEXICON_OWNER_ID) + Allergen
+      - scope="owner:<id>": قاموس/مكوّنات/نفي مالك معيّن
+    مخزّن في DB ليبقى متّسقًا بين عدّة workers (gunicorn) بدون كاش مشترك.
+    """
+    GLOBAL_SCOPE = "global"
+
+    scope = models.CharField(max_length=32, unique=True, verbose_name=_("Scope"))
+    version = models.PositiveBigIntegerField(default=0, verbose_name=_("Version"))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_("Updated at"))
+
+    class Meta:
+        verbose_name = _("Lexicon Version")
+        verbose_name_plural = _("Lexicon Versions")
+
+    def __str__(self) -> str:
+        return f"{self.scope}@{self.version}"
+
+    @classmethod
+    def scope_for_owner(cls, owner_id: Optional[int]) -> str:
+        global_owner_id = getattr(settings, "GLOBAL_LEXICON_OWNER_ID", None)
+        if owner_id is None or owner_id == global_owner_id:
+            return cls.GLOBAL_SCOPE
+        return f"owner:{owner_id}"
+
+    @classmethod
+    def bump(cls, *scopes: str) -> None:
+        for scope in dict.fromkeys(scopes):
+            updated = cls.objects.filter(scope=scope).update(version=F("version") + 1, updated_at=timezone.now())
+            if updated:
+                continue
+            try:
+                cls.objects.create(scope=scope, version=1)
+            except IntegrityError:
+                cls.objects.filter(scope=scope).update(version=F("version") + 1, updated_at=timezone.now())
+
+    @classmethod
+    def current(cls, owner_id: Optional[int]) -> str:
+        """إصدار مركّب "g<global>.o<owner>" في استعلام واحد."""
+        g_scope = cls.GLOBAL_SCOPE
+        o_scope = cls.scope_for_owner(owner_id)
+        found = dict(cls.objects.filter(scope__in={g_scope, o_scope}).values_list("scope", "version"))
+        g = found.get(g_scope, 0)
+        o = found.get(o_scope, 0) if o_scope != g_scope else 0
+        return f"g{g}.o{o}"
+
+
+class RuleResultMemo(models.Model):
+    """
+    نتيجة محرك القواعد المحفوظة لنص طبق متكرّر (سلاسل/فروع بنفس الطبق):
+      - digest: sha256 للمفتاح (لقطة القاموس owner/lang/version + النص المُطبّع
+        + المكوّنات + extras + إعدادات المحرك/الصيغة) — انظر rules_core/memo.key_digest
+      - payload: DishEvaluation بدون dish_id (letters/numbers/provenance ...)
+    الصفوف المرتبطة بإصدار قاموس قديم لا تُطابَق أبدًا وتُحذف عند أول تشغيل بالإصدار الجديد.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    owner_id = models.BigIntegerField(null=True, blank=True)
+    lang = models.CharField(max_length=8)
+    lexicon_version = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Rule Result Memo")
+        verbose_name_plural = _("Rule Result Memos")
+        indexes = [
+            models.Index(fields=["owner_id", "lang", "lexicon_version"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.owner_id}/{self.lang}@{self.lexicon_version}: {self.digest[:12]}"
+
+
+class LLMResponseCache(models.Model):
+    """
+    ردود LLM المحفوظة حسب prompt hash (services/llm_cache):
+      - digest: sha256 لـ(نوع البرومبت + إصدار القالب + النموذج + temperature + المدخل المُطبّع)
+      - payload: الرد الخام أو الناتج المحلَّل (حسب النوع)
+    تنتهي صلاحيتها بعد LLM_CACHE_TTL_SECONDS وتُقلَّم الأقدم فوق LLM_CACHE_MAX_ROWS.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    kind = models.CharField(max_length=32)
+    model_name = models.CharField(max_length=100, blank=True, default="")
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("LLM Response Cache")
+        verbose_name_plural = _("LLM Response Cache")
+
+    def __str__(self) -> str:
+        return f"{self.kind}/{self.model_name}: {self.digest[:12]}"
+
+
+# ------------------------------------------------------------
+# إشارات: رفع إصدار القاموس عند أي تغيير حقيقي
+# ------------------------------------------------------------
+def _ingredient_scopes(ingredient_ids) -> set:
+    """نطاق مالك المكوّن + نطاقات الـlexemes المربوطة به (قد تكون عامة)."""
+    scopes = set()
+    for owner_id in Ingredient.objects.filter(pk__in=ingredient_ids).values_list("owner_id", flat=True):
+        scopes.add(LexiconVersion.scope_for_owner(owner_id))
+    for owner_id in KeywordLexeme.objects.filter(ingredient_id__in=ingredient_ids).values_list("owner_id", flat=True).distinct():
+        scopes.add(LexiconVersion.scope_for_owner(owner_id))
+    return scopes
+
+
+@receiver([post_save, post_delete], sender=KeywordLexeme)
+@receiver([post_save, post_delete], sender=NegationCue)
+def bump_version_on_owned_change(sender, instance, **kwargs):
+    LexiconVersion.bump(LexiconVersion.scope_for_owner(instance.owner_id))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_version_on_ingredient_change(sender, instance, **kwargs):
+    scopes = {LexiconVersion.scope_for_owner(instance.owner_id)}
+    if kwargs.get("signal") is post_save:
+        scopes |= _ingredient_scopes([instance.pk])
+    else:
+        # بعد الحذف صار ingredient_id=NULL على الـlexemes؛ نرفع العام احتياطًا
+        scopes.add(LexiconVersion.GLOBAL_SCOPE)
+    LexiconVersion.bump(*scopes)
+
+
+@receiver([post_save, post_delete], sender=Allergen)
+def bump_version_on_allergen_change(sender, instance, **kwargs):
+    LexiconVersion.bump(LexiconVersion.GLOBAL_SCOPE)
+
+
+@receiver(m2m_changed, sender=KeywordLexeme.allergens.through)
+def bump_version_on_lexeme_allergens(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # instance = Allergen: قد يمسّ lexemes لعدّة مالكين
+        LexiconVersion.bump(LexiconVersion.GLOBAL_SCOPE)
+        return
+    LexiconVersion.bump(LexiconVersion.scope_for_owner(instance.owner_id))
+
+
+@receiver(m2m_changed, sender=Ingredient.allergens.through)
+def bump_version_on_ingredient_allergens(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        LexiconVersion.bump(LexiconVersion.GLOBAL_SCOPE)
+        return
+    LexiconVersion.bump(*_ingredient_scopes([instance.pk]))
+
+
 # ------------------------------------------------------------
 # Backwards-compat alias for old imports:
 # بعض الملفات القديمة (مثل core/services/llm_ingest.py)
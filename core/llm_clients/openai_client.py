@@ -1,8 +1,16 @@
 # core/llm_clients/openai_client.py
 import os
 import re
-from typing import Optional
-from openai import OpenAI, RateLimitError, APIError, APIConnectionError, AuthenticationError
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import (
+    DefaultHttpxClient, OpenAI, RateLimitError, APIError, APIConnectionError, APIStatusError, AuthenticationError,
+)
+
+from core.llm_clients.rate_limiter import CircuitOpen, backoff_delay, estimate_tokens, get_limiter
 
 MODEL_ALIAS = {
     "gpt-4.1": "gpt-4o",
@@ -18,11 +26,107 @@ class LLMRateLimit(LLMError):
     """تخطي السقف (429)."""
     pass
 
+class LLMCircuitOpen(LLMError):
+    """قاطع الدائرة مفتوح: الخدمة تفشل باستمرار، النداء رُفض بدون إرسال."""
+    pass
+
 def _resolve_model(name: str) -> str:
     if not name:
         return "gpt-4o-mini"
     return MODEL_ALIAS.get(name, name)
 
+
+# -----------------------------------------------
+# سجلّ عملاء مشترك على مستوى العملية (keep-alive)
+#   - عميل أساسي واحد لكل API key بمجمّع اتصالات httpx (حجمه من OPENAI_HTTP_POOL_SIZE)
+#   - لكل timeout نسخة with_options تشارك نفس المجمّع → اتصالات TLS دافئة بين النداءات
+#   - آمن مع fork (gunicorn --preload): العملية الابنة تبدأ بسجلّ فارغ ولا تلمس مقابس الأب
+# -----------------------------------------------
+HTTP_POOL_SIZE = int(os.getenv("OPENAI_HTTP_POOL_SIZE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY", "30"))
+# إعادة المحاولة يتولاها openai_caller (rate_limiter) → إعادة المحاولة الداخلية للمكتبة معطّلة
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+MAX_WAIT = float(os.getenv("OPENAI_MAX_WAIT", "120"))
+
+_clients: Dict[Tuple[str, Optional[float]], OpenAI] = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+
+def _reset_clients() -> None:
+    """بعد fork: نسقط المراجع فقط (إغلاقها هنا يغلق مقابس ما زالت للأب)."""
+    global _clients, _clients_lock, _clients_pid
+    _clients = {}
+    _clients_lock = threading.Lock()
+    _clients_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients)
+
+
+def get_client(timeout: Optional[float] = 60, api_key: Optional[str] = None) -> OpenAI:
+    """عميل OpenAI مُعاد الاستخدام لهذا الـtimeout (نفس مجمّع الاتصالات لكل الـtimeouts)."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMError("OPENAI_API_KEY is not set in environment.")
+    if os.getpid() != _clients_pid:
+        _reset_clients()
+
+    key = (api_key, float(timeout) if timeout is not None else None)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            base = _clients.get((api_key, None))
+            if base is None:
+                base = OpenAI(
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=HTTP_POOL_SIZE,
+                            max_keepalive_connections=HTTP_POOL_SIZE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                        ),
+                    ),
+                )
+                _clients[(api_key, None)] = base
+            client = base if timeout is None else base.with_options(timeout=float(timeout))
+            _clients[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """يغلق مجمّعات الاتصالات (عند إيقاف العملية/في الاختبارات)."""
+    with _clients_lock:
+        bases = {id(c._client): c for c in _clients.values()}
+        _clients.clear()
+    for client in bases.values():
+        try:
+            client.close()
+        except Exception:
+            pass
+
+def _response_headers(e: Exception):
+    try:
+        return e.response.headers  # type: ignore[attr-defined]
+    except Exception:
+        return None
+
+
+def _rate_limit_message(model: str, e: Exception) -> str:
+    # نستخرج تلميح "try again in XmYs" إن وجد
+    msg = str(e)
+    wait_hint = ""
+    m = re.search(r"in\s+(\d+)m(\d+)s", msg)
+    if m:
+        wait_hint = f" (try again in ~{m.group(1)}m {m.group(2)}s)"
+    return f"Rate limit for {model}{wait_hint}"
+
+
 def openai_caller(
     prompt: str,
     *,
@@ -35,41 +139,86 @@ def openai_caller(
     نداء بسيط لـ OpenAI Chat Completions مع معالجة أخطاء مفيدة.
     - يأخذ الـAPI Key من OPENAI_API_KEY (متغير البيئة).
     - يعمل alias للأسماء الحديثة.
-    - يرمي LLMRateLimit عند 429 حتى تتعامل الواجهة معه برِفق.
+    - العميل من get_client (اتصالات keep-alive مشتركة) بدل عميل جديد لكل نداء.
+    - الإرسال عبر get_limiter(model): انتظار حسب سطلي الطلبات/tokens (من هيدرز الردود)،
+      وإعادة المحاولة على 429/5xx/الشبكة بـbackoff عشوائي (وretry-after) حتى OPENAI_MAX_RETRIES.
+    - يرمي LLMRateLimit إن بقي 429 بعد المحاولات (أو الانتظار > OPENAI_MAX_WAIT)،
+      وLLMCircuitOpen إن كان القاطع مفتوحًا.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise LLMError("OPENAI_API_KEY is not set in environment.")
-
-    client = OpenAI(api_key=api_key, timeout=timeout)
+    client = get_client(timeout)
     model = _resolve_model(model_name)
+    limiter = get_limiter(model)
+    cost = estimate_tokens(prompt, max_tokens)
 
+    attempt = 0
+    sent = False
     try:
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=float(temperature),
-            max_tokens=int(max_tokens),
-        )
-        return (resp.choices[0].message.content or "").strip()
-
-    except RateLimitError as e:
-        # نستخرج تلميح "try again in XmYs" إن وجد
-        msg = str(e)
-        wait_hint = ""
-        m = re.search(r"in\s+(\d+)m(\d+)s", msg)
-        if m:
-            wait_hint = f" (try again in ~{m.group(1)}m {m.group(2)}s)"
-        raise LLMRateLimit(f"Rate limit for {model}{wait_hint}") from e
-
-    except AuthenticationError as e:
-        raise LLMError("Invalid OPENAI_API_KEY or auth error.") from e
-
-    except APIConnectionError as e:
-        raise LLMError(f"Network error contacting OpenAI: {e}") from e
-
-    except APIError as e:
-        raise LLMError(f"OpenAI API error: {e}") from e
-
-    except Exception as e:
-        raise LLMError(f"Unexpected LLM error: {e}") from e
+        while True:
+            try:
+                wait = limiter.acquire(cost)
+            except CircuitOpen as e:
+                raise LLMCircuitOpen(str(e)) from e
+            if wait > MAX_WAIT:
+                limiter.refund(cost)  # لن يُرسل: الحجز يعود للسطلين
+                raise LLMRateLimit(f"Rate limit for {model} (would wait ~{int(wait)}s)")
+            if wait:
+                time.sleep(wait)
+
+            try:
+                sent = True
+                raw = client.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=float(temperature),
+                    max_tokens=int(max_tokens),
+                )
+                limiter.observe(raw.headers)
+                resp = raw.parse()
+                limiter.record_success()
+                return (resp.choices[0].message.content or "").strip()
+
+            except RateLimitError as e:
+                headers = _response_headers(e)
+                limiter.observe(headers)
+                if getattr(e, "code", None) == "insufficient_quota":
+                    raise LLMRateLimit(f"Insufficient quota for {model}") from e
+                # التجميد يسري على كل نداءات النموذج؛ المحاولة التالية تنتظره عبر acquire
+                delay = limiter.throttle(headers, backoff_delay(attempt))
+                if attempt >= MAX_RETRIES or delay > MAX_WAIT:
+                    limiter.record_failure()
+                    raise LLMRateLimit(_rate_limit_message(model, e)) from e
+                limiter.record_success()  # 429 = تقنين لا عطل؛ التجميد أعلاه يكفي
+                attempt += 1
+
+            except AuthenticationError as e:
+                limiter.record_success()  # الخدمة تردّ؛ الخطأ في المفتاح لا في توفّرها
+                raise LLMError("Invalid OPENAI_API_KEY or auth error.") from e
+
+            except APIConnectionError as e:
+                if attempt >= MAX_RETRIES:
+                    limiter.record_failure()
+                    raise LLMError(f"Network error contacting OpenAI: {e}") from e
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+            except APIStatusError as e:
+                if e.status_code < 500 and e.status_code not in (408, 409):
+                    limiter.record_success()
+                    raise LLMError(f"OpenAI API error: {e}") from e
+                limiter.observe(_response_headers(e))
+                if attempt >= MAX_RETRIES:
+                    limiter.record_failure()
+                    raise LLMError(f"OpenAI API error: {e}") from e
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+            except APIError as e:
+                limiter.record_failure()
+                raise LLMError(f"OpenAI API error: {e}") from e
+
+            except Exception as e:
+                limiter.record_failure()
+                raise LLMError(f"Unexpected LLM error: {e}") from e
+    finally:
+        # النداء التجريبي (half-open) يُحرَّر مهما كان مسار الخروج
+        limiter.release_probe(failed=sent)
@@ -0,0 +1,250 @@
+# core/llm_clients/rate_limiter.py
+# -----------------------------------------------
+# جدولة نداءات LLM حسب حدود المعدّل الفعلية (مشتركة على مستوى العملية، لكل نموذج)
+#   - سطلان لكل نموذج: طلبات/دقيقة وtokens/دقيقة؛ السعة والرصيد من هيدرز كل رد
+#     (x-ratelimit-limit-*/remaining-*/reset-*) والتعبئة مستمرة بمعدّل limit/60s
+#   - قبل كل نداء: حجز التكلفة (طلب + tokens تقديرية)؛ عند العجز ننتظر بقدر النقص فقط
+#     → الدُفعات الكبيرة تمشي بأقصى معدّل مسموح بدل أن تسقط بـ429 في منتصفها
+#   - 429/retry-after: السطلان يُجمَّدان حتى انتهاء المهلة لكل threads النموذج
+#   - قاطع دائرة: بعد N نداءات متتالية فشلت بعد كل محاولاتها (5xx/شبكة/429) يُرفض
+#     النداء فورًا لمدة cooldown، ثم نداء تجريبي واحد (half-open) يقرر الإغلاق أو إعادة الفتح
+#   - قبل وصول أي هيدرز الحدود مجهولة → لا تقنين
+# -----------------------------------------------
+
+from __future__ import annotations
+
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+RATE_HEADROOM = float(os.getenv("OPENAI_RATE_HEADROOM", "0.9"))
+BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+BREAKER_THRESHOLD = int(os.getenv("OPENAI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+
+WINDOW_SECONDS = 60.0
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value) -> Optional[float]:
+    """"1m30s" / "250ms" / "6s" / "2" (ثوانٍ كما في retry-after) → ثوانٍ؛ غير صالح → None."""
+    if value in (None, ""):
+        return None
+    text = str(value).strip()
+    try:
+        return max(0.0, float(text))
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(text)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """full jitter: عشوائي حتى base*2^attempt (سقفه BACKOFF_MAX)، ولا يقل عن retry-after."""
+    ceiling = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """تقدير تكلفة الحجز: ~4 أحرف لكل token في المدخل + سقف المخرج."""
+    return len(prompt or "") // 4 + int(max_tokens or 0)
+
+
+class TokenBucket:
+    """سطل بسعة limit وتعبئة limit/60s؛ الرصيد قد يصبح سالبًا (حجوزات تنتظر دورها)."""
+
+    def __init__(self) -> None:
+        self.capacity: Optional[float] = None
+        self.level = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is None:
+            return
+        rate = self.capacity / WINDOW_SECONDS
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def reserve(self, cost: float, now: float) -> float:
+        """يخصم التكلفة ويعيد زمن الانتظار حتى يصبح الرصيد غير سالب."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        self.level -= cost
+        if self.level >= 0:
+            return 0.0
+        return -self.level / (self.capacity / WINDOW_SECONDS)
+
+    def observe(self, limit: Optional[int], remaining: Optional[int], now: float) -> None:
+        if not limit:
+            return
+        first = self.capacity is None
+        self._refill(now)
+        self.capacity = float(limit) * RATE_HEADROOM
+        if remaining is not None:
+            # الهيدرز لا تعرف حجوزاتنا الجارية → تُستخدم لتضييق الرصيد فقط
+            server_level = float(remaining) - float(limit) * (1 - RATE_HEADROOM)
+            self.level = server_level if first else min(self.level, server_level)
+        elif first:
+            self.level = self.capacity
+
+    def refund(self, cost: float, now: float) -> None:
+        """يعيد حجزًا لم يُرسل (النداء تخلّى قبل الإرسال)."""
+        if self.capacity is not None:
+            self._refill(now)
+            self.level = min(self.capacity, self.level + cost)
+
+    def drain(self, now: float) -> None:
+        if self.capacity is not None:
+            self._refill(now)
+            self.level = min(self.level, 0.0)
+
+
+class CircuitOpen(Exception):
+    """القاطع مفتوح: النداء مرفوض بدون إرسال."""
+
+
+class ModelLimiter:
+    """حالة نموذج واحد: سطلا الطلبات/tokens + تجميد 429 + قاطع الدائرة (آمن مع threads)."""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing: Optional[int] = None  # thread النداء التجريبي
+        self._lock = threading.Lock()
+
+    # ----- pacing -----
+    def acquire(self, cost_tokens: int) -> float:
+        """يحجز طلبًا + cost_tokens ويعيد كم يجب الانتظار قبل الإرسال (بالثواني)."""
+        with self._lock:
+            self._admit()
+            now = time.monotonic()
+            wait = max(
+                self.requests.reserve(1, now),
+                self.tokens.reserve(cost_tokens, now),
+                self.blocked_until - now,
+            )
+            return max(0.0, wait)
+
+    def refund(self, cost_tokens: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refund(1, now)
+            self.tokens.refund(cost_tokens, now)
+
+    def observe(self, headers: Optional[Mapping[str, str]]) -> None:
+        if not headers:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.requests.observe(
+                _header_int(headers, "x-ratelimit-limit-requests"),
+                _header_int(headers, "x-ratelimit-remaining-requests"),
+                now,
+            )
+            self.tokens.observe(
+                _header_int(headers, "x-ratelimit-limit-tokens"),
+                _header_int(headers, "x-ratelimit-remaining-tokens"),
+                now,
+            )
+
+    def throttle(self, headers: Optional[Mapping[str, str]], fallback: float) -> float:
+        """بعد 429: يجمّد النموذج حتى retry-after (أو reset-*، أو fallback) ويعيد المدة."""
+        headers = headers or {}
+        delay = parse_duration(headers.get("retry-after"))
+        if delay is None:
+            resets = [
+                parse_duration(headers.get("x-ratelimit-reset-requests")),
+                parse_duration(headers.get("x-ratelimit-reset-tokens")),
+            ]
+            resets = [r for r in resets if r is not None]
+            delay = max(resets) if resets else fallback
+        now = time.monotonic()
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, now + delay)
+            self.requests.drain(now)
+            self.tokens.drain(now)
+        return delay
+
+    # ----- circuit breaker -----
+    def _admit(self) -> None:
+        if not self.open_until:
+            return
+        me = threading.get_ident()
+        if self.probing == me:
+            return  # محاولات النداء التجريبي نفسه
+        if time.monotonic() < self.open_until or self.probing is not None:
+            raise CircuitOpen(f"LLM circuit open for {self.model}")
+        self.probing = me  # half-open: هذا النداء وحده يختبر الخدمة
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = None
+
+    def record_failure(self) -> None:
+        """نداء فشل نهائيًا (بعد كل محاولاته)."""
+        with self._lock:
+            self.failures += 1
+            if self.probing is not None or self.failures >= BREAKER_THRESHOLD:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN
+                self.probing = None
+
+    def release_probe(self, failed: bool) -> None:
+        """
+        يُستدعى دائمًا عند خروج النداء: إن بقي هذا الـthread هو النداء التجريبي
+        (خرج بدون record_success/record_failure) يُحرَّر — وإلا بقي القاطع مفتوحًا
+        لكل threads الأخرى. failed=True (أُرسل طلب بلا نتيجة) → يُعاد الفتح لمدة cooldown.
+        """
+        with self._lock:
+            if self.probing != threading.get_ident():
+                return
+            self.probing = None
+            if failed:
+                self.failures += 1
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(model, ModelLimiter(model))
+    return limiter
+
+
+def reset_limiters() -> None:
+    global _limiters, _limiters_lock
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_limiters)
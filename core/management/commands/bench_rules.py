@@ -0,0 +1,403 @@
+import csv
+import json
+import platform
+import random
+import re
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import Allergen, Dish, Ingredient, Menu, Section
+from core.dictionary_models import KeywordLexeme, LexiconVersion
+from core.management.commands.seed_allergens_and_ingredients import ALLERGENS, INGREDIENTS
+from core.rules_core import evaluate_dish
+from core.services.allergen_rules import dish_record, generate_for_dishes, generate_per_owner
+from core.services.dish_stream import dish_chunks
+from core.services.lexicon_cache import clear_lexicon_cache, get_lexicon_snapshot
+from core.services.rules_engine import infer_codes_from_text
+from core.services.text_normalize import normalize_text
+
+User = get_user_model()
+
+DISH_NAMES = [
+    "Pizza", "Pasta", "Salat", "Suppe", "Burger", "Wrap", "Bowl", "Toast", "Auflauf", "Curry",
+    "Schnitzel", "Flammkuchen", "Omelett", "Bagel", "Panini", "Risotto", "Lasagne", "Quiche",
+]
+FILLER = [
+    "frisch", "hausgemacht", "mit", "und", "dazu", "serviert", "gegrillt", "knusprig", "scharf",
+    "klein", "gross", "tomaten", "zwiebeln", "paprika", "oliven", "kräutern", "rucola", "spinat",
+]
+NEGATIONS = ["ohne", "kein", "keine", "frei von"]
+JOINERS = ["", "s", "n", "en"]
+
+
+class _QueryCounter:
+    """connection.execute_wrapper: يعدّ الاستعلامات بدون تخزين SQL (آمن لمليون طبق)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the allergen rules engine on synthetic German menus and lexicons "
+        "(built from lexemes_bundle_de.csv + seed_allergens_and_ingredients). "
+        "Reports dishes/sec, p50/p99 per-dish latency, peak memory (tracemalloc) and DB query counts, "
+        "and can save/compare a JSON baseline. All data is rolled back unless --keep."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dishes", type=int, default=10000, help="Synthetic dishes (10k–1M).")
+        parser.add_argument("--lexemes", type=int, default=1000, help="Synthetic lexemes (1k–100k).")
+        parser.add_argument("--regex-ratio", type=float, default=0.02, help="Share of lexemes stored as regex.")
+        parser.add_argument("--owners", type=int, default=1, help="Owners to spread dishes over (>1 adds a per-owner parallel scenario).")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--infer-sample", type=int, default=200, help="Texts timed through infer_codes_from_text.")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--csv", default=str(Path(settings.BASE_DIR) / "lexemes_bundle_de.csv"))
+        parser.add_argument("--scenarios", default="core,dry,batch,write,incremental,infer,parallel",
+                            help="Comma separated subset of: core,dry,batch,write,incremental,infer,parallel")
+        parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc (lower overhead timings).")
+        parser.add_argument("--output", help="Write results JSON to this path.")
+        parser.add_argument("--baseline", help="Compare against a previous results JSON.")
+        parser.add_argument("--max-regression", type=float, default=None,
+                            help="Fail if dishes/sec drops by more than this percentage vs --baseline.")
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic data (default: roll back).")
+
+    # --------------------------------------------------------
+    def handle(self, *args, **opts):
+        self.opts = opts
+        self.rng = random.Random(opts["seed"])
+        self.trace_memory = not opts["no_memory"]
+        scenarios = [s.strip() for s in (opts["scenarios"] or "").split(",") if s.strip()]
+
+        results = {}
+        try:
+            with transaction.atomic():
+                owners = self._build_dataset()
+                clear_lexicon_cache()
+                for name in scenarios:
+                    runner = getattr(self, f"_scenario_{name}", None)
+                    if runner is None:
+                        raise CommandError(f"Unknown scenario: {name}")
+                    res = runner(owners)
+                    if res is not None:
+                        results[name] = res
+                        self._print_row(name, res)
+                if not opts["keep"]:
+                    raise _Rollback()
+        except _Rollback:
+            pass
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "db_vendor": connection.vendor,
+                "dishes": opts["dishes"],
+                "lexemes": opts["lexemes"],
+                "regex_ratio": opts["regex_ratio"],
+                "owners": opts["owners"],
+                "chunk_size": opts["chunk_size"],
+                "seed": opts["seed"],
+                "tracemalloc": self.trace_memory,
+            },
+            "scenarios": results,
+        }
+        if opts["output"]:
+            Path(opts["output"]).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+            self.stdout.write(self.style.SUCCESS(f"Saved results → {opts['output']}"))
+        if opts["baseline"]:
+            self._compare(report, opts["baseline"], opts["max_regression"])
+
+    # --------------------------------------------------------
+    # بيانات اصطناعية
+    # --------------------------------------------------------
+    def _vocabulary(self):
+        """(term, ingredient_name, codes) من CSV + مرادفات seed_allergens_and_ingredients."""
+        vocab = {}
+        path = Path(self.opts["csv"])
+        if path.exists():
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    term = (row.get("term") or "").strip()
+                    if not term or term.startswith("#"):
+                        continue
+                    codes = tuple(c for c in re.split(r"[,\s]+", (row.get("allergen_codes") or "").upper()) if c)
+                    vocab.setdefault(normalize_text(term), (term, (row.get("ingredient_name") or "").strip(), codes))
+        for name, codes, synonyms in INGREDIENTS:
+            for syn in synonyms:
+                vocab.setdefault(normalize_text(syn), (syn, name, tuple(codes)))
+        return [v for k, v in vocab.items() if k]
+
+    def _build_dataset(self):
+        opts, rng = self.opts, self.rng
+        t0 = time.perf_counter()
+
+        for code, label in ALLERGENS:
+            Allergen.objects.get_or_create(code=code, defaults={"label_de": label})
+        code_ids = dict(Allergen.objects.values_list("code", "id"))
+
+        vocab = self._vocabulary()
+        if not vocab:
+            raise CommandError("Empty vocabulary (CSV missing and no seed ingredients).")
+
+        stamp = int(time.time())
+        owners = [
+            User.objects.create(username=f"bench_{stamp}_{i}", email=f"bench_{stamp}_{i}@example.invalid")
+            for i in range(max(1, opts["owners"]))
+        ]
+
+        # ---- lexemes: مصطلحات القاموس + مركّبات ألمانية (a + وصلة + b) حتى العدد المطلوب
+        target = max(1, opts["lexemes"])
+        terms = {}
+        for term, _, codes in vocab:
+            terms.setdefault(normalize_text(term), (term, codes))
+        attempts = 0
+        while len(terms) < target and attempts < target * 20:
+            attempts += 1
+            a, b = rng.choice(vocab), rng.choice(vocab)
+            if " " in a[0] or " " in b[0]:
+                continue
+            term = f"{a[0]}{rng.choice(JOINERS)}{b[0]}"
+            terms.setdefault(normalize_text(term), (term, tuple(sorted(set(a[2]) | set(b[2])))))
+        term_items = list(terms.items())[:target]
+        regex_every = int(1 / opts["regex_ratio"]) if opts["regex_ratio"] > 0 else 0
+
+        owner = owners[0]
+        lexemes = []
+        for i, (norm, (term, _codes)) in enumerate(term_items):
+            is_regex = bool(regex_every) and i % regex_every == 0
+            raw = rf"\b{re.escape(norm)}(e|en|n|s)?\b" if is_regex else term
+            lexemes.append(KeywordLexeme(
+                owner=owner, lang="de", term=raw, normalized_term=normalize_text(raw) if not is_regex else norm,
+                is_regex=is_regex, is_active=True,
+            ))
+        KeywordLexeme.objects.bulk_create(lexemes, batch_size=5000, ignore_conflicts=True)
+        lx_ids = dict(KeywordLexeme.objects.filter(owner=owner, lang="de").values_list("normalized_term", "id"))
+        through = KeywordLexeme.allergens.through
+        links = [
+            through(keywordlexeme_id=lx_ids[norm], allergen_id=code_ids[c])
+            for norm, (_term, codes) in term_items
+            if norm in lx_ids
+            for c in codes
+            if c in code_ids
+        ]
+        through.objects.bulk_create(links, batch_size=5000, ignore_conflicts=True)
+
+        # ---- مكوّنات لكل مالك (من seed)
+        ing_ids = {}
+        for o in owners:
+            ings = [Ingredient(owner=o, name=name, synonyms=list(syns)) for name, _codes, syns in INGREDIENTS]
+            Ingredient.objects.bulk_create(ings, batch_size=1000)
+            ing_ids[o.id] = list(Ingredient.objects.filter(owner=o).values_list("id", flat=True))
+            by_name = dict(Ingredient.objects.filter(owner=o).values_list("name", "id"))
+            Ingredient.allergens.through.objects.bulk_create([
+                Ingredient.allergens.through(ingredient_id=by_name[name], allergen_id=code_ids[c])
+                for name, codes, _syns in INGREDIENTS
+                for c in codes
+                if c in code_ids and name in by_name
+            ], ignore_conflicts=True)
+        LexiconVersion.bump(*(LexiconVersion.scope_for_owner(o.id) for o in owners), LexiconVersion.GLOBAL_SCOPE)
+
+        # ---- أطباق
+        plain_terms = [t for _n, (t, _c) in term_items]
+        sections = []
+        for o in owners:
+            menu = Menu.objects.create(user=o, name="Bench")
+            sections.append(Section.objects.create(menu=menu, user=o, name="Bench"))
+
+        total = max(1, opts["dishes"])
+        batch = []
+        for i in range(total):
+            words = [rng.choice(plain_terms) for _ in range(rng.randint(2, 6))]
+            words += [rng.choice(FILLER) for _ in range(rng.randint(1, 4))]
+            rng.shuffle(words)
+            if rng.random() < 0.1:
+                words.insert(rng.randrange(len(words) + 1), f"{rng.choice(NEGATIONS)} {rng.choice(plain_terms)}")
+            batch.append(Dish(
+                section=sections[i % len(sections)],
+                name=f"{rng.choice(DISH_NAMES)} {rng.choice(plain_terms)}",
+                description=", ".join(words),
+            ))
+            if len(batch) >= 5000:
+                Dish.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Dish.objects.bulk_create(batch)
+
+        # 20% من الأطباق مرتبطة بمكوّنات
+        dish_through = Dish.ingredients.through
+        links = []
+        for dish_id, owner_id in Dish.objects.filter(section__in=sections).values_list("id", "section__menu__user_id").iterator():
+            if rng.random() < 0.2:
+                for ing_id in rng.sample(ing_ids[owner_id], k=rng.randint(1, 3)):
+                    links.append(dish_through(dish_id=dish_id, ingredient_id=ing_id))
+            if len(links) >= 5000:
+                dish_through.objects.bulk_create(links, ignore_conflicts=True)
+                links = []
+        if links:
+            dish_through.objects.bulk_create(links, ignore_conflicts=True)
+
+        self.stdout.write(
+            f"Dataset: owners={len(owners)} lexemes={len(lexemes)} (regex={sum(1 for l in lexemes if l.is_regex)}) "
+            f"dishes={total} built in {time.perf_counter() - t0:.1f}s"
+        )
+        return owners
+
+    # --------------------------------------------------------
+    # قياس
+    # --------------------------------------------------------
+    def _measure(self, fn):
+        """يشغّل fn ويقيس الزمن + الاستعلامات + ذروة الذاكرة؛ fn ترجّع (عدد الأطباق، زمن كل طبق أو None)."""
+        counter = _QueryCounter()
+        if self.trace_memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            n, latencies = fn()
+        elapsed = time.perf_counter() - t0
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        res = {
+            "dishes": n,
+            "seconds": round(elapsed, 4),
+            "dishes_per_sec": round(n / elapsed, 1) if elapsed > 0 else None,
+            "queries": counter.count,
+            "peak_memory_kb": round(peak / 1024, 1) if peak is not None else None,
+            "p50_ms": None,
+            "p99_ms": None,
+        }
+        if latencies:
+            qs = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+            res["p50_ms"] = round(qs[49] * 1000, 4)
+            res["p99_ms"] = round(qs[98] * 1000, 4)
+        return res
+
+    def _owner_qs(self, owner):
+        return Dish.objects.filter(section__menu__user=owner)
+
+    def _scenario_core(self, owners):
+        """rules_core فقط (بدون ORM داخل التوقيت لكل طبق) → زمن كل طبق."""
+        owner = owners[0]
+        rules = get_lexicon_snapshot(owner_id=owner.id, lang="de").rules
+
+        def run():
+            lat = []
+            for chunk in dish_chunks(self._owner_qs(owner), self.opts["chunk_size"]):
+                for d in chunk:
+                    rec = dish_record(d)
+                    t = time.perf_counter()
+                    evaluate_dish(rec, rules)
+                    lat.append(time.perf_counter() - t)
+            return len(lat), lat
+
+        return self._measure(run)
+
+    def _generate(self, owners, **kwargs):
+        owner = owners[0]
+
+        def run():
+            res = generate_for_dishes(
+                self._owner_qs(owner), owner_id=owner.id, lang="de",
+                chunk_size=self.opts["chunk_size"], include_details=False, **kwargs,
+            )
+            return res["processed"], None
+
+        return self._measure(run)
+
+    def _scenario_dry(self, owners):
+        return self._generate(owners, dry_run=True)
+
+    def _scenario_batch(self, owners):
+        # مثل dry لكن بمطابقة الدفعة (posting map) بدل automaton لكل طبق
+        return self._generate(owners, dry_run=True, batch_matching=True)
+
+    def _scenario_write(self, owners):
+        return self._generate(owners, dry_run=False)
+
+    def _scenario_incremental(self, owners):
+        # بعد write: البصمات محفوظة → يقيس كلفة تشغيل ليلي بلا تعديلات
+        return self._generate(owners, dry_run=False, incremental=True)
+
+    def _scenario_infer(self, owners):
+        owner = owners[0]
+        texts = list(
+            self._owner_qs(owner).order_by("id").values_list("name", "description")[: self.opts["infer_sample"]]
+        )
+
+        def run():
+            lat = []
+            for name, desc in texts:
+                t = time.perf_counter()
+                infer_codes_from_text(owner.id, f"{name} {desc or ''}", "de")
+                lat.append(time.perf_counter() - t)
+            return len(lat), lat
+
+        return self._measure(run)
+
+    def _scenario_parallel(self, owners):
+        if len(owners) < 2:
+            return None
+
+        def run():
+            res = generate_per_owner(
+                Dish.objects.filter(section__menu__user__in=owners), lang="de", parallel=True,
+                dry_run=True, include_details=False, chunk_size=self.opts["chunk_size"],
+            )
+            return res["processed"], None
+
+        return self._measure(run)
+
+    # --------------------------------------------------------
+    # تقرير
+    # --------------------------------------------------------
+    def _print_row(self, name, r):
+        lat = f" p50={r['p50_ms']}ms p99={r['p99_ms']}ms" if r["p50_ms"] is not None else ""
+        mem = f" peak={r['peak_memory_kb']}KB" if r["peak_memory_kb"] is not None else ""
+        self.stdout.write(
+            f"  {name:<12} dishes={r['dishes']:<8} {r['dishes_per_sec']} dishes/s "
+            f"queries={r['queries']}{lat}{mem} ({r['seconds']}s)"
+        )
+
+    def _compare(self, report, baseline_path, max_regression):
+        try:
+            baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+        except Exception as e:
+            raise CommandError(f"Cannot read baseline {baseline_path}: {e}")
+
+        regressions = []
+        self.stdout.write(f"Compared with {baseline_path}:")
+        for name, cur in report["scenarios"].items():
+            old = (baseline.get("scenarios") or {}).get(name)
+            if not old or not old.get("dishes_per_sec") or not cur.get("dishes_per_sec"):
+                continue
+            delta = (cur["dishes_per_sec"] - old["dishes_per_sec"]) / old["dishes_per_sec"] * 100
+            line = f"  {name:<12} dishes/s {old['dishes_per_sec']} → {cur['dishes_per_sec']} ({delta:+.1f}%)"
+            if old.get("queries") is not None and cur.get("queries") != old.get("queries"):
+                line += f" queries {old['queries']} → {cur['queries']}"
+            if max_regression is not None and delta < -abs(max_regression):
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"Throughput regression beyond {max_regression}% in: {', '.join(regressions)}")
@@ -6,6 +6,7 @@ from django.db import transaction
 from core.models import Allergen, Ingredient
 from core.dictionary_models import KeywordLexeme
 from core.services.allergen_rules import normalize_text as _norm
+from core.services.regex_guard import check_regex
 
 User = get_user_model()
 
@@ -59,6 +60,13 @@ class Command(BaseCommand):
                     skipped += 1
                     continue
 
+                if is_regex:
+                    verdict = check_regex(term)
+                    if not verdict.ok:
+                        self.stderr.write(self.style.WARNING(f"Skipping regex {term!r}: {verdict.status} ({verdict.reason})"))
+                        skipped += 1
+                        continue
+
                 # upsert lexeme بمفتاح (owner, lang, normalized_term, is_regex)
                 norm = _norm(term)
                 lx = KeywordLexeme.objects.filter(owner_id=owner_id, lang__iexact=lang, normalized_term=norm, is_regex=is_regex).first()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Dish, DishToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the DishToken inverted index (normalized name+description tokens per dish). "
+        "Needed once after migrating, and after bulk edits that bypass Dish.save()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Dishes per transaction.")
+
+    def handle(self, *args, **opts):
+        batch_size = max(1, int(opts["batch_size"]))
+        dishes = tokens = 0
+        last = 0
+        while True:
+            rows = list(
+                Dish.objects.filter(pk__gt=last)
+                .order_by("pk")
+                .values_list("pk", "name", "description")[:batch_size]
+            )
+            if not rows:
+                break
+            ids = [r[0] for r in rows]
+            new = [
+                DishToken(dish_id=pk, token=t)
+                for pk, name, desc in rows
+                for t in sorted(DishToken.tokens_for(name, desc))
+            ]
+            with transaction.atomic():
+                DishToken.objects.filter(dish_id__in=ids).delete()
+                DishToken.objects.bulk_create(new, batch_size=5000)
+            dishes += len(rows)
+            tokens += len(new)
+            last = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"DishToken index rebuilt: dishes={dishes}, tokens={tokens}"))
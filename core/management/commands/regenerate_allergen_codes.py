@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Dish
+from core.services.allergen_rules import DEFAULT_WRITE_CHUNK_SIZE, generate_for_dishes, parse_resume_token
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the allergen rules engine over all dishes, one owner (dictionary) at a time. "
+        "With --incremental only dishes whose content fingerprint changed are recomputed "
+        "(intended for nightly runs). Writes are committed per chunk; an interrupted run prints "
+        "a token for --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, action="append", help="Owner (user) id; repeatable. Default: all owners.")
+        parser.add_argument("--lang", default="de")
+        parser.add_argument("--incremental", action="store_true", help="Skip dishes whose fingerprint is unchanged.")
+        parser.add_argument("--force", action="store_true", help="Override manual codes and ignore fingerprints.")
+        parser.add_argument("--dry-run", action="store_true", help="Compute without writing.")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_WRITE_CHUNK_SIZE)
+        parser.add_argument("--timings", action="store_true", help="Print per-stage timings and counters per owner.")
+        parser.add_argument("--no-memo", action="store_true", help="Evaluate every dish even if an identical one was already evaluated.")
+        parser.add_argument("--persist-memo", action="store_true", help="Reuse/store results for identical dishes in the RuleResultMemo table.")
+        parser.add_argument("--batch-matching", action="store_true", help="Match plain terms per chunk through a token posting map (large reindexes).")
+        parser.add_argument("--resume", metavar="TOKEN", help="Continue an interrupted write run after its last committed chunk.")
+
+    def handle(self, *args, **opts):
+        owners = opts.get("owner") or list(
+            Dish.objects.exclude(section__menu__user__isnull=True)
+            .order_by()
+            .values_list("section__menu__user_id", flat=True)
+            .distinct()
+        )
+        if not owners:
+            raise CommandError("No dishes found.")
+        owners = sorted(set(owners))
+
+        resume = opts.get("resume")
+        resume_owner = None
+        if resume:
+            try:
+                resume_owner, _ = parse_resume_token(resume)
+            except ValueError as e:
+                raise CommandError(str(e))
+            if resume_owner not in owners:
+                raise CommandError(f"Resume token owner {resume_owner} is not among the selected owners.")
+            owners = owners[owners.index(resume_owner):]
+
+        self.last_token = None
+        totals = {"processed": 0, "changed": 0, "skipped": 0, "unchanged_fingerprint": 0, "failed": 0}
+        for owner_id in owners:
+            try:
+                res = self._run_owner(owner_id, opts, resume if owner_id == resume_owner else None)
+            except (Exception, KeyboardInterrupt):
+                if self.last_token:
+                    self.stderr.write(f"Interrupted. Continue with --resume {self.last_token}")
+                raise
+            for k in totals:
+                totals[k] += int(res.get(k, 0))
+            self.stdout.write(
+                f"  owner={owner_id}: processed={res['processed']} changed={res['changed']} "
+                f"unchanged_fingerprint={res['unchanged_fingerprint']} skipped_manual={res['skipped']} "
+                f"failed={res['failed']}"
+            )
+            for f in res.get("failed_dishes", []):
+                self.stderr.write(f"    failed dish={f['dish_id']}: {f['error']}")
+            if opts["timings"]:
+                self._print_timings(res["timings"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done{' (dry-run)' if opts['dry_run'] else ''}. owners={len(owners)}, "
+            + ", ".join(f"{k}={v}" for k, v in totals.items())
+        ))
+
+    def _checkpoint(self, token):
+        self.last_token = token
+
+    def _run_owner(self, owner_id, opts, resume_from):
+        return generate_for_dishes(
+            Dish.objects.filter(section__menu__user_id=owner_id),
+            owner_id=owner_id,
+            lang=(opts["lang"] or "de").lower(),
+            force=bool(opts["force"]),
+            dry_run=bool(opts["dry_run"]),
+            include_details=False,
+            chunk_size=opts["chunk_size"],
+            incremental=bool(opts["incremental"]),
+            timings=True if opts["timings"] else None,
+            memo=not opts["no_memo"],
+            persist_memo=True if opts["persist_memo"] else None,
+            batch_matching=True if opts["batch_matching"] else None,
+            resume_from=resume_from,
+            checkpoint=self._checkpoint,
+        )
+
+    def _print_timings(self, timings):
+        self.stdout.write(f"    total={timings['total_ms']}ms")
+        for name, st in sorted(timings["stages"].items(), key=lambda kv: -kv[1]["ms"]):
+            queries = f" queries={st['queries']}" if "queries" in st else ""
+            self.stdout.write(f"    {name:<22} {st['ms']:>10}ms calls={st['calls']}{queries}")
+        self.stdout.write("    " + ", ".join(f"{k}={v}" for k, v in timings["counters"].items()))
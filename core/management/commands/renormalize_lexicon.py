@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from core.dictionary_models import KeywordLexeme, NegationCue, LexiconVersion
+from core.services.text_normalize import NORMALIZER_VERSION, normalize_many
+
+# نخزّن نسخة المُطبِّع المطبّقة على DB في نفس جدول الإصدارات
+NORMALIZER_SCOPE = "normalizer"
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-normalize KeywordLexeme.normalized_term and NegationCue.normalized_cue in bulk "
+        "when services/text_normalize.NORMALIZER_VERSION changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Run even if the stored normalizer version is current.")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk_update batch.")
+
+    def handle(self, *args, **opts):
+        force = bool(opts["force"])
+        dry_run = bool(opts["dry_run"])
+        batch_size = max(1, int(opts["batch_size"]))
+
+        stored = (
+            LexiconVersion.objects.filter(scope=NORMALIZER_SCOPE).values_list("version", flat=True).first() or 0
+        )
+        if stored >= NORMALIZER_VERSION and not force:
+            self.stdout.write(self.style.SUCCESS(
+                f"Normalizer up to date (stored={stored}, current={NORMALIZER_VERSION}). Use --force to re-run."
+            ))
+            return
+
+        lex_changed, lex_conflicts = self._renormalize_lexemes(batch_size, dry_run)
+        cue_changed = self._renormalize_cues(batch_size, dry_run)
+
+        for c in lex_conflicts[:20]:
+            self.stdout.write(self.style.WARNING(
+                f"  conflict: lexeme id={c[0]} term={c[1]!r} → {c[2]!r} already taken; left unchanged"
+            ))
+        if len(lex_conflicts) > 20:
+            self.stdout.write(self.style.WARNING(f"  ... {len(lex_conflicts) - 20} more conflicts"))
+
+        if not dry_run:
+            LexiconVersion.objects.update_or_create(scope=NORMALIZER_SCOPE, defaults={"version": NORMALIZER_VERSION})
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Renormalize {'(dry-run) ' if dry_run else ''}done. lexemes_changed={lex_changed}, "
+            f"lexeme_conflicts={len(lex_conflicts)}, cues_changed={cue_changed}, "
+            f"version {stored} → {NORMALIZER_VERSION}"
+        ))
+
+    # --------------------------------------------------------
+    def _renormalize_lexemes(self, batch_size: int, dry_run: bool):
+        rows = list(
+            KeywordLexeme.objects
+            .order_by("id")
+            .values_list("id", "owner_id", "lang", "is_regex", "term", "normalized_term")
+        )
+        new_norms = normalize_many(r[4] or "" for r in rows)
+
+        # القيد الفريد (owner, lang, normalized_term, is_regex): الصفوف غير المتغيّرة تحجز مفاتيحها أولًا
+        taken = {
+            (owner_id, lang, old, is_regex)
+            for (_, owner_id, lang, is_regex, _, old), new in zip(rows, new_norms)
+            if old == new
+        }
+        updates = []
+        conflicts = []
+        for (pk, owner_id, lang, is_regex, term, old), new in zip(rows, new_norms):
+            if old == new:
+                continue
+            key = (owner_id, lang, new, is_regex)
+            if key in taken:
+                conflicts.append((pk, term, new))
+                continue
+            taken.add(key)
+            updates.append(KeywordLexeme(pk=pk, normalized_term=new))
+
+        if updates and not dry_run:
+            self._bulk_update(KeywordLexeme, updates, ["normalized_term"], batch_size)
+        return len(updates), conflicts
+
+    def _renormalize_cues(self, batch_size: int, dry_run: bool) -> int:
+        rows = list(NegationCue.objects.order_by("id").values_list("id", "cue", "normalized_cue"))
+        new_norms = normalize_many(r[1] or "" for r in rows)
+        updates = [
+            NegationCue(pk=pk, normalized_cue=new)
+            for (pk, _, old), new in zip(rows, new_norms)
+            if old != new
+        ]
+        if updates and not dry_run:
+            self._bulk_update(NegationCue, updates, ["normalized_cue"], batch_size)
+        return len(updates)
+
+    def _bulk_update(self, model, objs, fields, batch_size: int) -> None:
+        for i in range(0, len(objs), batch_size):
+            chunk = objs[i:i + batch_size]
+            try:
+                with transaction.atomic():
+                    model.objects.bulk_update(chunk, fields)
+            except IntegrityError as e:
+                self.stdout.write(self.style.ERROR(
+                    f"  {model.__name__}: batch starting at id={chunk[0].pk} failed ({e}); skipped"
+                ))
@@ -23,6 +23,7 @@ from django.contrib.auth import get_user_model
 
 from core.dictionary_models import KeywordLexeme, normalize_text
 from core.models import Allergen, Ingredient
+from core.services.regex_guard import check_regex
 
 DEFAULT_LANG = "de"
 
@@ -175,6 +176,12 @@ class Command(BaseCommand):
                 if not term:
                     continue
 
+                if is_regex:
+                    verdict = check_regex(term)
+                    if not verdict.ok:
+                        self.stderr.write(self.style.WARNING(f"Skipping regex {term!r}: {verdict.status} ({verdict.reason})"))
+                        continue
+
                 norm = normalize_text(term)
 
                 # ============ Ingredient (اختياري) ============
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_alter_dishallergen_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LexiconVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=32, unique=True, verbose_name='Scope')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Version')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Lexicon Version',
+                'verbose_name_plural': 'Lexicon Versions',
+            },
+        ),
+    ]
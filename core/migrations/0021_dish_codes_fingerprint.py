@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_lexiconversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='codes_fingerprint',
+            field=models.CharField(blank=True, default='', help_text='بصمة مدخلات آخر توليد (النص المُطبّع + المكوّنات + الإضافات + إصدار القاموس).', max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_dish_codes_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DishToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='text_tokens', to='core.dish')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'dish'], name='core_dishto_token_b26f4f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dish', 'token'), name='uniq_dish_token')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_dishtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleResultMemo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('owner_id', models.BigIntegerField(blank=True, null=True)),
+                ('lang', models.CharField(max_length=8)),
+                ('lexicon_version', models.CharField(max_length=32)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Rule Result Memo',
+                'verbose_name_plural': 'Rule Result Memos',
+                'indexes': [models.Index(fields=['owner_id', 'lang', 'lexicon_version'], name='core_rulere_owner_i_881329_idx')],
+            },
+        ),
+    ]
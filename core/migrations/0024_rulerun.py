@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_ruleresultmemo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.BigIntegerField(blank=True, help_text='قاموس المالك؛ فارغ = كل مالك بقاموسه.', null=True)),
+                ('lang', models.CharField(default='de', max_length=8)),
+                ('dry_run', models.BooleanField(default=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('dry_run', 'Dry run'), ('written', 'Written'), ('applying', 'Applying'), ('applied', 'Applied'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('stats', models.JSONField(blank=True, default=dict)),
+                ('timings', models.JSONField(blank=True, null=True)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('apply_stats', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rule_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RuleRunItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dish_id', models.BigIntegerField()),
+                ('name', models.CharField(blank=True, default='', max_length=255)),
+                ('before', models.CharField(blank=True, default='', max_length=255)),
+                ('after', models.CharField(blank=True, default='', max_length=255)),
+                ('action', models.CharField(max_length=32)),
+                ('fingerprint', models.CharField(blank=True, default='', max_length=64)),
+                ('rows', models.JSONField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.rulerun')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rulerun',
+            index=models.Index(fields=['user', 'created_at'], name='core_ruleru_user_id_dd3e6c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rulerun',
+            index=models.Index(fields=['status'], name='core_ruleru_status_6f59bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rulerunitem',
+            index=models.Index(fields=['run', 'id'], name='core_ruleru_run_id_dc7c3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rulerunitem',
+            index=models.Index(fields=['run', 'action', 'id'], name='core_ruleru_run_id_adbd51_idx'),
+        ),
+    ]
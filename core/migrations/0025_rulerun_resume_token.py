@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_rulerun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rulerun',
+            name='resume_token',
+            field=models.CharField(blank=True, default='', help_text='آخر دفعة مكتوبة (commit) في وضع الكتابة؛ تُمرَّر كـresume_token لإكمال تشغيل منقطع.', max_length=64),
+        ),
+    ]
@@ -184,6 +184,10 @@ class Dish(models.Model):
         default=list, blank=True, help_text="أرقام إضافية على مستوى الطبق مثل [1,3]"
     )
     codes_updated_at = models.DateTimeField(null=True, blank=True)
+    codes_fingerprint = models.CharField(
+        max_length=64, blank=True, default='',
+        help_text="بصمة مدخلات آخر توليد (النص المُطبّع + المكوّنات + الإضافات + إصدار القاموس)."
+    )
 
     class Meta:
         indexes = [
@@ -323,6 +327,144 @@ class MenuDisplaySettings(models.Model):
         return f'DisplaySettings(menu={self.menu_id})'
 
 
+# ===========================
+# فهرس عكسي: كلمة (نص مُطبّع) → أطباق
+# ===========================
+class DishToken(models.Model):
+    """
+    كلمات اسم+وصف الطبق بعد normalize_text (صف لكل كلمة مميّزة).
+    يُستخدم لمعرفة الأطباق التي قد يتأثّر ناتجها بتعديل مصطلح في القاموس
+    دون مسح كل الأطباق. يُحدَّث عند حفظ الطبق؛ البناء الكامل عبر rebuild_dish_token_index.
+    """
+    MAX_TOKEN_LEN = 64
+
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE, related_name="text_tokens")
+    token = models.CharField(max_length=MAX_TOKEN_LEN)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["dish", "token"], name="uniq_dish_token"),
+        ]
+        indexes = [
+            models.Index(fields=["token", "dish"]),
+        ]
+
+    def __str__(self):
+        return f"{self.token} → dish {self.dish_id}"
+
+    @classmethod
+    def tokens_for(cls, name, description) -> set:
+        from core.services.text_normalize import normalize_text
+
+        text_norm = normalize_text(" ".join(filter(None, [name or "", description or ""])))
+        return {t for t in text_norm.split() if len(t) <= cls.MAX_TOKEN_LEN}
+
+    @classmethod
+    def sync_for_dish(cls, dish: "Dish") -> None:
+        """يطابق صفوف الطبق مع نصّه الحالي (إضافة/حذف الفرق فقط)."""
+        wanted = cls.tokens_for(dish.name, dish.description)
+        existing = set(cls.objects.filter(dish_id=dish.pk).values_list("token", flat=True))
+        stale = existing - wanted
+        if stale:
+            cls.objects.filter(dish_id=dish.pk, token__in=stale).delete()
+        fresh = wanted - existing
+        if fresh:
+            cls.objects.bulk_create(
+                [cls(dish_id=dish.pk, token=t) for t in fresh],
+                ignore_conflicts=True,
+            )
+
+
+@receiver(post_save, sender=Dish)
+def sync_dish_tokens_on_save(sender, instance, update_fields=None, **kwargs):
+    """إعادة فهرسة كلمات الطبق عند تغيّر الاسم/الوصف فقط."""
+    if update_fields is not None and not ({"name", "description"} & set(update_fields)):
+        return
+    DishToken.sync_for_dish(instance)
+
+
+# ===========================
+# سجلات تشغيل محرك القواعد (قابلة للتصفّح والتطبيق لاحقًا)
+# ===========================
+class RuleRun(models.Model):
+    """
+    تشغيل واحد لمحرك القواعد: المعاملات + العدّادات + الأزمنة،
+    والنتائج لكل طبق في RuleRunItem (كلها، بدون حدّ ITEMS_LIMIT للاستجابة).
+    dry run مسجّل يمكن تطبيقه لاحقًا (apply) بالقرارات المخزّنة بدون إعادة حساب.
+    """
+    STATUS_RUNNING = "running"
+    STATUS_DRY_RUN = "dry_run"
+    STATUS_WRITTEN = "written"
+    STATUS_APPLYING = "applying"
+    STATUS_APPLIED = "applied"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DRY_RUN, "Dry run"),
+        (STATUS_WRITTEN, "Written"),
+        (STATUS_APPLYING, "Applying"),
+        (STATUS_APPLIED, "Applied"),
+        (STATUS_FAILED, "Failed"),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="rule_runs"
+    )
+    owner_id = models.BigIntegerField(null=True, blank=True, help_text="قاموس المالك؛ فارغ = كل مالك بقاموسه.")
+    lang = models.CharField(max_length=8, default="de")
+    dry_run = models.BooleanField(default=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    params = models.JSONField(default=dict, blank=True)
+    stats = models.JSONField(default=dict, blank=True)
+    timings = models.JSONField(null=True, blank=True)
+    item_count = models.PositiveIntegerField(default=0)
+    apply_stats = models.JSONField(null=True, blank=True)
+    resume_token = models.CharField(
+        max_length=64, blank=True, default='',
+        help_text="آخر دفعة مكتوبة (commit) في وضع الكتابة؛ تُمرَّر كـresume_token لإكمال تشغيل منقطع."
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["user", "created_at"]),
+            models.Index(fields=["status"]),
+        ]
+
+    def __str__(self):
+        return f"RuleRun({self.pk}, {self.status}, items={self.item_count})"
+
+
+class RuleRunItem(models.Model):
+    """
+    ناتج طبق واحد في RuleRun. dish_id بدون FK (حذف الطبق لا يمسّ السجل).
+    rows: مصادر صفوف DishAllergen المحسوبة {code: [source, confidence, rationale]}
+    — تُخزَّن فقط للقرارات التي تغيّر الطبق (ليكتبها apply كما هي).
+    """
+    run = models.ForeignKey(RuleRun, on_delete=models.CASCADE, related_name="items")
+    dish_id = models.BigIntegerField()
+    name = models.CharField(max_length=255, blank=True, default='')
+    before = models.CharField(max_length=255, blank=True, default='')
+    after = models.CharField(max_length=255, blank=True, default='')
+    action = models.CharField(max_length=32)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    rows = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["run", "id"]),
+            models.Index(fields=["run", "action", "id"]),
+        ]
+
+    def __str__(self):
+        return f"RuleRunItem(run={self.run_id}, dish={self.dish_id}, {self.action})"
+
+
 # ===========================
 # إشارات إدارة صور الأطباق
 # ===========================
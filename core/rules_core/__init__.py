@@ -0,0 +1,38 @@
+# core/rules_core/__init__.py
+# -----------------------------------------------------------
+# نواة محرك القواعد بدون ORM:
+#   بيانات بسيطة تدخل (RulesSnapshot + DishRecord) ونتائج بسيطة تخرج (DishEvaluation)
+# تُستخدم من allergen_rules / rules_engine (محوّلات ORM) ومن العمليات الفرعية والقياس.
+# -----------------------------------------------------------
+
+from core.rules_core.memo import EvaluationMemo, memo_key
+from core.rules_core.metrics import StageTimer
+from core.rules_core.types import DishEvaluation, DishRecord, IngredientRecord, RulesSnapshot
+from core.rules_core.engine import (
+    collect_from_ingredients,
+    collect_from_lexicon,
+    compile_lexeme_patterns,
+    evaluate_dish,
+    evaluate_many,
+    format_codes,
+    infer_letters,
+    is_negated,
+)
+
+__all__ = [
+    "DishEvaluation",
+    "DishRecord",
+    "EvaluationMemo",
+    "IngredientRecord",
+    "RulesSnapshot",
+    "StageTimer",
+    "collect_from_ingredients",
+    "collect_from_lexicon",
+    "compile_lexeme_patterns",
+    "evaluate_dish",
+    "evaluate_many",
+    "format_codes",
+    "infer_letters",
+    "is_negated",
+    "memo_key",
+]
@@ -0,0 +1,403 @@
+# core/rules_core/engine.py
+# -----------------------------------------------------------
+# محرك القواعد الصِّرف: DishRecord + RulesSnapshot → DishEvaluation
+#   - أكواد المكوّنات + extra_allergens/extra_additives
+#   - مطابقة القاموس (Aho-Corasick + كلمات مركّبة + تقريب إملائي + regex) مع النفي بنوافذ الكلمات
+#   - infer_letters: المطابقة المبسّطة (مرادفات + lexemes) لـrules_engine
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import re
+from dataclasses import replace
+from time import perf_counter
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from core.rules_core.metrics import StageTimer
+from core.rules_core.types import DishEvaluation, DishRecord, RulesSnapshot
+from core.services.lexicon_matcher import CompiledLexicon, LexemeEntry, LexiconHit
+from core.services.negation import NegationRules, NegationScope
+from core.services.regex_guard import check_regex, compile_regex
+from core.services.text_normalize import normalize_text
+
+
+# -----------------------
+# تنسيق الأكواد
+# -----------------------
+def format_codes(letters: Iterable[str], numbers: Iterable[int]) -> str:
+    letters_part = ",".join(sorted({c for c in letters if c}))
+    numbers_part = ",".join(str(n) for n in sorted(set(numbers)))
+    if letters_part and numbers_part:
+        return f"({letters_part},{numbers_part})"
+    if letters_part:
+        return f"({letters_part})"
+    if numbers_part:
+        return f"({numbers_part})"
+    return ""
+
+
+# -----------------------
+# تجميع من المكوّنات
+# -----------------------
+def collect_from_ingredients(record: DishRecord) -> Tuple[Set[str], Set[int], Dict[str, List[str]]]:
+    """
+    يرجّع:
+      - letters: أكواد A..Z
+      - numbers: إضافات رقمية
+      - provenance_ing: خريطة code -> قائمة أسباب نصيّة (Ingredient → Code)
+    """
+    letters: Set[str] = set()
+    numbers: Set[int] = set()
+    provenance_ing: Dict[str, List[str]] = {}
+
+    for ing in record.ingredients:
+        ing_name = (ing.name or "").strip() or "Ingredient"
+        for c in ing.letters:
+            c = (c or "").strip().upper()
+            if c:
+                letters.add(c)
+                provenance_ing.setdefault(c, []).append(f'Ingredient: {ing_name} → {c}')
+        numbers.update(ing.numbers)
+
+    for c in record.extra_allergens:
+        c = (str(c) or "").strip().upper()
+        if c:
+            letters.add(c)
+            provenance_ing.setdefault(c, []).append("Dish.extra_allergens → " + c)
+
+    numbers.update(record.extra_additives)
+    return letters, numbers, provenance_ing
+
+
+# -----------------------
+# مطابقة القاموس
+# -----------------------
+class _TimedScope:
+    """غلاف NegationScope يقيس زمن قرارات النفي ويعدّها (فقط عند تمرير timer)."""
+
+    __slots__ = ("_scope", "_timer")
+
+    def __init__(self, scope: NegationScope, timer: StageTimer) -> None:
+        self._scope = scope
+        self._timer = timer
+
+    def is_negated(self, start: int, end: int) -> bool:
+        t0 = perf_counter()
+        negated = self._scope.is_negated(start, end)
+        self._timer.add("negation", perf_counter() - t0, calls=0)
+        self._timer.incr("negation_checks")
+        return negated
+
+
+def _uncovered_words(text_norm: str, spans: List[Tuple[int, int]]) -> Iterator[Tuple[int, int]]:
+    """مدى كل كلمة (بين المسافات) لا تقع داخل أي مطابقة كاملة (spans مرتّبة وغير متداخلة)."""
+    i, n, k = 0, len(text_norm), 0
+    while i < n:
+        end = text_norm.find(" ", i)
+        if end == -1:
+            end = n
+        while k < len(spans) and spans[k][1] < end:
+            k += 1
+        if not (k < len(spans) and spans[k][0] <= i):
+            yield i, end
+        i = end + 1
+
+
+def collect_from_lexicon(
+    text_norm: str,
+    lexicon: CompiledLexicon,
+    negation: NegationRules,
+    timer: Optional[StageTimer] = None,
+    matches: Optional[Sequence[LexiconHit]] = None,
+) -> Tuple[Set[str], Set[int], Dict, Dict[str, List[str]]]:
+    """
+    يرجّع:
+      - letters, numbers
+      - details: {"lexeme_hits":[{term, negated, lexeme_id}]}
+      - provenance_lex: خريطة code -> قائمة أسباب نصيّة (Lexeme/Ingredient → Code)
+    النفي: فهرسة عبارات النفي مرة واحدة للنص، ثم قرار O(1) لكل مطابقة.
+    المصطلح منفيّ فقط إذا كانت كل مواضعه داخل نافذة نفي.
+    الكلمات المركّبة (lexicon.compounds): "sesambroetchen" → sesam بمدى الكلمة كلها،
+    ويحمل الـhit مفتاح "compound" بالكلمة الأصلية؛ "sesamfrei" → sesam منفيّ.
+    المطابقة التقريبية (lexicon.fuzzy): الـhit يحمل "fuzzy": {token, distance}
+    وسبب الـprovenance يذكر الكلمة الأصلية والمسافة.
+    matches: مطابقات المصطلحات الثابتة محسوبة مسبقًا للدفعة (PhraseIndex.find_many) بدل الـautomaton.
+    timer (اختياري): lexicon_matching بدون زمن النفي، negation (الفهرسة + القرارات)،
+    وعدّادات automaton_hits / compound_hits / fuzzy_hits / regex_evaluations / negation_checks.
+    """
+    letters: Set[str] = set()
+    numbers: Set[int] = set()
+    hits: List[Dict] = []
+    provenance_lex: Dict[str, List[str]] = {}
+
+    if timer is not None:
+        t0 = perf_counter()
+        neg_before = timer.seconds.get("negation", 0.0)
+        with timer.stage("negation"):
+            scope = _TimedScope(negation.scan(text_norm), timer)
+    else:
+        scope = negation.scan(text_norm)
+
+    # term_norm → (entry, negated) بترتيب أول ظهور
+    found: Dict[str, Tuple[LexemeEntry, bool]] = {}
+    # term_norm → الكلمة المركّبة / (الكلمة، المسافة) للمصطلحات التي جاءت من التفكيك أو التقريب فقط
+    via_compound: Dict[str, str] = {}
+    via_fuzzy: Dict[str, Tuple[str, int]] = {}
+
+    # 1) المصطلحات الثابتة: تمريرة واحدة عبر الـautomaton
+    automaton_hits = 0
+    spans: List[Tuple[int, int]] = []
+    for hit in (lexicon.matcher.find(text_norm) if matches is None else matches):
+        automaton_hits += 1
+        spans.append((hit.start, hit.end))
+        neg = scope.is_negated(hit.start, hit.end)
+        prev = found.get(hit.term_norm)
+        found[hit.term_norm] = (hit.entry, neg and (prev[1] if prev else True))
+
+    # 1b) الكلمات المركّبة: كل كلمة لا تغطّيها مطابقة كاملة تُفكَّك إلى مصطلحات معروفة
+    #     (مدى المصطلح للنفي = مدى الكلمة كلها)
+    # 1c) ما لم يُفكَّك: أقرب مصطلح ضمن مسافة تحرير محدودة (إن كان الفهرس مفعّلًا)
+    compound_hits = fuzzy_hits = 0
+    if lexicon.compounds is not None or lexicon.fuzzy is not None:
+        for start, end in _uncovered_words(text_norm, spans):
+            token = text_norm[start:end]
+            parts = lexicon.compounds.split(token) if lexicon.compounds is not None else ()
+            for entry, part_start, part_end in parts:
+                compound_hits += 1
+                neg = scope.is_negated(start, end) or negation.negates_within(token, part_end)
+                prev = found.get(entry.term_norm)
+                if prev is None:
+                    via_compound[entry.term_norm] = token
+                found[entry.term_norm] = (prev[0] if prev else entry, neg and (prev[1] if prev else True))
+            if parts or lexicon.fuzzy is None:
+                continue
+            near = lexicon.fuzzy.lookup(token)
+            if near is None:
+                continue
+            entry, _, distance = near
+            fuzzy_hits += 1
+            neg = scope.is_negated(start, end)
+            prev = found.get(entry.term_norm)
+            if prev is None:
+                via_fuzzy[entry.term_norm] = (token, distance)
+            found[entry.term_norm] = (prev[0] if prev else entry, neg and (prev[1] if prev else True))
+
+    # 2) أنماط Regex: مرشّح نص ثابت ثم الأنماط المُجمَّعة مسبقًا (بترتيب الأولوية)
+    regex_stats: Dict[str, int] = {}
+    for entry, start, end in lexicon.regex.find(text_norm, regex_stats):
+        if entry.term_norm in found:
+            continue
+        found[entry.term_norm] = (entry, scope.is_negated(start, end))
+
+    for entry, negated in found.values():
+        hit = {"term": entry.term, "negated": negated, "lexeme_id": entry.id}
+        near = via_fuzzy.get(entry.term_norm)
+        if entry.term_norm in via_compound:
+            hit["compound"] = via_compound[entry.term_norm]
+        elif near is not None:
+            hit["fuzzy"] = {"token": near[0], "distance": near[1]}
+        hits.append(hit)
+        if negated:
+            continue
+        letters.update(entry.letters)
+        numbers.update(entry.numbers)
+        for code, reason in entry.provenance:
+            if near is not None:
+                reason = f'{reason} (≈ "{near[0]}", d={near[1]})'
+            provenance_lex.setdefault(code, []).append(reason)
+
+    if timer is not None:
+        neg_seconds = timer.seconds.get("negation", 0.0) - neg_before
+        timer.add("lexicon_matching", perf_counter() - t0 - neg_seconds)
+        timer.incr("automaton_hits", automaton_hits)
+        timer.incr("compound_hits", compound_hits)
+        timer.incr("fuzzy_hits", fuzzy_hits)
+        timer.incr("regex_evaluations", regex_stats.get("regex_evaluations", 0))
+
+    details = {"lexeme_hits": hits}
+    return letters, numbers, details, provenance_lex
+
+
+# -----------------------
+# تقييم الأطباق
+# -----------------------
+def record_text(record: DishRecord) -> str:
+    if record.text_norm is not None:
+        return record.text_norm
+    return normalize_text(" ".join(filter(None, [record.name or "", record.description or ""])))
+
+
+def evaluate_dish(
+    record: DishRecord,
+    snapshot: RulesSnapshot,
+    timer: Optional[StageTimer] = None,
+    matches: Optional[Sequence[LexiconHit]] = None,
+) -> DishEvaluation:
+    if timer is None:
+        text_norm = record_text(record)
+        letters_ing, numbers_ing, prov_ing = collect_from_ingredients(record)
+    else:
+        if record.text_norm is None:
+            with timer.stage("normalization"):
+                text_norm = record_text(record)
+        else:
+            text_norm = record.text_norm
+        with timer.stage("ingredient_collection"):
+            letters_ing, numbers_ing, prov_ing = collect_from_ingredients(record)
+    letters_lex, numbers_lex, det, prov_lex = collect_from_lexicon(
+        text_norm, snapshot.lexicon, snapshot.negation, timer=timer, matches=matches,
+    )
+
+    letters = frozenset(letters_ing | letters_lex)
+    numbers = frozenset(numbers_ing | numbers_lex)
+    return DishEvaluation(
+        dish_id=record.dish_id,
+        text_norm=text_norm,
+        codes=format_codes(letters, numbers),
+        letters=letters,
+        numbers=numbers,
+        letters_ing=frozenset(letters_ing),
+        numbers_ing=frozenset(numbers_ing),
+        letters_lex=frozenset(letters_lex),
+        numbers_lex=frozenset(numbers_lex),
+        lexeme_hits=det.get("lexeme_hits", []),
+        provenance_ing=prov_ing,
+        provenance_lex=prov_lex,
+    )
+
+
+def evaluate_many(
+    records: Iterable[DishRecord],
+    snapshot: RulesSnapshot,
+    timer: Optional[StageTimer] = None,
+    batch: bool = False,
+) -> List[DishEvaluation]:
+    """
+    batch=True: المصطلحات الثابتة تُطابَق للدفعة كلها مرة واحدة عبر PhraseIndex
+    (posting map للكلمات) بدل تمريرة automaton لكل طبق — نفس النتائج.
+    """
+    phrases = snapshot.lexicon.phrases
+    if not batch or phrases is None:
+        return [evaluate_dish(r, snapshot, timer) for r in records]
+
+    records = list(records)
+    if timer is None:
+        texts = [record_text(r) for r in records]
+        matches = phrases.find_many(texts)
+    else:
+        with timer.stage("normalization"):
+            texts = [record_text(r) for r in records]
+        with timer.stage("batch_matching"):
+            matches = phrases.find_many(texts)
+    return [
+        evaluate_dish(r if r.text_norm is not None else replace(r, text_norm=t), snapshot, timer, m)
+        for r, t, m in zip(records, texts, matches)
+    ]
+
+
+# -----------------------
+# المطابقة المبسّطة (مرادفات + lexemes → حروف فقط)
+# -----------------------
+def _all_negated(scope: NegationScope, spans: Iterable[Tuple[int, int]]) -> bool:
+    """المصطلح منفيّ فقط إذا كانت كل مواضعه داخل نافذة نفي."""
+    any_span = False
+    for start, end in spans:
+        any_span = True
+        if not scope.is_negated(start, end):
+            return False
+    return any_span
+
+
+def substring_spans(text_norm: str, needle: str) -> Iterator[Tuple[int, int]]:
+    i = text_norm.find(needle)
+    while i != -1:
+        yield i, i + len(needle)
+        i = text_norm.find(needle, i + 1)
+
+
+def is_negated(text_norm: str, term_norm: str, rules: NegationRules) -> bool:
+    """هل كل مواضع term_norm في النص منفيّة؟"""
+    if not term_norm:
+        return False
+    return _all_negated(rules.scan(text_norm), substring_spans(text_norm, term_norm))
+
+
+def match_synonyms(text_norm: str, syn2codes: Mapping[str, FrozenSet[str]], scope: NegationScope) -> Set[str]:
+    """Substring بسيط بعد التطبيع (يمكن لاحقًا جعله word-boundary)."""
+    out: Set[str] = set()
+    for syn, codes in syn2codes.items():
+        if syn and (syn in text_norm) and not _all_negated(scope, substring_spans(text_norm, syn)):
+            out.update(codes)
+    return out
+
+
+# (gate, نمط مُجمَّع أو None للنص الثابت, الأكواد)
+#   gate: نص يجب أن يظهر في النص المُطبّع (العبارة نفسها أو literal الـregex؛ "" = دائمًا)
+LexemePattern = Tuple[str, Optional["re.Pattern"], FrozenSet[str]]
+
+
+def compile_lexeme_patterns(lexemes: Iterable[Tuple[str, bool, FrozenSet[str]]]) -> Tuple[LexemePattern, ...]:
+    """
+    يُجمِّع أنماط lexeme_codes مرة واحدة لكل لقطة (بدل re.finditer بنص النمط لكل نداء).
+    أنماط regex الخاطئة أو الخطرة (regex_guard) تُستبعد.
+    """
+    out: List[LexemePattern] = []
+    for phrase_norm, is_regex, codes in lexemes:
+        if not phrase_norm:
+            continue
+        if is_regex:
+            verdict = check_regex(phrase_norm, dynamic=False)
+            if not verdict.ok:
+                continue
+            out.append((verdict.literal, compile_regex(phrase_norm), codes))
+        else:
+            out.append((phrase_norm, None, codes))
+    return tuple(out)
+
+
+def word_spans(text_norm: str, phrase_norm: str) -> Iterator[Tuple[int, int]]:
+    """مواضع العبارة بحدود كلمات (مسافة/طرف النص) وبدون تداخل، كـ finditer على (?<=\\s)|^ ... (?=\\s)|$."""
+    n, size = len(text_norm), len(phrase_norm)
+    i = text_norm.find(phrase_norm)
+    while i != -1:
+        end = i + size
+        if (i == 0 or text_norm[i - 1].isspace()) and (end == n or text_norm[end].isspace()):
+            yield i, end
+            i = text_norm.find(phrase_norm, end)
+        else:
+            i = text_norm.find(phrase_norm, i + 1)
+
+
+def match_lexemes(
+    text_norm: str,
+    lexemes: Iterable[LexemePattern],
+    scope: NegationScope,
+) -> Set[str]:
+    """مطابقة lexemes مُجمَّعة: regex أو plain (substring بحدود كلمات)."""
+    out: Set[str] = set()
+    for gate, pattern, codes in lexemes:
+        if gate and gate not in text_norm:
+            continue
+        if pattern is not None:
+            spans = [m.span() for m in pattern.finditer(text_norm)]
+        else:
+            spans = list(word_spans(text_norm, gate))
+
+        if spans and not _all_negated(scope, spans):
+            out.update(codes)
+    return out
+
+
+def infer_letters(text_norm: str, snapshot: RulesSnapshot) -> Set[str]:
+    """حروف الأكواد من نص مُطبّع (مرادفات المكوّنات + lexemes) مع النفي."""
+    if not text_norm:
+        return set()
+    patterns = snapshot.lexeme_patterns
+    if not patterns and snapshot.lexeme_codes:
+        patterns = compile_lexeme_patterns(snapshot.lexeme_codes)
+    scope = snapshot.negation.scan(text_norm)
+    letters: Set[str] = set()
+    letters.update(match_synonyms(text_norm, snapshot.syn2codes, scope))
+    letters.update(match_lexemes(text_norm, patterns, scope))
+    return letters
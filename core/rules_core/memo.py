@@ -0,0 +1,188 @@
+# core/rules_core/memo.py
+# -----------------------------------------------------------
+# Memo لنتائج المحرك عبر الأطباق المتطابقة (سلاسل/فروع بنفس الطبق في قوائم كثيرة)
+#   - المفتاح: (مفتاح اللقطة owner/lang/version, النص المُطبّع, المكوّنات, extras)
+#     المكوّنات تشمل الاسم لأن provenance_ing يذكره
+#   - plan(): يقسم دفعة سجلات إلى (محسوب مسبقًا | يحتاج تقييمًا) مع إزالة التكرار
+#     داخل الدفعة؛ loader اختياري (مثلًا جدول DB) يُسأل عن المفاتيح المفقودة فقط
+#   - resolve(): يدمج التقييمات الجديدة ويعيد قائمة بنفس ترتيب السجلات
+#   - to_payload/from_payload: تمثيل JSON لحفظ DishEvaluation خارج العملية
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from core.rules_core.engine import record_text
+from core.rules_core.types import DishEvaluation, DishRecord
+
+# يُرفع عند أي تغيير في منطق المحرك يغيّر DishEvaluation لنفس المدخلات
+# (يدخل في digest الصفوف المحفوظة فتصبح القديمة غير قابلة للمطابقة)
+MEMO_FORMAT = 2
+DEFAULT_MAX_ENTRIES = 50_000
+
+MemoKey = Tuple[Hashable, ...]
+Loader = Callable[[List[MemoKey]], Dict[MemoKey, DishEvaluation]]
+
+
+def memo_key(snapshot_key: Tuple, record: DishRecord) -> MemoKey:
+    return (
+        snapshot_key,
+        record_text(record),
+        record.ingredients,
+        record.extra_allergens,
+        record.extra_additives,
+    )
+
+
+def key_digest(key: MemoKey, variant: int | str = "") -> str:
+    """sha256 ثابت بين العمليات/الإصدارات لمفتاح memo (لجدول DB)؛ variant = إعدادات المحرك."""
+    snapshot_key, text_norm, ingredients, extra_allergens, extra_additives = key
+    raw = json.dumps(
+        [
+            MEMO_FORMAT,
+            str(variant),
+            list(snapshot_key),
+            text_norm,
+            [[i.name, list(i.letters), list(i.numbers)] for i in ingredients],
+            list(extra_allergens),
+            list(extra_additives),
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# -----------------------
+# تمثيل JSON
+# -----------------------
+def to_payload(ev: DishEvaluation) -> Dict:
+    return {
+        "text_norm": ev.text_norm,
+        "codes": ev.codes,
+        "letters": sorted(ev.letters),
+        "numbers": sorted(ev.numbers),
+        "letters_ing": sorted(ev.letters_ing),
+        "numbers_ing": sorted(ev.numbers_ing),
+        "letters_lex": sorted(ev.letters_lex),
+        "numbers_lex": sorted(ev.numbers_lex),
+        "lexeme_hits": ev.lexeme_hits,
+        "provenance_ing": ev.provenance_ing,
+        "provenance_lex": ev.provenance_lex,
+    }
+
+
+def from_payload(dish_id: int, payload: Dict) -> DishEvaluation:
+    return DishEvaluation(
+        dish_id=dish_id,
+        text_norm=payload.get("text_norm", ""),
+        codes=payload.get("codes", ""),
+        letters=frozenset(payload.get("letters", ())),
+        numbers=frozenset(int(n) for n in payload.get("numbers", ())),
+        letters_ing=frozenset(payload.get("letters_ing", ())),
+        numbers_ing=frozenset(int(n) for n in payload.get("numbers_ing", ())),
+        letters_lex=frozenset(payload.get("letters_lex", ())),
+        numbers_lex=frozenset(int(n) for n in payload.get("numbers_lex", ())),
+        lexeme_hits=list(payload.get("lexeme_hits", ())),
+        provenance_ing=dict(payload.get("provenance_ing", {})),
+        provenance_lex=dict(payload.get("provenance_lex", {})),
+    )
+
+
+# -----------------------
+# Memo داخل العملية
+# -----------------------
+@dataclass
+class MemoPlan:
+    """
+    خطة دفعة واحدة:
+      - keys: مفتاح كل سجل (بنفس الترتيب)
+      - known: التقييم الجاهز لكل سجل (أو None)
+      - dish_ids: معرّف الطبق لكل سجل (النتيجة المشتركة تُعاد باسمه)
+      - todo / todo_keys: سجلات فريدة تحتاج تقييمًا (أول ظهور لكل مفتاح)
+    """
+    keys: List[MemoKey]
+    known: List[Optional[DishEvaluation]]
+    dish_ids: List[int]
+    todo: List[DishRecord] = field(default_factory=list)
+    todo_keys: List[MemoKey] = field(default_factory=list)
+
+
+class EvaluationMemo:
+    """
+    LRU محدود بعدد المدخلات (تشغيل/دفعة واحدة عادةً)؛ القيم DishEvaluation
+    تُشارك بين الأطباق (تُقرأ فقط) مع تبديل dish_id.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, loader: Optional[Loader] = None) -> None:
+        self.max_entries = max(1, int(max_entries or DEFAULT_MAX_ENTRIES))
+        self.loader = loader
+        self._data: "OrderedDict[MemoKey, DishEvaluation]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: MemoKey) -> Optional[DishEvaluation]:
+        ev = self._data.get(key)
+        if ev is not None:
+            self._data.move_to_end(key)
+        return ev
+
+    def put(self, key: MemoKey, ev: DishEvaluation) -> None:
+        self._data[key] = ev
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    @staticmethod
+    def _for_dish(ev: DishEvaluation, dish_id: int) -> DishEvaluation:
+        return ev if ev.dish_id == dish_id else dataclasses.replace(ev, dish_id=dish_id)
+
+    def plan(self, snapshot_key: Tuple, records: Sequence[DishRecord]) -> MemoPlan:
+        keys = [memo_key(snapshot_key, r) for r in records]
+        known: List[Optional[DishEvaluation]] = [self.get(k) for k in keys]
+
+        if self.loader is not None:
+            missing = list(dict.fromkeys(k for k, ev in zip(keys, known) if ev is None))
+            if missing:
+                loaded = self.loader(missing)
+                for k, ev in loaded.items():
+                    self.put(k, ev)
+                self.loaded += len(loaded)
+                known = [ev if ev is not None else loaded.get(k) for k, ev in zip(keys, known)]
+
+        plan = MemoPlan(keys=keys, known=known, dish_ids=[r.dish_id for r in records])
+        queued = set()
+        for r, k, ev in zip(records, keys, known):
+            if ev is not None:
+                self.hits += 1
+                continue
+            if k in queued:
+                self.hits += 1  # مكرّر داخل الدفعة: يُحسب مرة واحدة
+                continue
+            self.misses += 1
+            queued.add(k)
+            # النص المُطبّع محسوب للمفتاح؛ لا نعيد حسابه في evaluate_dish
+            plan.todo.append(r if r.text_norm is not None else dataclasses.replace(r, text_norm=k[1]))
+            plan.todo_keys.append(k)
+        return plan
+
+    def resolve(self, plan: MemoPlan, evaluations: Sequence[DishEvaluation]) -> List[DishEvaluation]:
+        """evaluations بترتيب plan.todo → قائمة كاملة بترتيب السجلات الأصلية."""
+        fresh = dict(zip(plan.todo_keys, evaluations))
+        for k, ev in fresh.items():
+            self.put(k, ev)
+        return [
+            self._for_dish(ev if ev is not None else fresh[k], dish_id)
+            for k, ev, dish_id in zip(plan.keys, plan.known, plan.dish_ids)
+        ]
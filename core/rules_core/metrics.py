@@ -0,0 +1,54 @@
+# core/rules_core/metrics.py
+# -----------------------------------------------------------
+# قياس اختياري لمراحل المحرك (بدون Django):
+#   - أزمنة المراحل (ثوانٍ تراكمية + عدد النداءات)
+#   - عدّادات (regex_evaluations, negation_checks, automaton_hits ...)
+# قابل لـpickle ويُدمج بين العمليات الفرعية والأب (merge).
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator
+
+
+class StageTimer:
+    """مجمّع أزمنة/عدّادات بسيط؛ يُمرَّر كـtimer=None لتعطيل القياس بالكامل."""
+
+    __slots__ = ("seconds", "calls", "counters")
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add(self, stage: str, seconds: float, calls: int = 1) -> None:
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    def incr(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - t0)
+
+    def merge(self, other: "StageTimer") -> None:
+        for name, secs in other.seconds.items():
+            self.add(name, secs, other.calls.get(name, 0))
+        for name, n in other.counters.items():
+            self.incr(name, n)
+
+    def as_dict(self) -> Dict:
+        return {
+            "stages": {
+                name: {"ms": round(secs * 1000, 3), "calls": self.calls.get(name, 0)}
+                for name, secs in sorted(self.seconds.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
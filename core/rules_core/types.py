@@ -0,0 +1,72 @@
+# core/rules_core/types.py
+# -----------------------------------------------------------
+# هياكل بيانات بسيطة (قابلة لـpickle) يتبادلها محرك القواعد الصِّرف مع محوّلات ORM
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from re import Pattern
+from typing import Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from core.services.lexicon_matcher import CompiledLexicon
+from core.services.negation import NegationRules
+
+
+@dataclass(frozen=True)
+class IngredientRecord:
+    """مكوّن مرتبط بالطبق: الاسم + أكواد الحساسية + الإضافات الرقمية."""
+    name: str
+    letters: Tuple[str, ...] = ()
+    numbers: Tuple[int, ...] = ()
+
+
+@dataclass(frozen=True)
+class DishRecord:
+    """
+    طبق كما يراه المحرك (بدون ORM):
+      - text_norm: النص المُطبّع إن كان محسوبًا مسبقًا (وإلا يُحسب من name + description)
+    """
+    dish_id: int
+    name: str = ""
+    description: str = ""
+    ingredients: Tuple[IngredientRecord, ...] = ()
+    extra_allergens: Tuple[str, ...] = ()
+    extra_additives: Tuple[int, ...] = ()
+    text_norm: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class RulesSnapshot:
+    """
+    الجزء الصِّرف من لقطة القاموس (ما تحتاجه المطابقة فقط):
+      - key: (owner_id, lang, version) لتمييز اللقطات بين العمليات
+      - lexicon: automaton + أنماط regex
+      - negation: عبارات النفي المُجمَّعة
+      - syn2codes: مرادف مُطبّع → أكواد (dict عادي للقراءة فقط)
+      - lexeme_codes: (term_norm, is_regex, letters) للمطابقة المبسّطة (infer_letters)
+      - lexeme_patterns: نفسها بعد التجميع (engine.compile_lexeme_patterns)
+    """
+    key: Tuple
+    lexicon: CompiledLexicon
+    negation: NegationRules
+    syn2codes: Mapping[str, FrozenSet[str]] = field(default_factory=dict)
+    lexeme_codes: Tuple[Tuple[str, bool, FrozenSet[str]], ...] = ()
+    lexeme_patterns: Tuple[Tuple[str, Optional[Pattern], FrozenSet[str]], ...] = ()
+
+
+@dataclass
+class DishEvaluation:
+    """نتيجة طبق واحد + أثر كل كود (بيانات بسيطة فقط)."""
+    dish_id: int
+    text_norm: str
+    codes: str
+    letters: FrozenSet[str]
+    numbers: FrozenSet[int]
+    letters_ing: FrozenSet[str]
+    numbers_ing: FrozenSet[int]
+    letters_lex: FrozenSet[str]
+    numbers_lex: FrozenSet[int]
+    lexeme_hits: List[Dict] = field(default_factory=list)
+    provenance_ing: Dict[str, List[str]] = field(default_factory=dict)
+    provenance_lex: Dict[str, List[str]] = field(default_factory=dict)
@@ -0,0 +1,40 @@
+# core/rules_core/workers.py
+# -----------------------------------------------------------
+# نقاط دخول العمليات الفرعية (ProcessPoolExecutor)
+#   - install_snapshots: initializer يثبّت لقطات التشغيل مرة واحدة لكل عملية
+#   - evaluate_chunk: المهمة نفسها؛ ترسل فقط مفتاح اللقطة + سجلات الأطباق
+#     (timed=True يرجّع أيضًا StageTimer الدفعة ليُدمج في الأب، batch=True مطابقة الدفعة معًا)
+# تعمل مع fork و spawn (الوحدة لا تستورد Django).
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple, Union
+
+from core.rules_core.engine import evaluate_many
+from core.rules_core.metrics import StageTimer
+from core.rules_core.types import DishEvaluation, DishRecord, RulesSnapshot
+
+_SNAPSHOTS: Dict[Tuple, RulesSnapshot] = {}
+
+
+def install_snapshots(snapshots: Iterable[RulesSnapshot]) -> None:
+    _SNAPSHOTS.clear()
+    for snap in snapshots:
+        _SNAPSHOTS[snap.key] = snap
+
+
+def clear_snapshots() -> None:
+    _SNAPSHOTS.clear()
+
+
+def evaluate_chunk(
+    key: Tuple,
+    records: List[DishRecord],
+    timed: bool = False,
+    batch: bool = False,
+) -> Union[List[DishEvaluation], Tuple[List[DishEvaluation], StageTimer]]:
+    if not timed:
+        return evaluate_many(records, _SNAPSHOTS[key], batch=batch)
+    timer = StageTimer()
+    return evaluate_many(records, _SNAPSHOTS[key], timer, batch=batch), timer
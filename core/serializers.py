@@ -21,6 +21,7 @@ from .models import (
 )
 # قاموس القواعد (ملف مستقل)
 from .dictionary_models import KeywordLexeme, NegationCue
+from .services.regex_guard import check_regex
 
 User = get_user_model()
 
@@ -254,6 +255,18 @@ class KeywordLexemeSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["created_at", "updated_at"]
 
+    def validate(self, attrs):
+        # نفس فحص KeywordLexeme.clean(): نمط regex خاطئ/خطر → 400 بدل خطأ عند الحفظ
+        instance = self.instance
+        is_regex = attrs.get("is_regex", getattr(instance, "is_regex", False))
+        is_active = attrs.get("is_active", getattr(instance, "is_active", True))
+        term = attrs.get("term", getattr(instance, "term", ""))
+        if is_regex and is_active:
+            verdict = check_regex(term or "")
+            if not verdict.ok:
+                raise serializers.ValidationError({"term": f"Regex rejected ({verdict.status}): {verdict.reason}"})
+        return attrs
+
     def create(self, validated_data):
         allergens = validated_data.pop("allergens", [])
         obj = super().create(validated_data)
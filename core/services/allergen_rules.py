@@ -1,151 +1,106 @@
 # core/services/allergen_rules.py
 # -----------------------------------------------------------
 # توليد أكواد الحساسيّات عبر القاموس المخزّن في قاعدة البيانات (rules first)
-# يعتمد على:
+# محوّل ORM حول core/rules_core: قراءة الأطباق → DishRecord، المطابقة الصِّرفة،
+# ثم الكتابة المجمّعة. يعتمد على:
 #   - KeywordLexeme  (قاموس عبارات -> Allergens / Ingredient)
 #   - Ingredient     (Allergens/Additives) الموجودة على الطبق أو عبر lexeme.ingredient
 #   - حقول extra_allergens / extra_additives على الطبق
-# يدعم نفي بسيط: "ohne <term>", "kein/keine/keinen <term>" + العربية/الإنجليزية و (<term>-frei)
+# النفي عبر NegationCue (نوافذ كلمات) + عبارات افتراضية: ohne/kein/no/without/frei/بدون ...
 # -----------------------------------------------------------
 
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import Iterable, List, Dict, Set, Tuple
+from typing import Callable, Iterable, Iterator, List, Dict, Set, Tuple
 
-import re
-import unicodedata
-from django.db import transaction
-from django.db.models import Q, Case, When, Value, IntegerField
-from django.utils import timezone
+import hashlib
+import os
 from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
 
-from core.models import Dish, Ingredient, Allergen, DishAllergen  # ⬅️ جديد: كتابة سجلات تتبّع
-from core.dictionary_models import KeywordLexeme  # النموذج الصحيح (dictionary_models.py)
-
-# -----------------------
-# تنسيق/تطبيع نص قوي
-# -----------------------
-_AR_DIACRITICS_RE = re.compile(r"[\u064B-\u0652]")
-_NON_ALNUM_RE = re.compile(r"[^\w\s]", flags=re.UNICODE)
-
-def normalize_text(s: str) -> str:
-    """
-    NFKD + إزالة accents، تبسيط الألمانية، إزالة التشكيل العربي،
-    إزالة الرموز غير الألفانوميرية (مع الإبقاء على المسافات)، lowercase + دمج المسافات.
-    """
-    if not s:
-        return ""
-    x = unicodedata.normalize("NFKD", str(s))
-    x = "".join(ch for ch in x if not unicodedata.combining(ch))
-    x = (
-        x.replace("ä", "ae")
-         .replace("ö", "oe")
-         .replace("ü", "ue")
-         .replace("ß", "ss")
-    )
-    x = _AR_DIACRITICS_RE.sub("", x)
-    x = _NON_ALNUM_RE.sub(" ", x)
-    x = " ".join(x.strip().lower().split())
-    return x
+from core.models import Dish, Allergen, DishAllergen  # ⬅️ جديد: كتابة سجلات تتبّع
+from core.rules_core import DishEvaluation, DishRecord, IngredientRecord, evaluate_many
+from core.rules_core import workers as rules_workers
+from core.services.lexicon_cache import get_lexicon_snapshot
+from core.services.negation import NEGATION_VERSION
+from core.services.text_normalize import NORMALIZER_VERSION, normalize_text
+from core.services.dish_stream import DEFAULT_CHUNK_SIZE, dish_chunks
+from core.services.rules_memo import build_memo
+from core.services.rules_timings import RunTimings, emit_timings, timings_enabled
 
 
 # -----------------------
-# مطابقة القاموس
+# ORM → سجلات بسيطة (rules_core)
 # -----------------------
-def _match_plain(text_norm: str, term_norm: str) -> bool:
-    """مطابقة عبارة بعد التطبيع بحدود كلمات تقريبية."""
-    if not term_norm:
-        return False
-    pat = rf"(?:(?<=\s)|^){re.escape(term_norm)}(?:(?=\s)|$)"
-    return re.search(pat, text_norm, flags=re.IGNORECASE) is not None
-
-
-def _match_regex(text_norm: str, pattern_raw: str) -> bool:
-    """مطابقة Regex على النص المُطبّع."""
-    try:
-        return re.search(pattern_raw, text_norm, flags=re.IGNORECASE) is not None
-    except re.error:
-        return False
-
-
-# صيغ نفي متعدّدة (de/en/ar)
-NEG_PATTERNS = [
-    r"\bohne\s+{t}\b",
-    r"\bkein(?:e|en|er)?\s+{t}\b",
-    r"\bno\s+{t}\b",
-    r"\bwithout\s+{t}\b",
-    r"\b{t}(?:\s|-)?frei\b",
-    r"\bبدون\s+{t}\b",
-    r"\bمن\s+غير\s+{t}\b",
-    r"\bohne\b[^.()]{{0,40}}\b{t}\b",
-]
-
-def _is_negated(text_norm: str, term_norm: str) -> bool:
-    t = re.escape(term_norm)
-    for p in NEG_PATTERNS:
-        if re.search(p.format(t=t), text_norm, flags=re.IGNORECASE):
-            return True
-    return False
-
+def _int_list(values) -> Tuple[int, ...]:
+    out: List[int] = []
+    for n in (values or []):
+        try:
+            out.append(int(n))
+        except Exception:
+            pass
+    return tuple(out)
 
-# -----------------------
-# تجميع من المكوّنات
-# -----------------------
-def _collect_from_ingredients(dish: Dish) -> Tuple[Set[str], Set[int], Dict[str, List[str]]]:
-    """
-    يرجّع:
-      - letters: أكواد A..Z
-      - numbers: إضافات رقمية
-      - provenance_ing: خريطة code -> قائمة أسباب نصيّة (Ingredient → Code)
-    """
-    letters: Set[str] = set()
-    numbers: Set[int] = set()
-    provenance_ing: Dict[str, List[str]] = {}
 
+def dish_record(dish: Dish, text_norm: str | None = None) -> DishRecord:
+    """يحوّل Dish (مع prefetch ingredients → allergens) إلى DishRecord."""
+    ingredients: List[IngredientRecord] = []
     try:
         for ing in dish.ingredients.all():
-            ing_name = (ing.name or "").strip() or "Ingredient"
             try:
-                for a in ing.allergens.all():
-                    c = (a.code or "").strip().upper()
-                    if c:
-                        letters.add(c)
-                        provenance_ing.setdefault(c, []).append(f'Ingredient: {ing_name} \u2192 {c}')
+                letters = tuple((a.code or "").strip().upper() for a in ing.allergens.all())
             except Exception:
-                pass
-            for n in (ing.additives or []):
-                try:
-                    numbers.add(int(n))
-                except Exception:
-                    pass
+                letters = ()
+            ingredients.append(IngredientRecord(
+                name=ing.name or "",
+                letters=tuple(c for c in letters if c),
+                numbers=_int_list(ing.additives),
+            ))
     except Exception:
         pass
+    return DishRecord(
+        dish_id=dish.id,
+        name=dish.name or "",
+        description=dish.description or "",
+        ingredients=tuple(ingredients),
+        extra_allergens=tuple(str(c) for c in (dish.extra_allergens or [])),
+        extra_additives=_int_list(dish.extra_additives),
+        text_norm=text_norm,
+    )
 
-    for c in (dish.extra_allergens or []):
-        c = (str(c) or "").strip().upper()
-        if c:
-            letters.add(c)
-            provenance_ing.setdefault(c, []).append("Dish.extra_allergens \u2192 " + c)
-
-    for n in (dish.extra_additives or []):
-        try:
-            numbers.add(int(n))
-        except Exception:
-            pass
 
-    return letters, numbers, provenance_ing
+# -----------------------
+# بصمة مدخلات الطبق (للوضع التزايدي)
+# -----------------------
+def dish_text_norm(dish: Dish) -> str:
+    """اسم + وصف الطبق بعد normalize_text (نص المطابقة والبصمة)."""
+    return normalize_text(" ".join(filter(None, [dish.name or "", dish.description or ""])))
 
 
-def _format_codes(letters: Set[str], numbers: Set[int]) -> str:
-    letters_part = ",".join(sorted({c for c in letters if c}))
-    numbers_part = ",".join(str(n) for n in sorted(numbers))
-    if letters_part and numbers_part:
-        return f"({letters_part},{numbers_part})"
-    if letters_part:
-        return f"({letters_part})"
-    if numbers_part:
-        return f"({numbers_part})"
-    return ""
+def dish_fingerprint(dish: Dish, text_norm: str, lexicon_version: str) -> str:
+    """
+    sha256 لكل ما يؤثّر على ناتج القواعد:
+    النص المُطبّع + معرّفات المكوّنات + extra_allergens/extra_additives
+    + إصدار القاموس (يشمل تغييرات Ingredient → Allergen) + إصدار المُطبِّع ومحرك النفي.
+    """
+    ing_ids = sorted(i.id for i in dish.ingredients.all())
+    extra_letters = sorted({str(c).strip().upper() for c in (dish.extra_allergens or []) if str(c).strip()})
+    extra_numbers = sorted({str(n).strip() for n in (dish.extra_additives or []) if str(n).strip()})
+    raw = "\x1f".join([
+        f"n{NORMALIZER_VERSION}",
+        f"g{NEGATION_VERSION}",
+        lexicon_version,
+        text_norm,
+        ",".join(map(str, ing_ids)),
+        ",".join(extra_letters),
+        ",".join(extra_numbers),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
 
 
 # -----------------------
@@ -174,110 +129,6 @@ def _build_de_explanation(letter_codes: Set[str]) -> str:
         return ""
 
 
-# -----------------------
-# تفضيل قاموس المالك ثم العام (owner=None) ثم GLOBAL_LEXICON_OWNER_ID
-# -----------------------
-_GLOBAL_OWNER_ID = getattr(settings, "GLOBAL_LEXICON_OWNER_ID", None)
-
-def _resolve_lexemes(owner_id: int | None, lang: str) -> List[KeywordLexeme]:
-    """
-    نجلب القواميس بالترتيب:
-      1) قاموس المالك (إن وُجد owner_id)
-      2) القاموس العام الحقيقي owner IS NULL
-      3) القاموس المُعرّف في settings.GLOBAL_LEXICON_OWNER_ID (إن وُجد)
-    مع ترتيب يفضّل نتائج المالك ثم NULL ثم GLOBAL.
-    """
-    filters = Q(is_active=True, lang__iexact=lang) & (
-        Q(owner_id=owner_id) |
-        Q(owner__isnull=True) |
-        (Q(owner_id=_GLOBAL_OWNER_ID) if _GLOBAL_OWNER_ID is not None else Q(pk__in=[]))
-    )
-
-    qs = (
-        KeywordLexeme.objects
-        .filter(filters)
-        .select_related("ingredient")
-        .prefetch_related("allergens", "ingredient__allergens")
-        .annotate(
-            owner_rank=Case(
-                When(owner_id=owner_id, then=Value(0)),
-                When(owner__isnull=True, then=Value(1)),
-                When(owner_id=_GLOBAL_OWNER_ID, then=Value(2)),
-                default=Value(3),
-                output_field=IntegerField(),
-            )
-        )
-        .order_by("owner_rank", "id")
-    )
-    return list(qs)
-
-
-def _collect_from_lexicon(
-    text_norm: str,
-    lexemes: List[KeywordLexeme]
-) -> Tuple[Set[str], Set[int], Dict, Dict[str, List[str]]]:
-    """
-    يرجّع:
-      - letters, numbers
-      - details: {"lexeme_hits":[{term, negated}]}
-      - provenance_lex: خريطة code -> قائمة أسباب نصيّة (Lexeme/Ingredient → Code)
-    """
-    letters: Set[str] = set()
-    numbers: Set[int] = set()
-    hits: List[Dict] = []
-    seen_terms: Set[str] = set()
-    provenance_lex: Dict[str, List[str]] = {}
-
-    for lx in lexemes:
-        raw_term = (lx.term or "").strip()
-        if not raw_term:
-            continue
-
-        term_norm = normalize_text(raw_term)
-        if term_norm in seen_terms:
-            continue
-
-        ok = _match_regex(text_norm, raw_term) if lx.is_regex else _match_plain(text_norm, term_norm)
-        if not ok:
-            continue
-
-        seen_terms.add(term_norm)
-
-        if _is_negated(text_norm, term_norm):
-            hits.append({"term": raw_term, "negated": True})
-            continue
-
-        # 1) أكواد على الـlexeme نفسه
-        for a in lx.allergens.all():
-            c = (a.code or "").strip().upper()
-            if c:
-                letters.add(c)
-                provenance_lex.setdefault(c, []).append(f'Lexeme: "{raw_term}" \u2192 {c}')
-
-        # 2) عبر Ingredient مرتبط بالـlexeme
-        if lx.ingredient_id:
-            try:
-                for a in lx.ingredient.allergens.all():
-                    c = (a.code or "").strip().upper()
-                    if c:
-                        letters.add(c)
-                        provenance_lex.setdefault(c, []).append(
-                            f'Lexeme: "{raw_term}" → Ingredient: {lx.ingredient.name} \u2192 {c}'
-                        )
-                for n in (lx.ingredient.additives or []):
-                    try:
-                        numbers.add(int(n))
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-
-        hits.append({"term": raw_term, "negated": False})
-
-    details = {"lexeme_hits": hits}
-    return letters, numbers, details, provenance_lex
-
-
 # -----------------------
 # هيكل نتيجة عنصر
 # -----------------------
@@ -293,71 +144,270 @@ class RuleResultItem:
 
 
 # -----------------------
-# كتابة سجلات DishAllergen
+# كتابة مجمّعة: Dish (bulk_update) + DishAllergen (bulk_create)
 # -----------------------
-@transaction.atomic
-def _upsert_dish_allergen_rows(
-    dish: Dish,
-    *,
-    codes_final: Set[str],
-    provenance_ing: Dict[str, List[str]],
-    provenance_lex: Dict[str, List[str]],
-    force: bool
-) -> int:
+DEFAULT_WRITE_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+# أقصى عدد عناصر تُعاد في الاستجابة (الباقي يُعدّ فقط ولا يُحتفظ به في الذاكرة)
+ITEMS_LIMIT = 1000
+# compact=True: مفاتيح العنصر فقط (الشرح الكامل لكل طبق عبر explain_dish عند الطلب)
+COMPACT_ITEM_KEYS = ("dish_id", "before", "after", "action")
+# أفعال التخطّي (العناصر المضغوطة بلا مفتاح "skipped")
+SKIPPED_ACTIONS = frozenset({"skip_manual", "unchanged_fingerprint"})
+# قرارات dry run التي تغيّر الطبق (تُحفظ معها مصادر DishAllergen ليطبّقها RuleRun لاحقًا)
+APPLY_ACTIONS = frozenset({"would_change", "would_override_manual"})
+
+
+def _evaluation_details(ev: DishEvaluation, explanation_de: str) -> Dict:
+    prov_ing, prov_lex = ev.provenance_ing, ev.provenance_lex
+    return {
+        "text_used": ev.text_norm,
+        "letters_from_ingredients": sorted(ev.letters_ing),
+        "numbers_from_ingredients": sorted(ev.numbers_ing),
+        "letters_from_lexemes": sorted(ev.letters_lex),
+        "numbers_from_lexemes": sorted(ev.numbers_lex),
+        "explanation_de": explanation_de,
+        "lexeme_hits": ev.lexeme_hits,
+        # أثر كل كود من أين جاء
+        "provenance": {
+            "ingredient": {k: prov_ing[k] for k in sorted(prov_ing.keys())},
+            "lexeme": {k: prov_lex[k] for k in sorted(prov_lex.keys())},
+        },
+    }
+
+
+# -----------------------
+# شرح طبق واحد عند الطلب
+# -----------------------
+def explain_dish(dish: Dish, owner_id: int | None = None, lang: str = "de") -> Dict:
     """
-    ينشئ سجلات DishAllergen لكل كود في codes_final إن لم تكن موجودة.
-    - لا يحذف أي سجل موجود.
-    - لا يلمس الأطباق اليدوية إذا force=False.
-    - source/confidence/rationale حسب المصدر الأقوى (Ingredient > Lexeme).
+    provenance كاملة لطبق واحد بلقطة القاموس المخزّنة (lexicon_cache) بدون كتابة.
+    owner_id=None → مالك قائمة الطبق. نفس هيكل details في generate_for_dishes
+    + before/after (after = ناتج القواعد الحالي حتى لو كانت للطبق أكواد يدوية).
     """
-    if (not force) and getattr(dish, "has_manual_codes", False):
-        return 0
+    if owner_id is None:
+        owner_id = dish.section.menu.user_id
+    snap = get_lexicon_snapshot(owner_id=owner_id, lang=lang)
+    ev = evaluate_many([dish_record(dish)], snap.rules)[0]
+    return {
+        "dish_id": dish.id,
+        "name": dish.name,
+        "owner_id": owner_id,
+        "lang": lang,
+        "lexicon_version": snap.version,
+        "before": (getattr(dish, "generated_codes", "") or "").strip(),
+        "after": ev.codes,
+        "has_manual_codes": bool(getattr(dish, "has_manual_codes", False)),
+        "details": _evaluation_details(ev, _build_de_explanation(set(ev.letters))),
+    }
 
-    if not codes_final:
-        return 0
 
-    existed = set(DishAllergen.objects.filter(dish=dish).values_list("allergen__code", flat=True))
-    to_add = [c for c in codes_final if c not in existed]
-    if not to_add:
-        return 0
+def _row_source(code: str, provenance_ing: Dict[str, List[str]], provenance_lex: Dict[str, List[str]]) -> Tuple[str, float, str]:
+    """source/confidence/rationale حسب المصدر الأقوى (Ingredient > Lexeme)."""
+    reasons_ing = provenance_ing.get(code, [])
+    reasons_lex = provenance_lex.get(code, [])
+    if reasons_ing:
+        return DishAllergen.Source.INGREDIENT, 0.98, "; ".join(reasons_ing[:3])
+    if reasons_lex:
+        return DishAllergen.Source.REGEX, 0.90, "; ".join(reasons_lex[:3])
+    # احتياط (لا يُفترض الوصول له هنا)
+    return DishAllergen.Source.REGEX, 0.50, ""
+
+
+class _BulkWriter:
+    """
+    يجمع تغييرات الأطباق وصفوف DishAllergen الجديدة ويكتبها على دفعات (chunk_size):
+      - Dish: bulk_update واحد لكل دفعة (بدل save() لكل طبق)
+      - DishAllergen: SELECT واحد للموجود + bulk_create(ignore_conflicts=True)
+    كل دفعة transaction واحدة. إن فشلت (DatabaseError) تُعاد داخل transaction الدفعة
+    طبقًا طبقًا، كلٌّ في savepoint: الطبق الفاشل يُسجَّل في failed ويُتخطّى والباقي يُكتب.
+    لا يحذف أي سجل موجود، ولا يكتب نفس الصف مرتين.
+    timer (اختياري): زمن/استعلامات كل دفعة تحت مرحلة db_write.
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE, timer: RunTimings | None = None) -> None:
+        self.chunk_size = max(1, int(chunk_size or DEFAULT_WRITE_CHUNK_SIZE))
+        self.timer = timer
+        self._dishes: Dict[int, Dish] = {}
+        self._fields: Set[str] = set()
+        # dish_id → {code: (source, confidence, rationale)}
+        self._rows: Dict[int, Dict[str, Tuple[str, float, str]]] = {}
+        self._allergen_ids: Dict[str, int] | None = None
+        self.dishes_written = 0
+        self.rows_created = 0
+        # dish_id → رسالة الخطأ (تُفرَّغ عبر take_failed)
+        self.failed: Dict[int, str] = {}
+
+    def add_dish(self, dish: Dish, fields: Iterable[str]) -> None:
+        fields = list(fields)
+        if not fields:
+            return
+        self._dishes[dish.id] = dish
+        self._fields.update(fields)
+
+    def add_rows(
+        self,
+        dish: Dish,
+        codes: Set[str],
+        provenance_ing: Dict[str, List[str]],
+        provenance_lex: Dict[str, List[str]],
+    ) -> None:
+        if not codes:
+            return
+        bucket = self._rows.setdefault(dish.id, {})
+        for code in codes:
+            bucket.setdefault(code, _row_source(code, provenance_ing, provenance_lex))
+
+    def add_row_sources(self, dish: Dish, sources: Dict[str, Tuple[str, float, str]]) -> None:
+        """صفوف محسوبة مسبقًا (RuleRunItem.rows) بدل provenance."""
+        if not sources:
+            return
+        bucket = self._rows.setdefault(dish.id, {})
+        for code, (source, confidence, rationale) in sources.items():
+            bucket.setdefault(code, (source, confidence, rationale))
+
+    def pending(self) -> int:
+        return max(len(self._dishes), len(self._rows))
+
+    def maybe_flush(self) -> None:
+        if self.pending() >= self.chunk_size:
+            self.flush()
+
+    def _allergen_map(self) -> Dict[str, int]:
+        if self._allergen_ids is None:
+            self._allergen_ids = dict(Allergen.objects.values_list("code", "id"))
+        return self._allergen_ids
+
+    def flush(self) -> None:
+        if not self._dishes and not self._rows:
+            return
+        with (self.timer.stage("db_write") if self.timer is not None else nullcontext()):
+            self._flush()
+
+    def take_failed(self) -> Dict[int, str]:
+        failed, self.failed = self.failed, {}
+        return failed
+
+    def _flush(self) -> None:
+        fields = sorted(self._fields)
+        try:
+            with transaction.atomic():
+                written, created = self._write(list(self._dishes.values()), self._rows, fields)
+        except DatabaseError:
+            written, created = self._write_each(fields)
+        self.dishes_written += written
+        self.rows_created += created
+
+        self._dishes.clear()
+        self._fields.clear()
+        self._rows.clear()
+
+    def _write_each(self, fields: List[str]) -> Tuple[int, int]:
+        written = created = 0
+        with transaction.atomic():
+            for dish_id in dict.fromkeys([*self._dishes, *self._rows]):
+                dish = self._dishes.get(dish_id)
+                rows = {dish_id: self._rows[dish_id]} if dish_id in self._rows else {}
+                try:
+                    with transaction.atomic():
+                        w, c = self._write([dish] if dish is not None else [], rows, fields)
+                except DatabaseError as e:
+                    self.failed[dish_id] = str(e)[:500]
+                    continue
+                written += w
+                created += c
+        return written, created
+
+    def _write(
+        self,
+        dishes: List[Dish],
+        rows: Dict[int, Dict[str, Tuple[str, float, str]]],
+        fields: List[str],
+    ) -> Tuple[int, int]:
+        if dishes:
+            Dish.objects.bulk_update(dishes, fields)
+
+        new_rows = []
+        if rows:
+            existing = set(
+                DishAllergen.objects
+                .filter(dish_id__in=list(rows.keys()))
+                .values_list("dish_id", "allergen__code")
+            )
+            all_map = self._allergen_map()
+            for dish_id, codes in rows.items():
+                for code, (source, confidence, rationale) in codes.items():
+                    allergen_id = all_map.get(code)
+                    if not allergen_id or (dish_id, code) in existing:
+                        continue
+                    new_rows.append(DishAllergen(
+                        dish_id=dish_id,
+                        allergen_id=allergen_id,
+                        source=source,
+                        confidence=confidence,
+                        rationale=rationale,
+                        is_confirmed=False,
+                        created_by=None,
+                    ))
+            if new_rows:
+                DishAllergen.objects.bulk_create(new_rows, ignore_conflicts=True)
+        return len(dishes), len(new_rows)
 
-    all_map = {a.code: a for a in Allergen.objects.filter(code__in=to_add)}
 
-    created = 0
-    for code in to_add:
-        allergen = all_map.get(code)
-        if not allergen:
+# -----------------------
+# التوزيع على عمليات (المطابقة في rules_core بدون ORM)
+# -----------------------
+def _max_workers(limit: int | None = None) -> int:
+    """RULES_MAX_WORKERS (0 = كل الأنوية)، ومقيّد بـlimit إن مُرِّر (مسار الويب)."""
+    configured = int(getattr(settings, "RULES_MAX_WORKERS", 0) or 0)
+    workers = configured if configured > 0 else (os.cpu_count() or 1)
+    return max(1, min(workers, int(limit))) if limit else workers
+
+
+def _timed_chunks(chunks: Iterator[List[Dish]], timer: RunTimings) -> Iterator[List[Dish]]:
+    """يقيس جلب كل دفعة (استعلامات keyset + prefetch) تحت مرحلة dish_loading."""
+    while True:
+        with timer.stage("dish_loading"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _iter_chunks(dishes, chunk_size: int, after_pk: int | None = None) -> Iterator[List[Dish]]:
+    if isinstance(dishes, QuerySet):
+        yield from dish_chunks(dishes, chunk_size, after_pk=after_pk)
+        return
+    batch: List[Dish] = []
+    for dish in dishes:
+        if after_pk is not None and dish.pk <= after_pk:
             continue
+        batch.append(dish)
+        if len(batch) >= chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        # مصدر ورشنال وثقة
-        reasons_ing = provenance_ing.get(code, [])
-        reasons_lex = provenance_lex.get(code, [])
-        if reasons_ing:
-            source = DishAllergen.Source.INGREDIENT
-            rationale = "; ".join(reasons_ing[:3])
-            confidence = 0.98
-        elif reasons_lex:
-            source = DishAllergen.Source.REGEX
-            rationale = "; ".join(reasons_lex[:3])
-            confidence = 0.90
-        else:
-            # احتياط (لا يُفترض الوصول له هنا)
-            source = DishAllergen.Source.REGEX
-            rationale = ""
-            confidence = 0.50
-
-        DishAllergen.objects.create(
-            dish=dish,
-            allergen=allergen,
-            source=source,
-            confidence=confidence,
-            rationale=rationale,
-            is_confirmed=False,
-            created_by=None,
-        )
-        created += 1
 
-    return created
+# -----------------------
+# نقطة الاستئناف: آخر دفعة مكتوبة (commit) لكل تشغيل
+#   "r1.<owner_id|g>.<last_pk>" — الأطباق تُمرَّر بترتيب pk داخل كل مالك،
+#   والمالكون بترتيب ثابت (generate_per_owner)؛ الاستئناف يبدأ بعد last_pk لنفس المالك
+# -----------------------
+RESUME_TOKEN_PREFIX = "r1"
+
+
+def resume_token(owner_id: int | None, last_pk: int) -> str:
+    return f"{RESUME_TOKEN_PREFIX}.{'g' if owner_id is None else owner_id}.{last_pk}"
+
+
+def parse_resume_token(token: str) -> Tuple[int | None, int]:
+    """(owner_id, last_pk)؛ ValueError لصيغة غير صحيحة."""
+    parts = str(token or "").strip().split(".")
+    if len(parts) != 3 or parts[0] != RESUME_TOKEN_PREFIX:
+        raise ValueError(f"Invalid resume token: {token!r}")
+    owner = None if parts[1] == "g" else int(parts[1])
+    return owner, int(parts[2])
 
 
 # -----------------------
@@ -370,147 +420,417 @@ def generate_for_dishes(
     force: bool = False,
     dry_run: bool = True,
     include_details: bool = False,
+    chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE,
+    incremental: bool = False,
+    timings: bool | None = None,
+    compact: bool = False,
+    recorder=None,
+    resume_from: str | None = None,
+    checkpoint: Callable[[str], None] | None = None,
+    memo: bool = True,
+    persist_memo: bool | None = None,
+    batch_matching: bool | None = None,
 ) -> Dict:
-    lexemes = _resolve_lexemes(owner_id=owner_id, lang=lang)
-
-    processed = 0
-    skipped = 0
-    changed = 0
-    missing_after_rules = 0
-    items: List[Dict] = []
-
-    for dish in dishes:
-        processed += 1
-
-        has_manual_flag = bool(getattr(dish, "has_manual_codes", False))
-        current_value = (getattr(dish, "generated_codes", "") or "").strip()
-
-        if has_manual_flag and not force:
-            skipped += 1
-            items.append({
-                "dish_id": dish.id,
-                "name": dish.name,
-                "before": current_value,
-                "after": "",
-                "action": "skip_manual",
-                "skipped": True,
-            })
-            continue
+    """
+    يشغّل محرك القواعد على الأطباق.
+    - dishes: QuerySet (يُمرَّر على دفعات keyset بحجم chunk_size مع prefetch
+      ingredients → allergens) أو أي iterable من Dish جاهز.
+    - في وضع الكتابة تُجمع التغييرات وتُكتب على دفعات بحجم chunk_size
+      (bulk_update للأطباق + bulk_create لسجلات DishAllergen).
+    - incremental=True: الأطباق التي لم تتغيّر بصمتها (Dish.codes_fingerprint) تُتخطّى
+      بدون مطابقة، ولا يُكتب codes_updated_at/DishAllergen إلا إذا تغيّر الناتج فعلًا.
+      force=True يتجاهل البصمة.
+    - timings=True: أزمنة/عدّادات كل مرحلة تحت مفتاح "timings" وتُرسل إلى
+      RULES_TIMINGS_HOOK (None = مفعّل فقط إذا كان الـhook مضبوطًا).
+    - memo=True: الأطباق المتطابقة (نفس النص المُطبّع + المكوّنات + extras + لقطة القاموس)
+      تُقيَّم مرة واحدة في التشغيل وتُشارك النتيجة؛ persist_memo=True يحفظها أيضًا في
+      RuleResultMemo لتشغيلات لاحقة (None = حسب RULES_MEMO_PERSIST).
+    - batch_matching=True: المصطلحات الثابتة تُطابَق لكل دفعة مرة واحدة عبر posting map
+      للكلمات (PhraseIndex) بدل automaton لكل طبق؛ نفس النتائج (None = حسب RULES_BATCH_MATCHING).
+    - compact=True: كل عنصر = COMPACT_ITEM_KEYS فقط (بدون details/شرح حتى لو طُلبت)؛
+      الشرح لطبق واحد عبر explain_dish.
+    - recorder (rule_runs.RunRecorder): يستلم كل العناصر (بدون حدّ ITEMS_LIMIT) لحفظها في RuleRun.
+    - وضع الكتابة: كل دفعة (chunk_size طبق) تُكتب في transaction واحدة قبل الانتقال للتالية؛
+      الطبق الذي تفشل كتابته يُعاد في savepoint خاص ثم يُسجَّل (action="failed", failed_dishes)
+      ويُتخطّى. بعد كل commit: resume_token (يُمرَّر إلى checkpoint إن وُجد ويُعاد في النتيجة)؛
+      resume_from=<token> يكمل تشغيلًا منقطعًا بعد آخر دفعة مكتوبة.
+    """
+    return _run_shards(
+        [(owner_id, dishes)],
+        lang=lang,
+        force=force,
+        dry_run=dry_run,
+        include_details=include_details,
+        chunk_size=chunk_size,
+        incremental=incremental,
+        parallel=False,
+        timings=timings,
+        compact=compact,
+        recorder=recorder,
+        resume_from=resume_from,
+        checkpoint=checkpoint,
+        memo=memo,
+        persist_memo=persist_memo,
+        batch_matching=batch_matching,
+    )
 
-        base_text = " ".join(filter(None, [dish.name or "", dish.description or ""]))
-        text_norm = normalize_text(base_text)
-
-        letters_ing, numbers_ing, prov_ing = _collect_from_ingredients(dish)
-        letters_lex, numbers_lex, det, prov_lex = _collect_from_lexicon(text_norm, lexemes)
-
-        letters = set(letters_ing) | set(letters_lex)
-        numbers = set(numbers_ing) | set(numbers_lex)
-
-        new_value = _format_codes(letters, numbers)
-        explanation_de = _build_de_explanation(letters) if include_details else ""
-
-        # ---------- DRY RUN ----------
-        if dry_run:
-            action = "no_change" if new_value == current_value else "would_change"
-            if force and has_manual_flag:
-                action = "would_override_manual"
-            item = {
-                "dish_id": dish.id,
-                "name": dish.name,
-                "before": current_value,
-                "after": new_value,
-                "action": action,
-                "skipped": False,
-            }
-            if include_details:
-                item["details"] = {
-                    "text_used": text_norm,
-                    "letters_from_ingredients": sorted(list(letters_ing)),
-                    "numbers_from_ingredients": sorted(list(numbers_ing)),
-                    "letters_from_lexemes": sorted(list(letters_lex)),
-                    "numbers_from_lexemes": sorted(list(numbers_lex)),
-                    "explanation_de": explanation_de,
-                    "lexeme_hits": det.get("lexeme_hits", []),
-                    # جديد: أثر كل كود من أين جاء
-                    "provenance": {
-                        "ingredient": {k: prov_ing[k] for k in sorted(prov_ing.keys())},
-                        "lexeme": {k: prov_lex[k] for k in sorted(prov_lex.keys())},
-                    },
-                }
-            if new_value == "":
-                missing_after_rules += 1
-            if new_value != current_value:
-                changed += 1
-            items.append(item)
-            continue
 
-        # ---------- WRITE MODE ----------
-        updated_fields = []
-        if force and has_manual_flag:
-            dish.has_manual_codes = False
-            dish.manual_codes = None
-            updated_fields += ["has_manual_codes", "manual_codes"]
+def generate_per_owner(dishes: QuerySet, lang: str = "de", parallel: bool = True, **kwargs) -> Dict:
+    """
+    يقسّم QuerySet أطباق من عدة مالكين حسب Menu.user، وكل مالك يُطابَق بقاموسه.
+    parallel=True: المطابقة الصِّرفة تُوزَّع على ProcessPoolExecutor بينما تبقى
+    القراءة (ORM) والكتابة في العملية الأم. النتيجة بنفس مفاتيح generate_for_dishes + "owners".
+    max_workers: سقف لعدد العمليات (طلبات الويب تمرّر RULES_WEB_MAX_WORKERS).
+    """
+    owner_ids = sorted(
+        dishes.order_by().values_list("section__menu__user_id", flat=True).distinct(),
+        key=lambda o: (o is None, o or 0),
+    )
+    shards = [(o, dishes.filter(section__menu__user_id=o)) for o in owner_ids]
+    res = _run_shards(shards, lang=lang, parallel=parallel, **kwargs)
+    res["owners"] = len(owner_ids)
+    return res
 
-        if new_value != current_value:
-            dish.generated_codes = new_value
-            updated_fields.append("generated_codes")
-            changed += 1
 
-        if hasattr(dish, "codes_updated_at"):
-            dish.codes_updated_at = timezone.now()
-            updated_fields.append("codes_updated_at")
+def _run_shards(
+    shards: List[Tuple[int | None, Iterable[Dish]]],
+    lang: str,
+    force: bool = False,
+    dry_run: bool = True,
+    include_details: bool = False,
+    chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE,
+    incremental: bool = False,
+    parallel: bool = False,
+    max_workers: int | None = None,
+    timings: bool | None = None,
+    compact: bool = False,
+    recorder=None,
+    resume_from: str | None = None,
+    checkpoint: Callable[[str], None] | None = None,
+    memo: bool = True,
+    persist_memo: bool | None = None,
+    batch_matching: bool | None = None,
+) -> Dict:
+    if batch_matching is None:
+        batch_matching = bool(getattr(settings, "RULES_BATCH_MATCHING", False))
+    opts = dict(
+        lang=lang,
+        force=force,
+        dry_run=dry_run,
+        include_details=include_details and not compact,
+        chunk_size=chunk_size,
+        incremental=incremental,
+        parallel=parallel,
+        max_workers=max_workers,
+        compact=compact,
+        recorder=recorder,
+        resume_from=resume_from,
+        checkpoint=checkpoint,
+        memo=memo,
+        persist_memo=persist_memo,
+        batch_matching=batch_matching,
+    )
+    if not timings_enabled(timings):
+        return _evaluate_shards(shards, timer=None, **opts)
+
+    timer = RunTimings()
+    with timer.run():
+        result = _evaluate_shards(shards, timer=timer, **opts)
+    result["timings"] = timer.as_dict()
+    emit_timings(result["timings"], {
+        "owners": [o for o, _ in shards],
+        "lang": lang,
+        "dry_run": dry_run,
+        "incremental": incremental,
+        "processed": result["processed"],
+        "workers": result.get("workers", 1),
+    })
+    return result
+
+
+def _evaluate_shards(
+    shards: List[Tuple[int | None, Iterable[Dish]]],
+    lang: str,
+    force: bool,
+    dry_run: bool,
+    include_details: bool,
+    chunk_size: int,
+    incremental: bool,
+    parallel: bool,
+    max_workers: int | None,
+    compact: bool,
+    recorder,
+    resume_from: str | None,
+    checkpoint: Callable[[str], None] | None,
+    memo: bool,
+    persist_memo: bool | None,
+    batch_matching: bool,
+    timer: RunTimings | None,
+) -> Dict:
+    chunk_size = max(1, int(chunk_size or DEFAULT_WRITE_CHUNK_SIZE))
+    stage = timer.stage if timer is not None else (lambda name: nullcontext())
+
+    # استئناف: تخطّي المالكين السابقين، ثم الأطباق حتى last_pk لمالك النقطة
+    after_pk: Dict[int | None, int] = {}
+    if resume_from:
+        resume_owner, resume_pk = parse_resume_token(resume_from)
+        owners = [o for o, _ in shards]
+        if resume_owner not in owners:
+            raise ValueError(f"Resume token owner {resume_owner} is not part of this run.")
+        shards = shards[owners.index(resume_owner):]
+        after_pk[resume_owner] = resume_pk
+
+    # لقطات القواميس (ORM) في الأب؛ العمليات الفرعية تستلم الجزء الصِّرف مرة واحدة (initializer)
+    with stage("lexicon_resolution"):
+        snapshots = [get_lexicon_snapshot(owner_id=o, lang=lang) for o, _ in shards]
+    rules = {snap.key: snap.rules for snap in snapshots}
+
+    workers = _max_workers(max_workers) if parallel and len(shards) > 1 else 1
+    executor = None
+    if workers > 1:
+        # لا نشارك مقابس DB مع العمليات الفرعية (تُفتح من جديد عند الحاجة في الأب)؛
+        # داخل transaction.atomic لا يمكن الإغلاق، والعمليات الفرعية لا تلمس DB أصلًا.
+        if not any(conn.in_atomic_block for conn in connections.all()):
+            connections.close_all()
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=rules_workers.install_snapshots,
+            initargs=(list(rules.values()),),
+        )
 
-        if updated_fields:
-            dish.save(update_fields=list(dict.fromkeys(updated_fields)))
+    stats = {"processed": 0, "skipped": 0, "unchanged_fingerprint": 0, "changed": 0, "missing_after_rules": 0, "failed": 0}
+    items: List[Dict] = []
+    item_count = 0
+    failed_dishes: List[Dict] = []
+    last_token = None
+    writer = None if dry_run else _BulkWriter(chunk_size, timer=timer)
+    result_memo, memo_store = build_memo(persist_memo, timer) if memo else (None, None)
+
+    def add_item(item: Dict, fingerprint: str = "", rows: Dict | None = None) -> None:
+        nonlocal item_count
+        item_count += 1
+        if recorder is not None:
+            recorder.add(item, fingerprint, rows)
+        if len(items) < ITEMS_LIMIT:
+            items.append({k: item[k] for k in COMPACT_ITEM_KEYS} if compact else item)
+
+    def finish(owner_id: int | None, pending: List, plan, evaluations) -> None:
+        nonlocal last_token
+        if isinstance(evaluations, tuple):
+            # evaluate_chunk(timed=True) من عملية فرعية: (evaluations, StageTimer)
+            evaluations, chunk_timer = evaluations
+            timer.merge(chunk_timer)
+        if plan is not None:
+            # evaluations تخص plan.todo فقط (نص فريد لم يُحسب بعد) → قائمة كاملة بترتيب records
+            if memo_store is not None:
+                memo_store.save(plan.todo_keys, evaluations)
+            evaluations = result_memo.resolve(plan, evaluations)
+        chunk_items = apply(pending, evaluations)
+        if writer is None:
+            for args in chunk_items:
+                add_item(*args)
+            return
+
+        # commit الدفعة كاملة قبل الانتقال للتالية؛ الأطباق الفاشلة تُعلَّم ولا توقف التشغيل
+        writer.flush()
+        failed = writer.take_failed()
+        for item, fingerprint, rows in chunk_items:
+            error = failed.get(item["dish_id"])
+            if error is not None:
+                if item["action"] == "changed":
+                    stats["changed"] -= 1
+                stats["failed"] += 1
+                item["action"] = "failed"
+                if len(failed_dishes) < ITEMS_LIMIT:
+                    failed_dishes.append({"dish_id": item["dish_id"], "error": error})
+            add_item(item, fingerprint, rows)
+        last = pending[-1]
+        last_token = resume_token(owner_id, last["dish_id"] if isinstance(last, dict) else last[0].id)
+        if checkpoint is not None:
+            checkpoint(last_token)
+
+    def apply(pending: List, evaluations: List[DishEvaluation]) -> List[Tuple[Dict, str, Dict | None]]:
+        # pending بترتيب الأطباق: عنصر جاهز (dict لتخطٍّ) أو طبق ينتظر تقييمه
+        chunk_items: List[Tuple[Dict, str, Dict | None]] = []
+        evals = iter(evaluations)
+        for entry in pending:
+            if isinstance(entry, dict):
+                chunk_items.append((entry, "", None))
+                continue
+            dish, current_value, has_manual_flag, fingerprint = entry
+            ev = next(evals)
+            letters = set(ev.letters)
+            prov_ing, prov_lex = ev.provenance_ing, ev.provenance_lex
+            new_value = ev.codes
+            explanation_de = ""
+            if include_details:
+                with stage("explanation"):
+                    explanation_de = _build_de_explanation(letters)
 
-        if new_value == "":
-            missing_after_rules += 1
+            if new_value == "":
+                stats["missing_after_rules"] += 1
+
+            # ---------- DRY RUN ----------
+            if dry_run:
+                action = "no_change" if new_value == current_value else "would_change"
+                if force and has_manual_flag:
+                    action = "would_override_manual"
+                if new_value != current_value:
+                    stats["changed"] += 1
+                item = {
+                    "dish_id": dish.id,
+                    "name": dish.name,
+                    "before": current_value,
+                    "after": new_value,
+                    "action": action,
+                    "skipped": False,
+                }
+            # ---------- WRITE MODE ----------
+            else:
+                updated_fields = []
+                if force and has_manual_flag:
+                    dish.has_manual_codes = False
+                    dish.manual_codes = None
+                    updated_fields += ["has_manual_codes", "manual_codes"]
+
+                if new_value != current_value:
+                    dish.generated_codes = new_value
+                    updated_fields.append("generated_codes")
+                    stats["changed"] += 1
+
+                # في الوضع التزايدي لا نلمس codes_updated_at إلا إذا تغيّر الناتج
+                result_changed = bool(updated_fields)
+                if hasattr(dish, "codes_updated_at") and (result_changed or not incremental):
+                    dish.codes_updated_at = timezone.now()
+                    updated_fields.append("codes_updated_at")
+
+                if (getattr(dish, "codes_fingerprint", "") or "") != fingerprint:
+                    dish.codes_fingerprint = fingerprint
+                    updated_fields.append("codes_fingerprint")
+
+                writer.add_dish(dish, updated_fields)
+
+                # صفوف التتبّع لكل كود حرفي ظهر (تُكتب مع الدفعة)
+                if result_changed or not incremental:
+                    writer.add_rows(dish, letters, prov_ing, prov_lex)
+
+                item = {
+                    "dish_id": dish.id,
+                    "name": dish.name,
+                    "before": current_value,
+                    "after": new_value,
+                    "action": "changed" if result_changed else "unchanged",
+                    "skipped": False,
+                }
 
-        # كتابة صفوف التتبّع لكل كود حرفي ظهر
-        if letters:
-            try:
-                _upsert_dish_allergen_rows(
-                    dish,
-                    codes_final=letters,
-                    provenance_ing=prov_ing,
-                    provenance_lex=prov_lex,
-                    force=force,
-                )
-            except Exception:
-                # لا نكسر التدفق لو حصل خطأ في التتبّع
-                pass
-
-        item = {
-            "dish_id": dish.id,
-            "name": dish.name,
-            "before": current_value,
-            "after": new_value,
-            "action": "changed" if updated_fields else "unchanged",
-            "skipped": False,
-        }
-        if include_details:
-            item["details"] = {
-                "text_used": text_norm,
-                "letters_from_ingredients": sorted(list(letters_ing)),
-                "numbers_from_ingredients": sorted(list(numbers_ing)),
-                "letters_from_lexemes": sorted(list(letters_lex)),
-                "numbers_from_lexemes": sorted(list(numbers_lex)),
-                "explanation_de": explanation_de,
-                "lexeme_hits": det.get("lexeme_hits", []),
-                "provenance": {
-                    "ingredient": {k: prov_ing[k] for k in sorted(prov_ing.keys())},
-                    "lexeme": {k: prov_lex[k] for k in sorted(prov_lex.keys())},
-                },
-            }
-        items.append(item)
+            if include_details:
+                item["details"] = _evaluation_details(ev, explanation_de)
+            rows = None
+            if recorder is not None and item["action"] in APPLY_ACTIONS:
+                rows = {code: _row_source(code, prov_ing, prov_lex) for code in sorted(letters)}
+            chunk_items.append((item, fingerprint, rows))
+        return chunk_items
+
+    # نافذة دفعات قيد المطابقة في العمليات الفرعية (الترتيب محفوظ عند التطبيق)
+    inflight: deque = deque()
+    window = workers * 2 if executor is not None else 0
+
+    def drain(limit: int) -> None:
+        while len(inflight) > limit:
+            owner_id, pending, plan, fut = inflight.popleft()
+            finish(owner_id, pending, plan, fut.result() if fut is not None else [])
 
-    return {
-        "processed": processed,
-        "skipped": skipped,
-        "changed": changed,
-        "missing_after_rules": missing_after_rules,
-        "items": items[:1000],
+    try:
+        for (owner_id, dishes), snap in zip(shards, snapshots):
+            chunks = _iter_chunks(dishes, chunk_size, after_pk.get(owner_id))
+            if timer is not None:
+                chunks = _timed_chunks(chunks, timer)
+            for chunk in chunks:
+                pending: List = []
+                records: List[DishRecord] = []
+                for dish in chunk:
+                    stats["processed"] += 1
+
+                    has_manual_flag = bool(getattr(dish, "has_manual_codes", False))
+                    current_value = (getattr(dish, "generated_codes", "") or "").strip()
+
+                    if has_manual_flag and not force:
+                        stats["skipped"] += 1
+                        pending.append({
+                            "dish_id": dish.id,
+                            "name": dish.name,
+                            "before": current_value,
+                            "after": "",
+                            "action": "skip_manual",
+                            "skipped": True,
+                        })
+                        continue
+
+                    with stage("normalization"):
+                        text_norm = dish_text_norm(dish)
+
+                    with stage("fingerprint"):
+                        fingerprint = dish_fingerprint(dish, text_norm, snap.version)
+                    if incremental and not force and fingerprint == (getattr(dish, "codes_fingerprint", "") or ""):
+                        stats["unchanged_fingerprint"] += 1
+                        pending.append({
+                            "dish_id": dish.id,
+                            "name": dish.name,
+                            "before": current_value,
+                            "after": current_value,
+                            "action": "unchanged_fingerprint",
+                            "skipped": True,
+                        })
+                        continue
+
+                    pending.append((dish, current_value, has_manual_flag, fingerprint))
+                    records.append(dish_record(dish, text_norm))
+
+                if not pending:
+                    continue
+                plan = None
+                if result_memo is not None and records:
+                    with stage("memo_lookup"):
+                        plan = result_memo.plan(snap.key, records)
+                    records = plan.todo
+                if executor is None:
+                    finish(owner_id, pending, plan, evaluate_many(records, rules[snap.key], timer, batch=batch_matching))
+                else:
+                    fut = (
+                        executor.submit(
+                            rules_workers.evaluate_chunk, snap.key, records, timer is not None, batch_matching,
+                        )
+                        if records else None
+                    )
+                    inflight.append((owner_id, pending, plan, fut))
+                    drain(window)
+        drain(0)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if writer is not None:
+        writer.flush()
+        if timer is not None:
+            timer.incr("dishes_written", writer.dishes_written)
+    if timer is not None and result_memo is not None:
+        timer.incr("memo_hits", result_memo.hits)
+        timer.incr("memo_misses", result_memo.misses)
+
+    result = {
+        **stats,
+        "incremental": incremental,
+        "items": items,
         "dry_run": dry_run,
         "lang": lang,
-        "count": len(items),
+        "count": item_count,
     }
+    if parallel:
+        result["workers"] = workers if executor is not None else 1
+    if writer is not None:
+        result["dish_allergen_rows_created"] = writer.rows_created
+        result["failed_dishes"] = failed_dishes
+        result["resume_token"] = last_token
+    if resume_from:
+        result["resumed_from"] = resume_from
+    return result
@@ -0,0 +1,163 @@
+# core/services/decompound.py
+# -----------------------------------------------------------
+# تفكيك الكلمات المركّبة الألمانية إلى مصطلحات قاموس معروفة
+#   "sesambroetchen" → sesam (+ broetchen)   "walnusspesto" → walnuss
+#   "frischkaese"    → kaese                 "kaesespaetzle" → kaese
+#   - trie أمامي (بدايات) + trie خلفي (نهايات معكوسة) فوق مصطلحات الكلمة الواحدة
+#   - عناصر الربط (Fugenelemente) بين الأجزاء: -s- -n- -en- -es-
+#   - سلسلة من بداية الكلمة وسلسلة من نهايتها؛ الجزء غير المعروف مسموح في الطرف الآخر
+#     إن كان بطول MIN_PART_LEN على الأقل (وإلا "eis" ≠ "ei" + "s")
+#   - الأطول يفوز داخل الكلمة: "milchreis" يلغي "milch" في "milchreispudding"
+#   - O(طول الكلمة × أطول مصطلح) لكل كلمة + كاش لكل كلمة (token → المصطلحات)
+# كلمة معروفة كاملة لا تُفكَّك (المطابقة الكاملة في LexiconMatcher تكفي) — لذا
+# الاستثناءات ("kokosnuss" بدون أكواد) تُضاف كـlexeme عادي.
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+LINKING_MORPHEMES: Dict[str, Tuple[str, ...]] = {
+    "de": ("s", "n", "en", "es"),
+}
+MIN_PART_LEN = 3
+TOKEN_CACHE_SIZE = 65536
+
+
+class _Trie:
+    """trie بسيط على مستوى الأحرف: عقد dict + entry طرفي لكل عقدة."""
+
+    __slots__ = ("goto", "entry")
+
+    def __init__(self) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.entry: List[Optional[object]] = [None]
+
+    def add(self, word: str, entry) -> bool:
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.entry.append(None)
+            node = nxt
+        if self.entry[node] is not None:
+            return False
+        self.entry[node] = entry
+        return True
+
+
+class Decompounder:
+    """
+    - add(term_norm, entry): مصطلح من كلمة واحدة (أول entry لكل مصطلح يفوز، كما في المطابِق)
+    - split(token): (entry, start, end) لكل مصطلح مكوِّن بترتيب موضعه (tuple فارغ = لا تفكيك)
+    الكاش لا يُنقل مع pickle (العمليات الفرعية تبني كاشها بنفسها).
+    """
+
+    def __init__(self, links: Tuple[str, ...] = LINKING_MORPHEMES["de"], cache_size: int = TOKEN_CACHE_SIZE) -> None:
+        self.links = tuple(sorted(set(links), key=len))
+        self.cache_size = cache_size
+        self._fwd = _Trie()
+        self._bwd = _Trie()
+        self._words: Dict[str, object] = {}
+        self._cache: Dict[str, Tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state["_cache"] = {}
+        return state
+
+    @property
+    def node_count(self) -> int:
+        return len(self._fwd.goto) + len(self._bwd.goto)
+
+    def add(self, term_norm: str, entry) -> bool:
+        if len(term_norm) < MIN_PART_LEN or not term_norm.isalpha() or term_norm in self._words:
+            return False
+        self._words[term_norm] = entry
+        self._fwd.add(term_norm, entry)
+        self._bwd.add(term_norm[::-1], entry)
+        self._cache.clear()
+        return True
+
+    def split(self, token: str) -> Tuple:
+        cached = self._cache.get(token)
+        if cached is not None:
+            return cached
+        parts = self._split(token)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[token] = parts
+        return parts
+
+    def _split(self, token: str) -> Tuple:
+        n = len(token)
+        if n < 2 * MIN_PART_LEN or token in self._words or not token.isalpha():
+            return ()
+        spans: List[Tuple[int, int, object]] = []
+
+        # 1) من البداية: أجزاء متتالية (مع عنصر ربط اختياري بينها)
+        goto, entries = self._fwd.goto, self._fwd.entry
+        reach = [False] * (n + 1)
+        reach[0] = True
+        for i in range(n):
+            if not reach[i]:
+                continue
+            node = 0
+            for j in range(i, n):
+                node = goto[node].get(token[j], 0)
+                if not node:
+                    break
+                end = j + 1
+                if entries[node] is None or end - i < MIN_PART_LEN:
+                    continue
+                if end < n and n - end < MIN_PART_LEN:
+                    continue  # بقية أقصر من جزء حقيقي (لاحقة تصريف مثلًا)
+                spans.append((i, end, entries[node]))
+                if end < n:
+                    reach[end] = True
+                    for link in self.links:
+                        if token.startswith(link, end) and n - end - len(link) >= MIN_PART_LEN:
+                            reach[end + len(link)] = True
+
+        # 2) من النهاية: نفس الفكرة على الـtrie المعكوس
+        goto, entries = self._bwd.goto, self._bwd.entry
+        reach = [False] * (n + 1)
+        reach[n] = True
+        for j in range(n, 0, -1):
+            if not reach[j]:
+                continue
+            node = 0
+            for k in range(j - 1, -1, -1):
+                node = goto[node].get(token[k], 0)
+                if not node:
+                    break
+                if entries[node] is None or j - k < MIN_PART_LEN:
+                    continue
+                if 0 < k < MIN_PART_LEN:
+                    continue
+                spans.append((k, j, entries[node]))
+                if k > 0:
+                    reach[k] = True
+                    for link in self.links:
+                        if token.endswith(link, 0, k) and k - len(link) >= MIN_PART_LEN:
+                            reach[k - len(link)] = True
+
+        if not spans:
+            return ()
+        # الأطول يفوز + إزالة التكرار (نفس الجزء من الاتجاهين)
+        spans.sort(key=lambda s: (s[0], -s[1]))
+        out: List[Tuple[object, int, int]] = []
+        max_end = -1
+        for start, end, entry in spans:
+            if end <= max_end:
+                continue
+            max_end = end
+            out.append((entry, start, end))
+        return tuple(out)
@@ -0,0 +1,153 @@
+# core/services/dish_index.py
+# -----------------------------------------------------------
+# إعادة حساب موجّهة بعد تعديل القاموس (بدل تشغيل الدفعة كاملة)
+#   - DishToken: فهرس عكسي كلمة → طبق (يُحدَّث عند حفظ الطبق)
+#   - مصطلح ثابت: الأطباق التي تحتوي كل كلماته (تصفية واسعة؛ المحرك يتحقق)
+#   - مع RULES_DECOMPOUND: مصطلح الكلمة الواحدة قد يكون جزءًا من كلمة مركّبة
+#     ("sesam" في "sesambroetchen") → كل كلمة مفهرسة تحتويه (token__contains)
+#   - مع RULES_FUZZY_MAX_DISTANCE: خطأ إملائي لا يمكن حصره بالفهرس → كل أطباق النطاق
+#   - مصطلح Regex: لا يمكن فهرسته → كل أطباق النطاق
+#   - تعديل Ingredient → Allergen: الأطباق المرتبطة بالمكوّن
+#   - النطاق: أطباق المالك، أو كل الأطباق لمصطلح عام (owner=NULL / GLOBAL_LEXICON_OWNER_ID)
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db.models import Count, Q, QuerySet
+
+from core.models import Dish, DishToken
+from core.dictionary_models import KeywordLexeme
+from core.services.allergen_rules import generate_per_owner
+from core.services.decompound import LINKING_MORPHEMES, MIN_PART_LEN
+from core.services.fuzzy_index import allowed_distance
+from core.services.text_normalize import normalize_text
+
+_GLOBAL_OWNER_ID = getattr(settings, "GLOBAL_LEXICON_OWNER_ID", None)
+
+
+def is_global_owner(owner_id: Optional[int]) -> bool:
+    return owner_id is None or owner_id == _GLOBAL_OWNER_ID
+
+
+@dataclass
+class LexiconChange:
+    """ما تغيّر في قاموس مالك واحد (أو العام)."""
+    owner_id: Optional[int]
+    terms: Set[str] = field(default_factory=set)
+    has_regex: bool = False
+    ingredient_ids: Set[int] = field(default_factory=set)
+
+    def add_lexeme(self, lx: KeywordLexeme) -> None:
+        if lx.is_regex:
+            self.has_regex = True
+        else:
+            self.terms.add(lx.term or "")
+        if lx.ingredient_id:
+            self.ingredient_ids.add(lx.ingredient_id)
+
+    def __bool__(self) -> bool:
+        return bool(self.terms or self.has_regex or self.ingredient_ids)
+
+
+def changes_for_lexemes(lexemes: Iterable[KeywordLexeme]) -> List[LexiconChange]:
+    """يجمع lexemes حسب المالك (كل المصطلحات العامة في تغيير واحد)."""
+    by_owner: Dict[Optional[int], LexiconChange] = {}
+    for lx in lexemes:
+        key = None if is_global_owner(lx.owner_id) else lx.owner_id
+        by_owner.setdefault(key, LexiconChange(owner_id=key)).add_lexeme(lx)
+    return list(by_owner.values())
+
+
+def _scope(owner_id: Optional[int]) -> QuerySet:
+    qs = Dish.objects.all()
+    return qs if is_global_owner(owner_id) else qs.filter(section__menu__user_id=owner_id)
+
+
+def _is_word(term_norm: str) -> bool:
+    """مصطلح كلمة واحدة (كما يُضاف إلى Decompounder/FuzzyIndex في compile_lexicon)."""
+    return bool(term_norm) and " " not in term_norm and term_norm.isalpha()
+
+
+def _decompounds(lang: str) -> bool:
+    return bool(getattr(settings, "RULES_DECOMPOUND", True)) and bool(LINKING_MORPHEMES.get(lang or ""))
+
+
+def _fuzzy_matches(term_norm: str) -> bool:
+    cap = int(getattr(settings, "RULES_FUZZY_MAX_DISTANCE", 0) or 0)
+    return cap > 0 and _is_word(term_norm) and allowed_distance(len(term_norm), cap) > 0
+
+
+def _term_filter(term: str, lang: str = "de") -> Optional[Q]:
+    term_norm = normalize_text(term)
+    tokens = set(term_norm.split())
+    if not tokens:
+        return None
+    if _decompounds(lang) and _is_word(term_norm) and len(term_norm) >= MIN_PART_LEN:
+        # جزء من كلمة مركّبة: أي كلمة مفهرسة تحتوي المصطلح (المحرك يحسم التفكيك)
+        return Q(id__in=DishToken.objects.filter(token__contains=term_norm).values("dish_id"))
+    if any(len(t) > DishToken.MAX_TOKEN_LEN for t in tokens):
+        # كلمة أطول من الفهرس: لا يمكن أن تُطابق كلمة مفهرسة
+        return None
+    matching = (
+        DishToken.objects
+        .filter(token__in=tokens)
+        .values("dish_id")
+        .annotate(n=Count("token"))
+        .filter(n=len(tokens))
+        .values("dish_id")
+    )
+    return Q(id__in=matching)
+
+
+def affected_dishes(change: LexiconChange, lang: str = "de") -> QuerySet:
+    """الأطباق التي قد يتغيّر ناتجها (مجموعة شاملة؛ الحساب نفسه يحسم)."""
+    scope = _scope(change.owner_id)
+    if change.has_regex or any(_fuzzy_matches(normalize_text(t)) for t in change.terms):
+        return scope
+
+    cond = Q()
+    for term in sorted(change.terms):
+        q = _term_filter(term, lang)
+        if q is not None:
+            cond |= q
+    if change.ingredient_ids:
+        cond |= Q(id__in=Dish.ingredients.through.objects
+                  .filter(ingredient_id__in=change.ingredient_ids)
+                  .values("dish_id"))
+    if not cond:
+        return scope.none()
+    return scope.filter(cond)
+
+
+def recompute_affected(
+    changes: Iterable[LexiconChange],
+    lang: str = "de",
+    dry_run: bool = True,
+    restrict_to: Optional[QuerySet] = None,
+) -> Dict:
+    """
+    يشغّل محرك القواعد على الأطباق المتأثّرة فقط (كل مالك بقاموسه).
+    dry_run=True = معاينة الأثر (before/after بدون كتابة).
+    restrict_to: تقييد إضافي (مثل أطباق المستخدم الحالي فقط).
+    """
+    ids_q = Q()
+    any_change = False
+    for change in changes:
+        if not change:
+            continue
+        any_change = True
+        ids_q |= Q(id__in=affected_dishes(change, lang).values("id"))
+
+    base = restrict_to if restrict_to is not None else Dish.objects.all()
+    qs = base.filter(ids_q) if any_change else base.none()
+    res = generate_per_owner(qs, lang=lang, parallel=False, dry_run=dry_run, include_details=False)
+    res["affected"] = res["processed"]
+    res["items"] = [
+        it for it in res["items"]
+        if not it.get("skipped") and (it.get("after") or "") != (it.get("before") or "")
+    ]
+    return res
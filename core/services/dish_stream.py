@@ -0,0 +1,52 @@
+# core/services/dish_stream.py
+# -----------------------------------------------------------
+# تمرير الأطباق على دفعات (keyset pagination) بذاكرة محدودة
+#   - كل دفعة: استعلام واحد للأطباق + prefetch ingredients → allergens
+#   - الذاكرة ∝ حجم الدفعة، والاستعلامات ∝ عدد الدفعات لا عدد الأطباق
+#   - pk > last_pk بدل OFFSET: ثابت الكلفة ويعمل على SQLite و Postgres،
+#     ولا يُبقي cursor مفتوحًا بين دفعات الكتابة (commits)
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from typing import Iterator, List
+
+from django.db.models import Prefetch, QuerySet
+
+from core.models import Dish, Ingredient
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def with_rule_prefetch(qs: QuerySet) -> QuerySet:
+    """ما يحتاجه محرك القواعد لكل طبق بدون استعلامات إضافية."""
+    return (
+        qs.select_related("section__menu")
+        .prefetch_related(
+            Prefetch("ingredients", queryset=Ingredient.objects.prefetch_related("allergens")),
+        )
+    )
+
+
+def dish_chunks(qs: QuerySet, chunk_size: int = DEFAULT_CHUNK_SIZE, *, after_pk: int | None = None) -> Iterator[List[Dish]]:
+    """
+    يرجّع الأطباق كدفعات مرتّبة حسب pk.
+    after_pk: نقطة استئناف (يبدأ بعد هذا الـpk).
+    """
+    chunk_size = max(1, int(chunk_size or DEFAULT_CHUNK_SIZE))
+    base = with_rule_prefetch(qs.order_by("pk"))
+    last = after_pk
+    while True:
+        page = base.filter(pk__gt=last) if last is not None else base
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1].pk
+
+
+def iter_dishes(qs: QuerySet, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dish]:
+    for chunk in dish_chunks(qs, chunk_size):
+        yield from chunk
@@ -0,0 +1,140 @@
+# core/services/fuzzy_index.py
+# -----------------------------------------------------------
+# مطابقة تقريبية للأخطاء الإملائية (SymSpell): "mozarella" → mozzarella, "sesamm" → sesam
+#   - فهرس حذف (deletion neighbourhood) مسبق فوق مصطلحات الكلمة الواحدة المُطبّعة:
+#     كل نسخة من المصطلح بعد حذف ≤ d حروف → المصطلحات الأصلية
+#   - البحث: حذوفات الكلمة نفسها (≤ d) → مرشّحون → تحقّق بمسافة OSA
+#     (Levenshtein + تبديل حرفين متجاورين) → ثابت تقريبًا لكل كلمة
+#   - المسافة حسب الطول: الكلمات القصيرة لا تُقرَّب أبدًا ("brot" ≠ "boot")
+#   - الأقرب يفوز، ثم أولوية الإضافة (المالك ثم العام)؛ كاش لكل كلمة
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Set, Tuple
+
+# (أقل طول, المسافة المسموحة): 5–8 أحرف → 1، 9+ → 2
+LENGTH_DISTANCE: Tuple[Tuple[int, int], ...] = ((9, 2), (5, 1))
+TOKEN_CACHE_SIZE = 65536
+
+
+def allowed_distance(length: int, cap: int = 2) -> int:
+    for min_len, dist in LENGTH_DISTANCE:
+        if length >= min_len:
+            return min(dist, cap)
+    return 0
+
+
+def _deletes(word: str, depth: int) -> Set[str]:
+    out = {word}
+    frontier = {word}
+    for _ in range(depth):
+        nxt = set()
+        for w in frontier:
+            for i in range(len(w)):
+                nxt.add(w[:i] + w[i + 1:])
+        nxt -= out
+        out |= nxt
+        frontier = nxt
+    return out
+
+
+def osa_distance(a: str, b: str, limit: int) -> int:
+    """مسافة OSA (Damerau مقيّدة)؛ limit + 1 إن تجاوزت الحد."""
+    if a == b:
+        return 0
+    la, lb = len(a), len(b)
+    if abs(la - lb) > limit:
+        return limit + 1
+    prev2: List[int] = []
+    prev = list(range(lb + 1))
+    for i in range(1, la + 1):
+        cur = [i] + [0] * lb
+        row_min = i
+        ca = a[i - 1]
+        for j in range(1, lb + 1):
+            cb = b[j - 1]
+            cost = 0 if ca == cb else 1
+            v = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                v = min(v, prev2[j - 2] + 1)
+            cur[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[lb] if prev[lb] <= limit else limit + 1
+
+
+class FuzzyIndex:
+    """
+    - add(term_norm, entry): مصطلح من كلمة واحدة (أول entry لكل مصطلح يفوز)
+    - lookup(token): (entry, term_norm, distance) لأقرب مصطلح ضمن المسافة المسموحة، أو None
+    max_distance: سقف عام (1 أو 2)؛ الكاش لا يُنقل مع pickle.
+    """
+
+    def __init__(self, max_distance: int = 2, cache_size: int = TOKEN_CACHE_SIZE) -> None:
+        self.max_distance = max(0, min(2, int(max_distance)))
+        self.cache_size = cache_size
+        self._terms: List[Tuple[str, object, int]] = []
+        self._known: Set[str] = set()
+        self._index: Dict[str, List[int]] = {}
+        self._cache: Dict[str, Optional[Tuple[object, str, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state["_cache"] = {}
+        return state
+
+    @property
+    def key_count(self) -> int:
+        return len(self._index)
+
+    def add(self, term_norm: str, entry) -> bool:
+        if not term_norm.isalpha() or term_norm in self._known:
+            return False
+        depth = allowed_distance(len(term_norm), self.max_distance)
+        if depth == 0:
+            return False
+        idx = len(self._terms)
+        self._terms.append((term_norm, entry, depth))
+        self._known.add(term_norm)
+        for d in _deletes(term_norm, depth):
+            self._index.setdefault(d, []).append(idx)
+        self._cache.clear()
+        return True
+
+    def lookup(self, token: str) -> Optional[Tuple[object, str, int]]:
+        if token in self._cache:
+            return self._cache[token]
+        found = self._lookup(token)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[token] = found
+        return found
+
+    def _lookup(self, token: str) -> Optional[Tuple[object, str, int]]:
+        depth = allowed_distance(len(token), self.max_distance)
+        if depth == 0 or token in self._known or not token.isalpha():
+            return None
+        best: Optional[Tuple[int, int]] = None
+        seen: Set[int] = set()
+        for d in _deletes(token, depth):
+            for idx in self._index.get(d, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                term, _, term_depth = self._terms[idx]
+                limit = min(depth, term_depth)
+                dist = osa_distance(token, term, limit)
+                if dist <= limit and (best is None or (dist, idx) < best):
+                    best = (dist, idx)
+        if best is None:
+            return None
+        term, entry, _ = self._terms[best[1]]
+        return entry, term, best[0]
@@ -0,0 +1,375 @@
+# core/services/lexicon_cache.py
+# -----------------------------------------------------------
+# كاش لقطات القاموس (Lexicon Snapshot) داخل العملية
+#   - المفتاح: (owner_id, lang, lexicon_version)
+#   - القيمة: هياكل Python بسيطة وغير قابلة للتعديل (entries + maps + automaton)
+#   - الإخلاء: LRU حسب الحجم التقريبي بالبايت (LEXICON_CACHE_MAX_BYTES)
+#   - الإبطال: LexiconVersion يُرفع من إشارات KeywordLexeme/Ingredient/Allergen/NegationCue
+# يستخدمه كل من allergen_rules و rules_engine.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Q, Case, When, Value, IntegerField
+
+from core.models import Ingredient
+from core.dictionary_models import KeywordLexeme, LexiconVersion, NegationCue
+from core.services.lexicon_matcher import LexemeEntry, CompiledLexicon, compile_lexicon
+from core.services.negation import NegationCueEntry, NegationRules, merge_cues
+from core.services.text_normalize import normalize_text
+from core.rules_core import RulesSnapshot, compile_lexeme_patterns
+
+_GLOBAL_OWNER_ID = getattr(settings, "GLOBAL_LEXICON_OWNER_ID", None)
+_DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+# -----------------------
+# هيكل اللقطة
+# -----------------------
+@dataclass(frozen=True)
+class IngredientCodes:
+    """أكواد مكوّن واحد كما تُرى من محرك القواعد."""
+    name: str
+    letters: Tuple[str, ...] = ()
+    numbers: Tuple[int, ...] = ()
+
+
+@dataclass(frozen=True)
+class LexiconSnapshot:
+    owner_id: Optional[int]
+    lang: str
+    version: str
+    entries: Tuple[LexemeEntry, ...]                      # بالترتيب: المالك ثم العام ثم GLOBAL
+    lexicon: CompiledLexicon                              # automaton + regex جاهزة
+    syn2codes: Mapping[str, FrozenSet[str]]               # مرادف مُطبّع → أكواد
+    ingredient_codes: Mapping[int, IngredientCodes]       # ingredient_id → أكواد/إضافات
+    negation: NegationRules                               # عبارات نفي مُجمَّعة (DB + افتراضية)
+    size_bytes: int = 0
+    rules: Optional[RulesSnapshot] = None                 # الجزء الصِّرف (قابل لـpickle) لـrules_core
+
+    @property
+    def key(self) -> Tuple[Optional[int], str, str]:
+        return (self.owner_id, self.lang, self.version)
+
+
+# -----------------------
+# تحميل من DB
+# -----------------------
+def _owner_precedence(owner_id: int | None) -> Tuple[Q, Case]:
+    """فلتر (المالك + العام + GLOBAL_LEXICON_OWNER_ID) + ترتيب يفضّل المالك ثم NULL ثم GLOBAL."""
+    owners = (
+        Q(owner_id=owner_id) |
+        Q(owner__isnull=True) |
+        (Q(owner_id=_GLOBAL_OWNER_ID) if _GLOBAL_OWNER_ID is not None else Q(pk__in=[]))
+    )
+    rank = Case(
+        When(owner_id=owner_id, then=Value(0)),
+        When(owner__isnull=True, then=Value(1)),
+        When(owner_id=_GLOBAL_OWNER_ID, then=Value(2)),
+        default=Value(3),
+        output_field=IntegerField(),
+    )
+    return owners, rank
+
+
+def _resolve_lexemes(owner_id: int | None, lang: str) -> List[KeywordLexeme]:
+    """
+    نجلب القواميس بالترتيب:
+      1) قاموس المالك (إن وُجد owner_id)
+      2) القاموس العام الحقيقي owner IS NULL
+      3) القاموس المُعرّف في settings.GLOBAL_LEXICON_OWNER_ID (إن وُجد)
+    مع ترتيب يفضّل نتائج المالك ثم NULL ثم GLOBAL.
+    """
+    owners, rank = _owner_precedence(owner_id)
+    qs = (
+        KeywordLexeme.objects
+        .filter(Q(is_active=True, lang__iexact=lang) & owners)
+        .select_related("ingredient")
+        .prefetch_related("allergens", "ingredient__allergens")
+        .annotate(owner_rank=rank)
+        .order_by("owner_rank", "id")
+    )
+    return list(qs)
+
+
+def _resolve_negation_cues(owner_id: int | None, lang: str) -> Tuple[NegationCueEntry, ...]:
+    """
+    صفوف NegationCue (المالك ثم العام) مدموجة مع العبارات الافتراضية.
+    نقرأ غير المفعّلة أيضًا: صف غير مفعّل يعطّل العبارة الافتراضية المماثلة.
+    """
+    owners, rank = _owner_precedence(owner_id)
+    qs = (
+        NegationCue.objects
+        .filter(Q(lang__iexact=lang) & owners)
+        .annotate(owner_rank=rank)
+        .order_by("owner_rank", "id")
+    )
+    rows = [
+        NegationCueEntry(
+            cue_norm=(c.cue or "").strip() if c.is_regex else c.normalized_cue,
+            is_regex=bool(c.is_regex),
+            window_before=int(c.window_before or 0),
+            window_after=int(c.window_after or 0),
+            is_active=bool(c.is_active),
+        )
+        for c in qs
+    ]
+    return merge_cues(rows)
+
+
+def _ingredient_codes(ing: Ingredient) -> IngredientCodes:
+    letters = tuple(dict.fromkeys(
+        (a.code or "").strip().upper() for a in ing.allergens.all() if (a.code or "").strip()
+    ))
+    numbers: List[int] = []
+    for n in (ing.additives or []):
+        try:
+            numbers.append(int(n))
+        except Exception:
+            pass
+    return IngredientCodes(
+        name=(ing.name or "").strip() or "Ingredient",
+        letters=letters,
+        numbers=tuple(dict.fromkeys(numbers)),
+    )
+
+
+def _lexeme_entry(lx: KeywordLexeme) -> LexemeEntry:
+    """
+    يحوّل KeywordLexeme (مع prefetch) إلى LexemeEntry مضغوط:
+    الأكواد + الإضافات + أسباب كل كود تُحسب مرة واحدة لكل قاموس بدل كل طبق.
+    """
+    raw_term = (lx.term or "").strip()
+    letters: List[str] = []
+    numbers: List[int] = []
+    prov: List[Tuple[str, str]] = []
+
+    # 1) أكواد على الـlexeme نفسه
+    for a in lx.allergens.all():
+        c = (a.code or "").strip().upper()
+        if c:
+            letters.append(c)
+            prov.append((c, f'Lexeme: "{raw_term}" → {c}'))
+
+    # 2) عبر Ingredient مرتبط بالـlexeme
+    if lx.ingredient_id:
+        try:
+            for a in lx.ingredient.allergens.all():
+                c = (a.code or "").strip().upper()
+                if c:
+                    letters.append(c)
+                    prov.append((c, f'Lexeme: "{raw_term}" → Ingredient: {lx.ingredient.name} → {c}'))
+            for n in (lx.ingredient.additives or []):
+                try:
+                    numbers.append(int(n))
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+    return LexemeEntry(
+        id=lx.id,
+        term=raw_term,
+        term_norm=normalize_text(raw_term),
+        is_regex=bool(lx.is_regex),
+        letters=tuple(dict.fromkeys(letters)),
+        numbers=tuple(dict.fromkeys(numbers)),
+        provenance=tuple(prov),
+    )
+
+
+def _approx_size(obj, _seen: Optional[set] = None) -> int:
+    """تقدير تقريبي لحجم هيكل متداخل (tuple/dict/frozenset/dataclass) بالبايت."""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, Mapping):
+        for k, v in obj.items():
+            size += _approx_size(k, seen) + _approx_size(v, seen)
+    elif isinstance(obj, (tuple, list, set, frozenset)):
+        for it in obj:
+            size += _approx_size(it, seen)
+    elif hasattr(obj, "__dataclass_fields__"):
+        for name in obj.__dataclass_fields__:
+            size += _approx_size(getattr(obj, name), seen)
+    return size
+
+
+def build_lexicon_snapshot(owner_id: int | None, lang: str, version: str) -> LexiconSnapshot:
+    """يبني لقطة كاملة من DB (lexemes + مكوّنات المالك + عبارات النفي)."""
+    lexemes = _resolve_lexemes(owner_id=owner_id, lang=lang)
+    entries = tuple(_lexeme_entry(lx) for lx in lexemes if (lx.term or "").strip())
+
+    ingredients: Dict[int, IngredientCodes] = {}
+    syn2codes: Dict[str, set] = {}
+
+    # 1) مكوّنات المالك + مرادفاتها
+    if owner_id is not None:
+        for ing in Ingredient.objects.filter(owner_id=owner_id).prefetch_related("allergens"):
+            codes = _ingredient_codes(ing)
+            ingredients[ing.id] = codes
+            for syn in (ing.synonyms or []):
+                syn_norm = normalize_text(syn)
+                if syn_norm:
+                    syn2codes.setdefault(syn_norm, set()).update(codes.letters)
+
+    # 2) مكوّنات مربوطة بالـlexemes (قد تكون عامة): الأكواد + المرادفات
+    by_id = {e.id: e for e in entries}
+    for lx in lexemes:
+        if not lx.ingredient_id:
+            continue
+        ing = lx.ingredient
+        if ing.id not in ingredients:
+            ingredients[ing.id] = _ingredient_codes(ing)
+        entry = by_id.get(lx.id)
+        codes = set(entry.letters) if entry else set()
+        for syn in (ing.synonyms or []):
+            syn_norm = normalize_text(syn)
+            if syn_norm:
+                syn2codes.setdefault(syn_norm, set()).update(codes)
+
+    syn_plain = {k: frozenset(v) for k, v in syn2codes.items()}
+    syn_frozen = MappingProxyType(syn_plain)
+    ing_frozen = MappingProxyType(dict(ingredients))
+    lexicon = compile_lexicon(
+        entries,
+        lang=lang if getattr(settings, "RULES_DECOMPOUND", True) else None,
+        fuzzy_distance=int(getattr(settings, "RULES_FUZZY_MAX_DISTANCE", 0) or 0),
+    )
+    cues = _resolve_negation_cues(owner_id, lang)
+    negation = NegationRules(cues)
+    lexeme_codes = tuple(
+        (e.term_norm, e.is_regex, frozenset(e.letters))
+        for e in entries
+        if e.term_norm and e.letters
+    )
+
+    # حجم تقريبي: entries + maps + عقد الـautomaton/الـtrie (~200 بايت لكل عقدة) + مفاتيح فهرس الحذف
+    size = (
+        _approx_size(entries)
+        + _approx_size(dict(syn_frozen))
+        + _approx_size(dict(ing_frozen))
+        + _approx_size(cues)
+        + 200 * lexicon.matcher.node_count
+        + 200 * (lexicon.compounds.node_count if lexicon.compounds is not None else 0)
+        + 120 * (lexicon.fuzzy.key_count if lexicon.fuzzy is not None else 0)
+    )
+    return LexiconSnapshot(
+        owner_id=owner_id,
+        lang=lang,
+        version=version,
+        entries=entries,
+        lexicon=lexicon,
+        syn2codes=syn_frozen,
+        ingredient_codes=ing_frozen,
+        negation=negation,
+        size_bytes=size,
+        rules=RulesSnapshot(
+            key=(owner_id, lang, version),
+            lexicon=lexicon,
+            negation=negation,
+            syn2codes=syn_plain,
+            lexeme_codes=lexeme_codes,
+            lexeme_patterns=compile_lexeme_patterns(lexeme_codes),
+        ),
+    )
+
+
+# -----------------------
+# LRU حسب الحجم
+# -----------------------
+class SnapshotLRU:
+    """
+    LRU آمن للخيوط (threads) يُخلي الأقدم استخدامًا حتى يعود الحجم الكلي تحت max_bytes.
+    لقطة أكبر من الحد كاملًا لا تُخزَّن (تُستخدم لمرة واحدة فقط).
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = int(max_bytes)
+        self._data: "OrderedDict[Tuple, LexiconSnapshot]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Tuple) -> Optional[LexiconSnapshot]:
+        with self._lock:
+            snap = self._data.get(key)
+            if snap is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return snap
+
+    def put(self, snap: LexiconSnapshot) -> None:
+        key = snap.key
+        with self._lock:
+            # نُسقط الإصدارات القديمة لنفس (owner, lang)
+            for old_key in [k for k in self._data if k[:2] == key[:2] and k != key]:
+                self._bytes -= self._data.pop(old_key).size_bytes
+            if snap.size_bytes > self.max_bytes:
+                return
+            prev = self._data.pop(key, None)
+            if prev is not None:
+                self._bytes -= prev.size_bytes
+            self._data[key] = snap
+            self._bytes += snap.size_bytes
+            while self._bytes > self.max_bytes and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted.size_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+_CACHE = SnapshotLRU(getattr(settings, "LEXICON_CACHE_MAX_BYTES", _DEFAULT_MAX_BYTES))
+
+
+def lexicon_version(owner_id: int | None) -> str:
+    return LexiconVersion.current(owner_id)
+
+
+def get_lexicon_snapshot(owner_id: int | None, lang: str = "de") -> LexiconSnapshot:
+    """
+    يرجّع لقطة القاموس لـ(owner, lang) من الكاش، أو يبنيها إن تغيّر الإصدار.
+    كلفة الحالة الساخنة: استعلام واحد صغير على LexiconVersion.
+    """
+    lang = (lang or "de").lower()
+    version = lexicon_version(owner_id)
+    key = (owner_id, lang, version)
+    snap = _CACHE.get(key)
+    if snap is None:
+        snap = build_lexicon_snapshot(owner_id, lang, version)
+        _CACHE.put(snap)
+    return snap
+
+
+def clear_lexicon_cache() -> None:
+    _CACHE.clear()
+
+
+def cache_stats() -> Dict[str, int]:
+    """hits/misses/entries/bytes لكاش اللقطات في هذه العملية (للقياس والتشخيص)."""
+    return {"hits": _CACHE.hits, "misses": _CACHE.misses, "entries": len(_CACHE), "bytes": _CACHE.total_bytes}
@@ -0,0 +1,360 @@
+# core/services/lexicon_matcher.py
+# -----------------------------------------------------------
+# مطابِق قاموس مُجمَّع (Aho-Corasick) فوق المصطلحات المُطبّعة
+#   - يُبنى مرة واحدة لكل قاموس (owner, lang)
+#   - تمريرة واحدة على نص الطبق تُرجع كل المطابقات مع حدود الكلمات
+#   - الأطول يفوز: "erdnuss butter" يلغي "butter" داخل نفس المدى
+#   - أنماط Regex: تُفحص (regex_guard) وتُجمَّع مرة واحدة لكل قاموس، مع مرشّح
+#     نص ثابت إلزامي لكل نمط → لا re.search إلا للأنماط المرشّحة فعلًا
+#   - اختياريًا Decompounder (services/decompound) لتفكيك الكلمات المركّبة الألمانية
+#     و FuzzyIndex (services/fuzzy_index) للأخطاء الإملائية في الكلمات غير المطابقة
+#   - PhraseIndex: نفس المصطلحات الثابتة على مستوى الكلمات لمطابقة دفعة نصوص معًا
+#     (posting map كلمة → مواضع) بنتيجة مطابقة لـLexiconMatcher.find لكل نص
+# لا يعتمد على Django: يعمل على بيانات بسيطة فقط.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from core.services.decompound import LINKING_MORPHEMES, Decompounder
+from core.services.fuzzy_index import FuzzyIndex
+from core.services.regex_guard import check_regex, compile_regex
+
+
+@dataclass(frozen=True)
+class LexemeEntry:
+    """
+    نسخة مضغوطة وغير قابلة للتعديل من KeywordLexeme:
+      - letters/numbers: الأكواد الناتجة (مباشرة أو عبر Ingredient)
+      - provenance: أزواج (code, reason) لشرح مصدر كل كود
+    """
+    id: int
+    term: str
+    term_norm: str
+    is_regex: bool = False
+    letters: Tuple[str, ...] = ()
+    numbers: Tuple[int, ...] = ()
+    provenance: Tuple[Tuple[str, str], ...] = ()
+
+
+@dataclass(frozen=True)
+class LexiconHit:
+    """مطابقة واحدة داخل النص المُطبّع: [start, end) + الـlexeme الفائز."""
+    start: int
+    end: int
+    entry: LexemeEntry
+
+    @property
+    def term_norm(self) -> str:
+        return self.entry.term_norm
+
+
+class LexiconMatcher:
+    """
+    Automaton من نوع Aho-Corasick على مستوى الأحرف.
+    - add(term_norm, entry): أول entry لكل مصطلح هو الفائز (ترتيب الأولوية يقرّره المستدعي).
+    - build(): يحسب روابط الفشل (fail) وروابط المخرجات (output links).
+    - find(text_norm): يرجّع المطابقات ذات حدود الكلمات بعد حذف المحتواة داخل أطول منها.
+    """
+
+    __slots__ = ("_goto", "_fail", "_out", "_term_len", "_entry", "_built")
+
+    def __init__(self) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [0]                 # أقرب عقدة لاحقة تحمل مصطلحًا
+        self._term_len: List[int] = [0]            # 0 = لا مصطلح ينتهي هنا
+        self._entry: List[Optional[LexemeEntry]] = [None]
+        self._built = False
+
+    def __len__(self) -> int:
+        return sum(1 for e in self._entry if e is not None)
+
+    @property
+    def node_count(self) -> int:
+        return len(self._goto)
+
+    def add(self, term_norm: str, entry: LexemeEntry) -> bool:
+        if not term_norm:
+            return False
+        node = 0
+        for ch in term_norm:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(0)
+                self._term_len.append(0)
+                self._entry.append(None)
+            node = nxt
+        if self._entry[node] is not None:
+            return False
+        self._entry[node] = entry
+        self._term_len[node] = len(term_norm)
+        self._built = False
+        return True
+
+    def build(self) -> "LexiconMatcher":
+        goto, fail, out, term_len = self._goto, self._fail, self._out, self._term_len
+        queue: deque = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            out[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fc = goto[f].get(ch, 0)
+                fail[child] = fc
+                out[child] = fc if term_len[fc] else out[fc]
+                queue.append(child)
+        self._built = True
+        return self
+
+    def find(self, text_norm: str) -> List[LexiconHit]:
+        """
+        تمريرة واحدة على النص. حدود الكلمة = بداية/نهاية النص أو مسافة
+        (النص المُطبّع لا يحتوي إلا \\w ومسافات مفردة).
+        """
+        if not text_norm or len(self._goto) == 1:
+            return []
+        if not self._built:
+            self.build()
+
+        goto, fail, out, term_len, entries = self._goto, self._fail, self._out, self._term_len, self._entry
+        n = len(text_norm)
+        raw: List[Tuple[int, int, LexemeEntry]] = []
+        node = 0
+        for i, ch in enumerate(text_norm):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not node:
+                continue
+            # الحد الأيمن يجب أن يكون مسافة/نهاية — وإلا لا داعي لفحص المخرجات
+            if i + 1 < n and text_norm[i + 1] != " ":
+                continue
+            o = node if term_len[node] else out[node]
+            while o:
+                start = i + 1 - term_len[o]
+                if start == 0 or text_norm[start - 1] == " ":
+                    raw.append((start, i + 1, entries[o]))  # type: ignore[arg-type]
+                o = out[o]
+
+        if not raw:
+            return []
+        return _longest_wins(raw)
+
+
+def _longest_wins(raw: List[Tuple[int, int, LexemeEntry]]) -> List[LexiconHit]:
+    """نحذف كل مطابقة محتواة داخل مدى مطابقة أخرى (الأطول يفوز)."""
+    raw.sort(key=lambda r: (r[0], -r[1]))
+    hits: List[LexiconHit] = []
+    max_end = -1
+    for start, end, entry in raw:
+        if end <= max_end:
+            continue
+        max_end = end
+        hits.append(LexiconHit(start, end, entry))
+    return hits
+
+
+class PhraseIndex:
+    """
+    المصطلحات الثابتة كـtrie على مستوى الكلمات (كلمة → عقدة، entry طرفي لكل عقدة).
+    find_many(texts): تمريرة واحدة لتقطيع كل النصوص إلى posting map
+    (كلمة → [(نص, موضع)])، ثم كل كلمة مميّزة تُفحص مرة واحدة مقابل جذر الـtrie،
+    والعبارات متعددة الكلمات تُتحقَّق موضعيًا بالسير على الكلمات التالية في نفس النص.
+    الكلفة ≈ مجموع الكلمات + المطابقات، والكلمات المكرّرة بين الأطباق تُفحص مرة واحدة.
+    """
+
+    __slots__ = ("_root", "_size")
+
+    def __init__(self) -> None:
+        # عقدة = (أبناء: كلمة → عقدة, [entry أو None])
+        self._root: Dict[str, Tuple[Dict, List[Optional[LexemeEntry]]]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, term_norm: str, entry: LexemeEntry) -> None:
+        """يُستدعى فقط للمصطلحات التي قبلها LexiconMatcher.add (أول entry يفوز)."""
+        children = self._root
+        node = None
+        for tok in term_norm.split(" "):
+            node = children.get(tok)
+            if node is None:
+                node = ({}, [None])
+                children[tok] = node
+            children = node[0]
+        if node is not None and node[1][0] is None:
+            node[1][0] = entry
+            self._size += 1
+
+    def find_many(self, texts: Sequence[str]) -> List[List[LexiconHit]]:
+        docs: List[List[str]] = []
+        starts: List[List[int]] = []
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for d, text in enumerate(texts):
+            toks = text.split(" ") if text else []
+            offs: List[int] = []
+            pos = 0
+            for i, tok in enumerate(toks):
+                offs.append(pos)
+                pos += len(tok) + 1
+                occ = postings.get(tok)
+                if occ is None:
+                    postings[tok] = [(d, i)]
+                else:
+                    occ.append((d, i))
+            docs.append(toks)
+            starts.append(offs)
+
+        raw: List[List[Tuple[int, int, LexemeEntry]]] = [[] for _ in texts]
+        root = self._root
+        for tok, occ in postings.items():
+            first = root.get(tok)
+            if first is None:
+                continue
+            children, slot = first
+            entry = slot[0]
+            for d, i in occ:
+                offs = starts[d]
+                if entry is not None:
+                    raw[d].append((offs[i], offs[i] + len(tok), entry))
+                if not children:
+                    continue
+                toks = docs[d]
+                kids = children
+                for j in range(i + 1, len(toks)):
+                    node = kids.get(toks[j])
+                    if node is None:
+                        break
+                    kids, nslot = node
+                    if nslot[0] is not None:
+                        raw[d].append((offs[i], offs[j] + len(toks[j]), nslot[0]))
+                    if not kids:
+                        break
+
+        return [_longest_wins(r) if r else [] for r in raw]
+
+
+class RegexSet:
+    """
+    أنماط regex لقاموس واحد (مفحوصة ومُجمَّعة مرة واحدة لكل لقطة)، بالترتيب:
+      - كل نمط مع نص ثابت إلزامي (literal من regex_guard): إن لم يظهر في النص
+        لا يُشغَّل النمط (فحص `in` رخيص بدل re.search لكل lexeme)
+      - أنماط بلا literal تُشغَّل دائمًا
+    find() يعطي نفس نتيجة re.search لكل نمط على حدة (أول مدى لكل نمط).
+    النص المُطبّع بحروف صغيرة، والأنماط تُجمَّع بـIGNORECASE (regex_guard.REGEX_FLAGS).
+    """
+
+    __slots__ = ("entries", "_gated")
+
+    def __init__(self, entries: Sequence[LexemeEntry], literals: Sequence[str]) -> None:
+        self.entries: Tuple[LexemeEntry, ...] = tuple(entries)
+        self._gated: Tuple[Tuple[str, re.Pattern], ...] = tuple(
+            (literal, compile_regex(e.term)) for e, literal in zip(self.entries, literals)
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def find(self, text_norm: str, stats: Optional[Dict[str, int]] = None) -> List[Tuple[LexemeEntry, int, int]]:
+        """(entry, start, end) لكل نمط مطابق بترتيب الأولوية؛ stats["regex_evaluations"] = الأنماط المُشغَّلة."""
+        if not text_norm or not self.entries:
+            return []
+        out: List[Tuple[LexemeEntry, int, int]] = []
+        evaluations = 0
+        entries = self.entries
+        for i, (literal, pattern) in enumerate(self._gated):
+            if literal and literal not in text_norm:
+                continue
+            evaluations += 1
+            m = pattern.search(text_norm)
+            if m is not None:
+                out.append((entries[i], m.start(), m.end()))
+        if stats is not None:
+            stats["regex_evaluations"] = stats.get("regex_evaluations", 0) + evaluations
+        return out
+
+
+_EMPTY_REGEX_SET = RegexSet((), ())
+
+
+@dataclass(frozen=True)
+class CompiledLexicon:
+    """
+    قاموس جاهز للمطابقة: automaton للمصطلحات الثابتة + RegexSet مرتّب.
+    rejected_regex: (lexeme_id, السبب) للأنماط المستبعدة (خاطئة أو خطرة).
+    compounds: مفكِّك الكلمات المركّبة (None = معطّل لهذه اللغة).
+    fuzzy: فهرس المطابقة التقريبية (None = معطّل).
+    phrases: نفس مصطلحات الـautomaton مفهرسة بالكلمات لمطابقة دفعة نصوص (find_many).
+    """
+    matcher: LexiconMatcher
+    regex: RegexSet = _EMPTY_REGEX_SET
+    rejected_regex: Tuple[Tuple[int, str], ...] = ()
+    compounds: Optional[Decompounder] = None
+    fuzzy: Optional[FuzzyIndex] = None
+    phrases: Optional[PhraseIndex] = None
+
+    @property
+    def regex_entries(self) -> Tuple[LexemeEntry, ...]:
+        return self.regex.entries
+
+    def __len__(self) -> int:
+        return len(self.matcher) + len(self.regex)
+
+
+def compile_lexicon(entries: Iterable[LexemeEntry], lang: str | None = None, fuzzy_distance: int = 0) -> CompiledLexicon:
+    """
+    يبني CompiledLexicon من entries مرتّبة حسب الأولوية (المالك ثم العام).
+    أول مصطلح مُطبّع يفوز، كما في الحلقة القديمة (seen_terms).
+    أنماط regex تمرّ بالفحص الثابت (regex_guard) فقط هنا؛ الفحص الديناميكي عند الحفظ.
+    lang: لغة لها عناصر ربط في LINKING_MORPHEMES → يُبنى Decompounder من مصطلحات الكلمة الواحدة.
+    fuzzy_distance: 1 أو 2 → FuzzyIndex فوق نفس المصطلحات (0 = بدون مطابقة تقريبية).
+    """
+    matcher = LexiconMatcher()
+    phrases = PhraseIndex()
+    links = LINKING_MORPHEMES.get(lang or "")
+    compounds = Decompounder(links) if links else None
+    fuzzy = FuzzyIndex(fuzzy_distance) if fuzzy_distance > 0 else None
+    regexes: List[LexemeEntry] = []
+    literals: List[str] = []
+    rejected: List[Tuple[int, str]] = []
+    for e in entries:
+        if not e.term_norm:
+            continue
+        if e.is_regex:
+            verdict = check_regex(e.term, dynamic=False)
+            if not verdict.ok:
+                rejected.append((e.id, verdict.reason))
+                continue
+            regexes.append(e)
+            literals.append(verdict.literal)
+        else:
+            if matcher.add(e.term_norm, e):
+                phrases.add(e.term_norm, e)
+            if " " not in e.term_norm:
+                if compounds is not None:
+                    compounds.add(e.term_norm, e)
+                if fuzzy is not None:
+                    fuzzy.add(e.term_norm, e)
+    return CompiledLexicon(
+        matcher=matcher.build(),
+        regex=RegexSet(regexes, literals) if regexes else _EMPTY_REGEX_SET,
+        rejected_regex=tuple(rejected),
+        compounds=compounds if compounds else None,
+        fuzzy=fuzzy if fuzzy else None,
+        phrases=phrases,
+    )
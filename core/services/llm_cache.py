@@ -0,0 +1,212 @@
+# core/services/llm_cache.py
+# -----------------------------------------------------------
+# كاش ردود LLM حسب prompt hash (نفس الطلب → نفس الرد فورًا وبدون تكلفة)
+#   - prompt_hash(): sha256 لـ(نوع البرومبت + إصدار القالب + النموذج + temperature
+#     + المدخل المُطبّع) — تغيير القالب يرفع إصداره فتتجاهل الردود القديمة تلقائيًا
+#   - LLMCache: LRU في الذاكرة (آمن مع threads) أمام مخزن DB اختياري، بنفس TTL المخزن
+#     (عنصر LRU ينتهي مع صفّه في DB ولا يُخدم بعده من عامل طويل العمر)
+#   - DbLLMStore: جدول LLMResponseCache مع TTL وتقليم حسب الحجم (كل PRUNE_EVERY كتابة)
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.dictionary_models import LLMResponseCache
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ROWS = 50_000
+PRUNE_EVERY = 200
+
+
+def prompt_hash(kind: str, version: int, model_name: str, temperature: float, payload) -> str:
+    raw = json.dumps(
+        [kind, int(version), model_name or "", round(float(temperature), 3), payload],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DbLLMStore:
+    """قراءة/كتابة مجمّعة في LLMResponseCache (الصفوف المنتهية لا تُرجع)."""
+
+    def __init__(self, ttl_seconds: int = DEFAULT_TTL_SECONDS, max_rows: int = DEFAULT_MAX_ROWS) -> None:
+        self.ttl_seconds = int(ttl_seconds)
+        self.max_rows = int(max_rows)
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _cutoff(self):
+        return timezone.now() - timedelta(seconds=self.ttl_seconds)
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, object]:
+        return {d: payload for d, (payload, _) in self.load(digests).items()}
+
+    def load(self, digests: Iterable[str]) -> Dict[str, Tuple[object, float]]:
+        """digest → (payload, expires_at بتوقيت time.time()) للصفوف غير المنتهية."""
+        digests = list(digests)
+        if not digests:
+            return {}
+        rows = LLMResponseCache.objects.filter(digest__in=digests, created_at__gte=self._cutoff())
+        return {
+            d: (payload, created_at.timestamp() + self.ttl_seconds)
+            for d, payload, created_at in rows.values_list("digest", "payload", "created_at")
+        }
+
+    def set_many(self, items: Dict[str, object], kind: str, model_name: str) -> None:
+        if not items:
+            return
+        # الصف المنتهي بنفس digest يُستبدل (ignore_conflicts وحده يُبقي القديم)
+        LLMResponseCache.objects.filter(digest__in=list(items), created_at__lt=self._cutoff()).delete()
+        LLMResponseCache.objects.bulk_create(
+            [LLMResponseCache(digest=d, kind=kind, model_name=model_name or "", payload=p) for d, p in items.items()],
+            ignore_conflicts=True,
+        )
+        with self._lock:
+            self._writes += len(items)
+            due = self._writes >= PRUNE_EVERY
+            if due:
+                self._writes = 0
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """يحذف المنتهي ثم الأقدم فوق max_rows."""
+        deleted, _ = LLMResponseCache.objects.filter(created_at__lt=self._cutoff()).delete()
+        boundary = (
+            LLMResponseCache.objects.order_by("-id").values_list("id", flat=True)[self.max_rows:self.max_rows + 1]
+        )
+        boundary = list(boundary)
+        if boundary:
+            extra, _ = LLMResponseCache.objects.filter(id__lte=boundary[0]).delete()
+            deleted += extra
+        return deleted
+
+
+class LLMCache:
+    """
+    key(...): = prompt_hash (llm_ingest يبني المفاتيح عبره بدون استيراد Django)
+    get/get_many: LRU أولًا ثم المخزن (ويُرفع ما وُجد فيه إلى LRU).
+    set/set_many: LRU + المخزن. القيم JSON (dict/list/str).
+    ttl_seconds: عمر عناصر LRU (افتراضيًا TTL المخزن؛ None/0 بدون مخزن = بلا انتهاء)؛
+    العنصر المحمّل من المخزن ينتهي مع صفّه (created_at + TTL).
+    """
+
+    key = staticmethod(prompt_hash)
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        store: Optional[DbLLMStore] = None,
+        ttl_seconds: Optional[int] = None,
+    ) -> None:
+        self.max_entries = max(0, int(max_entries))
+        self.store = store
+        if ttl_seconds is None and store is not None:
+            ttl_seconds = store.ttl_seconds
+        self.ttl_seconds = int(ttl_seconds or 0)
+        self._lru: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl_seconds if self.ttl_seconds else float("inf")
+
+    def _remember(self, digest: str, payload, expires_at: float) -> None:
+        if not self.max_entries:
+            return
+        self._lru[digest] = (payload, expires_at)
+        self._lru.move_to_end(digest)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, digest: str):
+        return self.get_many([digest]).get(digest)
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, object]:
+        wanted = list(dict.fromkeys(digests))
+        found: Dict[str, object] = {}
+        missing = []
+        now = time.time()
+        with self._lock:
+            for d in wanted:
+                entry = self._lru.get(d)
+                if entry is not None and entry[1] <= now:
+                    del self._lru[d]  # منتهٍ: لا يُخدم (صفّه في DB منتهٍ أيضًا)
+                    entry = None
+                if entry is not None:
+                    self._lru.move_to_end(d)
+                    found[d] = entry[0]
+                else:
+                    missing.append(d)
+        if missing and self.store is not None:
+            try:
+                loaded = self.store.load(missing)
+            except Exception:
+                loaded = {}
+            if loaded:
+                with self._lock:
+                    for d, (payload, expires_at) in loaded.items():
+                        self._remember(d, payload, expires_at)
+                        found[d] = payload
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def set(self, digest: str, payload, kind: str, model_name: str = "") -> None:
+        self.set_many({digest: payload}, kind, model_name)
+
+    def set_many(self, items: Dict[str, object], kind: str, model_name: str = "") -> None:
+        if not items:
+            return
+        expires_at = self._expires_at()
+        with self._lock:
+            for d, payload in items.items():
+                self._remember(d, payload, expires_at)
+        if self.store is not None:
+            try:
+                self.store.set_many(items, kind, model_name)
+            except Exception:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+
+
+_default_cache: Optional[LLMCache] = None
+_default_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """كاش العملية المشترك (حجمه ومخزنه من settings.LLM_CACHE_*)."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                store = None
+                if getattr(settings, "LLM_CACHE_PERSIST", True):
+                    store = DbLLMStore(
+                        ttl_seconds=getattr(settings, "LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS),
+                        max_rows=getattr(settings, "LLM_CACHE_MAX_ROWS", DEFAULT_MAX_ROWS),
+                    )
+                _default_cache = LLMCache(
+                    max_entries=getattr(settings, "LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+                    store=store,
+                    ttl_seconds=getattr(settings, "LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS),
+                )
+    return _default_cache
@@ -0,0 +1,56 @@
+# core/services/llm_fanout.py
+# -----------------------------------------------------------
+# توزيع نداءات LLM المستقلة (طبق لكل نداء) على ThreadPoolExecutor بحدّ أقصى
+# للطلبات المتزامنة (settings.LLM_MAX_IN_FLIGHT)
+#   - النتائج تُعاد بنفس ترتيب المدخلات: (ok, result أو الاستثناء)
+#   - threads تشارك عميل OpenAI المجمّع (get_client) وكاش LLM (آمن مع threads)
+#   - كل thread يغلق اتصالات DB التي فتحها (كاش LLMResponseCache) عند انتهائه
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple, TypeVar
+
+from django.conf import settings
+from django.db import connections
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+def max_in_flight(requested: Optional[int] = None) -> int:
+    """الحد من settings؛ الطلب يستطيع تخفيضه فقط (1 = تسلسلي)."""
+    limit = int(getattr(settings, "LLM_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT) or 1)
+    if requested:
+        limit = min(limit, int(requested))
+    return max(1, limit)
+
+
+def _guarded(fn: Callable[[T], R], item: T) -> Tuple[bool, object]:
+    try:
+        return True, fn(item)
+    except Exception as e:
+        return False, e
+
+
+def _in_worker(fn: Callable[[T], R], item: T) -> Tuple[bool, object]:
+    try:
+        return _guarded(fn, item)
+    finally:
+        connections.close_all()
+
+
+def fan_out(fn: Callable[[T], R], items: Sequence[T], limit: int = DEFAULT_MAX_IN_FLIGHT) -> List[Tuple[bool, object]]:
+    """
+    fn(item) لكل عنصر بحد أقصى limit متزامنًا → [(ok, result|exception)] بترتيب items.
+    limit<=1 أو عنصر واحد → تسلسلي في نفس الـthread (بدون pool).
+    """
+    items = list(items)
+    workers = min(max(1, int(limit or 1)), len(items))
+    if workers <= 1:
+        return [_guarded(fn, item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-fanout") as pool:
+        return list(pool.map(lambda item: _in_worker(fn, item), items))
@@ -3,17 +3,32 @@
 # LLM pipeline: Extract German food terms (Zutaten) and map them
 # to allergen letter codes (A..Z). Designed to work with
 # core/llm_clients/openai_client.openai_caller
+# cache (اختياري، services/llm_cache.LLMCache): نفس الطلب لا يُرسل مرتين
+# دفعات: llm_extract_terms_batch (عدة أطباق في برومبت واحد بمفاتيح) و
+# llm_map_terms_to_codes (المصطلحات المميّزة لكل الدفعة، مقسّمة حسب ميزانية tokens)
 # ============================================================
 
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Callable, Dict, Iterable, List, Tuple
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
 import json
 import re
 
+from core.services.text_normalize import normalize_term
+
 # نوع الدالة التي تستدعي نموذج OpenAI (نمررها من الخارج)
 LLMCaller = Callable[..., str]
+# منفّذ الدفعات: runner(fn, items) → [(ok, result|exception)] بنفس الترتيب
+# (services/llm_fanout.fan_out للتوازي؛ الافتراضي تسلسلي)
+Runner = Callable[[Callable, Sequence], List[Tuple[bool, object]]]
+
+# إصدار كل قالب برومبت: جزء من مفتاح الكاش — ارفعه عند أي تعديل على نص القالب/التحليل
+PROMPT_VERSIONS: Dict[str, int] = {
+    "extract_terms": 1,
+    "map_terms": 1,
+    "dish_codes": 1,
+}
 
 
 # ------------------------------------------------------------
@@ -28,6 +43,8 @@ class LLMConfig:
     dry_run: bool = True
     max_output_tokens: int = 512
     timeout: int = 60
+    batch_size: int = 20           # أقصى عدد أطباق/مصطلحات في برومبت دفعة واحد
+    batch_token_budget: int = 6000 # ميزانية تقديرية (مدخل + مخرج) لكل برومبت دفعة
 
 
 # ------------------------------------------------------------
@@ -36,24 +53,10 @@ class LLMConfig:
 # كلمة ألمانية (مع الأحرف الممدودة) + السماح بالمركبات واستخدام -
 _WORD_RE = re.compile(r"[A-Za-zÄÖÜäöüẞß\u00C0-\u017F][A-Za-zÄÖÜäöüẞß\u00C0-\u017F\-]+", re.UNICODE)
 
-def normalize_de(s: str) -> str:
-    """تبسيط/تطبيع بسيط للألمانية: أحرف صغيرة + تحويل ß→ss و ä→ae/ö→oe/ü→ue + مسافات موحّدة."""
-    if not s:
-        return ""
-    x = s.strip().lower()
-    x = re.sub(r"\s+", " ", x)
-    # تحويل بعض البدائل الشائعة
-    repl = {
-        "ß": "ss",
-        "ä": "ae",
-        "ö": "oe",
-        "ü": "ue",
-    }
-    for a, b in repl.items():
-        x = x.replace(a, b)
-    # توحيد بعض العلامات
-    x = x.replace("œ", "oe").replace("æ", "ae")
-    return x
+# التطبيع الموحّد (services/text_normalize) بنسخة تُبقي الشرطة داخل الكلمة ("brioche-bun")
+# كما في المثال داخل البرومبت و_WORD_RE: نفس طيّ الأحرف ("kaese") في القاموس ومحرك القواعد،
+# والمطابقة مع القاموس تمرّ بـnormalize_text. الاسم القديم باقٍ للتوافق.
+normalize_de = normalize_term
 
 def _dedup_keep_order(items: Iterable[str]) -> List[str]:
     seen, out = set(), []
@@ -74,6 +77,26 @@ def _clean_codes_str(codes: str) -> str:
             bag.append(tok)
     return ",".join(_dedup_keep_order(bag))
 
+def prompt_key(cache, kind: str, cfg: "LLMConfig", payload) -> str:
+    """مفتاح الكاش: نوع البرومبت + إصدار القالب + النموذج + temperature + المدخل المُطبّع."""
+    return cache.key(kind, PROMPT_VERSIONS[kind], cfg.model_name, cfg.temperature, payload)
+
+def extract_terms_payload(cfg: "LLMConfig", dish_name: str, dish_description: str) -> Dict[str, object]:
+    return {
+        "name": normalize_de(dish_name or ""),
+        "desc": normalize_de(dish_description or ""),
+        "lang": (cfg.lang or "de").lower(),
+        "max_terms": cfg.max_terms,
+    }
+
+def suggestion_key(cache, cfg: "LLMConfig", dish_name: str, dish_description: str, guess_codes: bool) -> str:
+    """prompt_hash لاقتراح طبق كامل (IngredientSuggestion): الاستخراج (+ تخمين الأكواد) بإصدارات قوالبهما."""
+    payload = {
+        **extract_terms_payload(cfg, dish_name, dish_description),
+        "map_terms": PROMPT_VERSIONS["map_terms"] if guess_codes else None,
+    }
+    return prompt_key(cache, "extract_terms", cfg, payload)
+
 def _parse_json_object_or_array(txt: str):
     """حاول استخراج JSON (object/array) من رد النموذج حتى لو لفّه داخل ```json ...```."""
     if not txt:
@@ -91,10 +114,77 @@ def _parse_json_object_or_array(txt: str):
     except Exception:
         return None
 
+def _approx_tokens(text: str) -> int:
+    """تقدير تقريبي: ~4 أحرف لكل token."""
+    return len(text or "") // 4 + 1
+
+def _split_by_budget(items: Sequence, cost: Callable[[object], int], budget: int, max_items: int) -> List[List]:
+    """يقسّم العناصر بالترتيب إلى دفعات لا تتجاوز budget (تكلفة) ولا max_items (عدد)."""
+    chunks: List[List] = []
+    current: List = []
+    used = 0
+    for item in items:
+        c = cost(item)
+        if current and (used + c > budget or len(current) >= max_items):
+            chunks.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += c
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _serial_runner(fn: Callable, items: Sequence) -> List[Tuple[bool, object]]:
+    results: List[Tuple[bool, object]] = []
+    for item in items:
+        try:
+            results.append((True, fn(item)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
 
 # ------------------------------------------------------------
 # LLM: Extract candidate terms
 # ------------------------------------------------------------
+def _extract_rules(max_terms: int) -> str:
+    return f"""Rules:
+- Output <= {max_terms} items, lowercased, concise single tokens if possible (compound allowed, e.g., "joghurtsose", "sesampaste", "doenerfleisch", "brioche-bun").
+- Skip generic fillers that aren't ingredients (e.g., "gericht", "hausgemacht", "frisch", "lecker", "portion", "klassisch").
+- If ingredient is ambiguous ("sose", "salat"), keep it but prefer more specific forms if present ("joghurtsose", "mayonnaise", "senf", "kaese")."""
+
+_EXTRACT_EXAMPLES = """Examples:
+INPUT: "Döner Teller — Dönerfleisch, Soße, Salat, Kraut, Zwiebeln, Tomaten"
+OUTPUT: ["doenerfleisch","sose","salat","kraut","zwiebeln","tomaten"]
+
+INPUT: "Chicken Wrap mit Joghurtsoße und Sesam"
+OUTPUT: ["chicken","joghurtsose","sesam","wrap"]
+
+INPUT: "Falafel mit Tahini (Sesampaste), Salat, Tomaten"
+OUTPUT: ["falafel","tahini","sesampaste","salat","tomaten"]"""
+
+_EXTRACT_STOPWORDS = {
+    "mit","und","oder","vom","hausgemacht","lecker","frisch","gericht",
+    "portion","gross","klein","grossen","kleinen","serviert","klassisch","spezial",
+    "menu","menue","gerichtname","gerichtnamen","gerichtname","teller","beilage",
+}
+
+def _terms_from_data(data) -> List[str]:
+    if isinstance(data, list):
+        return [normalize_de(str(x)) for x in data if isinstance(x, (str, int, float))]
+    return []
+
+def _finish_terms(cfg: LLMConfig, name: str, desc: str, terms: List[str]) -> List[str]:
+    """Fallback محلي إذا فشل LLM أو النتيجة فارغة + تمييز موحد."""
+    if not terms:
+        text = normalize_de(f"{name} {desc}")
+        cand = _WORD_RE.findall(text)
+        # ترشيح كلمات شائعة لا تفيد
+        cand = [c for c in cand if c not in _EXTRACT_STOPWORDS and len(c) >= 3]
+        # خذ أول max_terms
+        terms = cand[: cfg.max_terms]
+    return _dedup_keep_order([t for t in terms if t])
+
 def llm_extract_terms(
     caller: LLMCaller,
     cfg: LLMConfig,
@@ -102,10 +192,15 @@ def llm_extract_terms(
     dish_description: str,
     *,
     return_raw: bool = False,
-) -> Tuple[List[str], str] | List[str]:
+    cache=None,
+    with_status: bool = False,
+) -> Tuple[List[str], str, bool] | Tuple[List[str], str] | List[str]:
     """
     يرجّع قائمة مصطلحات Zutaten (ألمانية) بطول لا يتجاوز cfg.max_terms.
     إن فشل LLM نستخدم fallback محلي بسيط باستخراج كلمات وأسماء شائعة.
+    cache: الرد الخام يُحفظ فقط إذا حُلِّل إلى قائمة غير فارغة (الفشل لا يُخزَّن).
+    with_status=True → (terms, raw, from_llm): from_llm=False إذا جاءت المصطلحات من
+    الـfallback المحلي (خطأ/رد غير صالح/فارغ) — نفس شرط التخزين في الكاش.
     """
     name = dish_name or ""
     desc = dish_description or ""
@@ -116,21 +211,10 @@ def llm_extract_terms(
 You are a precise German culinary term extractor.
 Task: Given a dish name/description, return ONLY JSON array of distinct German ingredient-like terms (nouns/compounds). No translations, no explanations.
 
-Rules:
-- Output <= {cfg.max_terms} items, lowercased, concise single tokens if possible (compound allowed, e.g., "joghurtsose", "sesampaste", "doenerfleisch", "brioche-bun").
-- Skip generic fillers that aren't ingredients (e.g., "gericht", "hausgemacht", "frisch", "lecker", "portion", "klassisch").
-- If ingredient is ambiguous ("sose", "salat"), keep it but prefer more specific forms if present ("joghurtsose", "mayonnaise", "senf", "kaese").
+{_extract_rules(cfg.max_terms)}
 - Return ONLY a JSON array (no code blocks).
 
-Examples:
-INPUT: "Döner Teller — Dönerfleisch, Soße, Salat, Kraut, Zwiebeln, Tomaten"
-OUTPUT: ["doenerfleisch","sose","salat","kraut","zwiebeln","tomaten"]
-
-INPUT: "Chicken Wrap mit Joghurtsoße und Sesam"
-OUTPUT: ["chicken","joghurtsose","sesam","wrap"]
-
-INPUT: "Falafel mit Tahini (Sesampaste), Salat, Tomaten"
-OUTPUT: ["falafel","tahini","sesampaste","salat","tomaten"]
+{_EXTRACT_EXAMPLES}
 
 Now extract for language={lang}:
 
@@ -142,40 +226,143 @@ Return ONLY JSON array:
 
     raw = ""
     terms: List[str] = []
+    key = prompt_key(cache, "extract_terms", cfg, extract_terms_payload(cfg, name, desc)) if cache is not None else None
+    cached = cache.get(key) if key else None
     try:
+        if cached is not None:
+            raw = str(cached.get("raw") or "")
+        else:
+            raw = caller(
+                prompt,
+                model_name=cfg.model_name,
+                temperature=cfg.temperature,
+                max_tokens=min(cfg.max_output_tokens, 256),
+                timeout=cfg.timeout,
+            )
+        terms = _terms_from_data(_parse_json_object_or_array(raw))
+        if key and cached is None and terms:
+            cache.set(key, {"raw": raw}, "extract_terms", cfg.model_name)
+    except Exception:
+        terms = []
+
+    from_llm = bool(terms)
+    terms = _finish_terms(cfg, name, desc, terms)
+
+    if with_status:
+        return terms, raw or "", from_llm
+    if return_raw:
+        return terms, raw or ""
+    return terms
+
+
+def llm_extract_terms_batch(
+    caller: LLMCaller,
+    cfg: LLMConfig,
+    dishes: Sequence[Tuple[Hashable, str, str]],
+    *,
+    cache=None,
+    runner: Optional[Runner] = None,
+) -> Dict[Hashable, Tuple[List[str], str, bool]]:
+    """
+    مثل llm_extract_terms(with_status=True) لعدة أطباق (key, name, desc) → {key: (terms, raw, from_llm)}:
+    - الأطباق تُجمع في برومبت واحد (القواعد والأمثلة مرة واحدة) ورد JSON بمفاتيح "1".."n"،
+      مقسّمة حسب cfg.batch_size وcfg.batch_token_budget.
+    - نفس مفاتيح كاش llm_extract_terms لكل طبق (الوضعان يتشاركان الردود).
+    - طبق غائب/ليس مصفوفة في رد الدفعة (أو دفعة فشلت/لم تُحلَّل) → llm_extract_terms له وحده.
+    raw لكل طبق = مصفوفته JSON من رد الدفعة (أو الرد الخام في المسار الفردي).
+    """
+    runner = runner or _serial_runner
+    lang = (cfg.lang or "de").lower()
+    out: Dict[Hashable, Tuple[List[str], str, bool]] = {}
+
+    keys: Dict[Hashable, str] = {}
+    if cache is not None:
+        keys = {
+            k: prompt_key(cache, "extract_terms", cfg, extract_terms_payload(cfg, name or "", desc or ""))
+            for k, name, desc in dishes
+        }
+        cached = cache.get_many(keys.values())
+        for k, name, desc in dishes:
+            hit = cached.get(keys[k])
+            if isinstance(hit, dict):
+                raw = str(hit.get("raw") or "")
+                terms = _terms_from_data(_parse_json_object_or_array(raw))
+                out[k] = (_finish_terms(cfg, name or "", desc or "", terms), raw, bool(terms))
+
+    pending = [d for d in dishes if d[0] not in out]
+    if not pending:
+        return out
+
+    per_dish_output = cfg.max_terms * 6 + 8
+    instructions = f"""
+You are a precise German culinary term extractor.
+Task: For EACH dish below (name/description), return distinct German ingredient-like terms (nouns/compounds). No translations, no explanations.
+
+{_extract_rules(cfg.max_terms)}
+- Return ONLY a JSON object (no code blocks): keys = the dish ids exactly as given, values = JSON arrays of terms.
+
+{_EXTRACT_EXAMPLES}
+""".strip()
+    overhead = _approx_tokens(instructions) + 64
+
+    def cost(dish) -> int:
+        _, name, desc = dish
+        return _approx_tokens(f"{name} {desc}") + 16 + per_dish_output
+
+    chunks = _split_by_budget(
+        pending, cost, max(1, cfg.batch_token_budget - overhead), max(1, cfg.batch_size)
+    )
+
+    def ask(chunk) -> Optional[Dict]:
+        items = {
+            str(i): {"name": name or "", "desc": desc or ""}
+            for i, (_, name, desc) in enumerate(chunk, start=1)
+        }
+        prompt = f"""{instructions}
+
+Now extract for language={lang}:
+
+DISHES: {json.dumps(items, ensure_ascii=False)}
+
+Return ONLY JSON object:"""
         raw = caller(
             prompt,
             model_name=cfg.model_name,
             temperature=cfg.temperature,
-            max_tokens=min(cfg.max_output_tokens, 256),
+            max_tokens=len(chunk) * per_dish_output + 32,
             timeout=cfg.timeout,
         )
         data = _parse_json_object_or_array(raw)
-        if isinstance(data, list):
-            terms = [normalize_de(str(x)) for x in data if isinstance(x, (str, int, float))]
-    except Exception:
-        terms = []
+        return data if isinstance(data, dict) else None
 
-    # Fallback محلي إذا فشل LLM أو النتيجة فارغة
-    if not terms:
-        text = normalize_de(f"{name} {desc}")
-        cand = _WORD_RE.findall(text)
-        # ترشيح كلمات شائعة لا تفيد
-        stop = {
-            "mit","und","oder","vom","hausgemacht","lecker","frisch","gericht",
-            "portion","gross","klein","grossen","kleinen","serviert","klassisch","spezial",
-            "menu","menue","gerichtname","gerichtnamen","gerichtname","teller","beilage",
-        }
-        cand = [c for c in cand if c not in stop and len(c) >= 3]
-        # خذ أول max_terms
-        terms = cand[: cfg.max_terms]
-
-    # تمييز موحد
-    terms = _dedup_keep_order([t for t in terms if t])
-
-    if return_raw:
-        return terms, raw or ""
-    return terms
+    fallback: List[Tuple[Hashable, str, str]] = []
+    new_entries: Dict[str, object] = {}
+    for chunk, (ok, data) in zip(chunks, runner(ask, chunks)):
+        if not ok or data is None:
+            fallback.extend(chunk)
+            continue
+        for i, (k, name, desc) in enumerate(chunk, start=1):
+            value = data.get(str(i))
+            if not isinstance(value, list):
+                fallback.append((k, name, desc))
+                continue
+            terms = _terms_from_data(value)
+            raw = json.dumps(value, ensure_ascii=False)
+            out[k] = (_finish_terms(cfg, name or "", desc or "", terms), raw, bool(terms))
+            if keys and terms:
+                new_entries[keys[k]] = {"raw": raw}
+    if new_entries:
+        cache.set_many(new_entries, "extract_terms", cfg.model_name)
+
+    # fallback فردي (نفس المسار القديم، مع fallback المحلي عند الفشل)
+    def ask_one(dish):
+        _, name, desc = dish
+        return llm_extract_terms(caller, cfg, name or "", desc or "", cache=cache, with_status=True)
+
+    for dish, (ok, res) in zip(fallback, runner(ask_one, fallback)):
+        k, name, desc = dish
+        out[k] = res if ok else (_finish_terms(cfg, name or "", desc or "", []), "", False)
+    return out
 
 
 # ------------------------------------------------------------
@@ -307,36 +494,8 @@ def _heuristic_map(term: str) -> Tuple[str, float, str]:
 # ------------------------------------------------------------
 # LLM: map terms → codes (with heuristics + few-shot)
 # ------------------------------------------------------------
-def llm_map_terms_to_codes(
-    caller: LLMCaller,
-    cfg: LLMConfig,
-    terms: Iterable[str],
-    *,
-    lang: str = "de",
-) -> Dict[str, Dict[str, object]]:
-    """
-    يرجّع قاموسًا: term(lower) → {codes: 'A,G', confidence: float, reason: str}
-    - يبدأ بهيورستك قوية (قاموس/أنماط).
-    - يكمل بما تبقى عبر LLM مع few-shot.
-    """
-    out: Dict[str, Dict[str, object]] = {}
-    terms_list = _dedup_keep_order([normalize_de(t) for t in terms if t])
-
-    # 1) هيورستك أولية
-    remaining: List[str] = []
-    for t in terms_list:
-        codes, conf, why = _heuristic_map(t)
-        if codes:
-            out[t] = {"codes": _clean_codes_str(codes), "confidence": round(float(conf), 3), "reason": why}
-        else:
-            remaining.append(t)
-
-    if not remaining:
-        return out
-
-    # 2) LLM mapping (few-shot)
-    # نزوّده بخريطة الأكواد + أمثلة لقرارات مؤكدة/مرفوضة
-    allergen_map_hint = """
+# نزوّد النموذج بخريطة الأكواد + أمثلة لقرارات مؤكدة/مرفوضة
+_ALLERGEN_MAP_HINT = """
 A = glutenhaltiges Getreide (Weizen, Dinkel, Roggen, Gerste, Mehl, Teig, Brot, Panier, Nudeln, Pasta, Couscous, Bulgur)
 B = Krebstiere (Garnelen, Shrimps, Krabben, Hummer, Scampi)
 C = Eier (Ei, Eier, Mayonnaise, Mayo, Remoulade, Aioli, Baiser/Meringue)
@@ -351,7 +510,7 @@ L = Sellerie (Sellerie)
 N = Lupine (Lupine, Lupinenmehl)
 """.strip()
 
-    examples = """
+_MAP_EXAMPLES = """
 Examples (decide codes; if uncertain, return empty codes with low confidence):
 - "joghurtsose" → G (dairy sauce) conf≈0.9
 - "mayonnaise" → C (egg-based) conf≈0.9
@@ -371,15 +530,18 @@ Examples (decide codes; if uncertain, return empty codes with low confidence):
 - "dönerfleisch" → (empty) conf≈0.0 (no inherent allergen)
 """.strip()
 
-    prompt = f"""
+_MAP_OUTPUT_TOKENS_PER_TERM = 30
+
+def _map_terms_prompt(terms: List[str], lang: str) -> str:
+    return f"""
 You are an expert allergen labeler for German menus.
 Map each term to EU-style allergen LETTER codes used by this system (A..Z subset), using the hint map below.
 Return ONLY JSON object: keys = terms (lowercased), values = {{"codes": "A,C", "confidence": 0.0..1.0, "reason": "short"}}
 
 Allergen hint:
-{allergen_map_hint}
+{_ALLERGEN_MAP_HINT}
 
-{examples}
+{_MAP_EXAMPLES}
 
 Rules:
 - Use letters only, comma-separated (no spaces). Example: "A,G" or "" for none.
@@ -389,55 +551,156 @@ Rules:
 - Reason must be short ("dairy", "egg-based", "sesame", "gluten cereal", "tree nuts", ...).
 
 Terms (language={lang}):
-{json.dumps(remaining, ensure_ascii=False)}
+{json.dumps(terms, ensure_ascii=False)}
 
 Return ONLY JSON object:
 """.strip()
 
-    try:
+def _term_entry(v) -> Dict[str, object]:
+    codes = ""
+    conf = 0.0
+    reason = ""
+    if isinstance(v, dict):
+        codes = _clean_codes_str(v.get("codes", ""))
+        try:
+            conf = float(v.get("confidence", 0.0))
+        except Exception:
+            conf = 0.0
+        reason = str(v.get("reason", "") or "")
+    return {"codes": codes, "confidence": round(conf, 3), "reason": reason or "llm"}
+
+MAP_FAILURE_REASONS = frozenset({"llm_error", "llm_unparsed"})
+
+def _with_status(out: Dict[str, Dict[str, object]], with_status: bool):
+    if not with_status:
+        return out
+    return out, {t for t, v in out.items() if v.get("reason") in MAP_FAILURE_REASONS}
+
+def llm_map_terms_to_codes(
+    caller: LLMCaller,
+    cfg: LLMConfig,
+    terms: Iterable[str],
+    *,
+    lang: str = "de",
+    cache=None,
+    runner: Optional[Runner] = None,
+    with_status: bool = False,
+):
+    """
+    يرجّع قاموسًا: term(lower) → {codes: 'A,G', confidence: float, reason: str}
+    with_status=True → (القاموس, failed): failed = المصطلحات التي لم يُجب عنها LLM
+    (reason في MAP_FAILURE_REASONS) — لا تُخزَّن في الكاش ولا يصح حفظ نتيجتها.
+    - يبدأ بهيورستك قوية (قاموس/أنماط).
+    - ثم الكاش لكل مصطلح على حدة (المصطلحات تتكرّر بين الأطباق).
+    - يكمل بما تبقى عبر LLM مع few-shot؛ يُخزَّن فقط ما أجاب عنه النموذج فعلًا.
+    - يقبل مصطلحات دفعة كاملة من الأطباق (مميّزة) ويقسّمها حسب cfg.batch_size/batch_token_budget؛
+      دفعة لم تُحلَّل أو أغفلت مصطلحات → نداء فردي لكل مصطلح منها.
+    """
+    out: Dict[str, Dict[str, object]] = {}
+    terms_list = _dedup_keep_order([normalize_de(t) for t in terms if t])
+
+    # 1) هيورستك أولية
+    remaining: List[str] = []
+    for t in terms_list:
+        codes, conf, why = _heuristic_map(t)
+        if codes:
+            out[t] = {"codes": _clean_codes_str(codes), "confidence": round(float(conf), 3), "reason": why}
+        else:
+            remaining.append(t)
+
+    if not remaining:
+        return _with_status(out, with_status)
+
+    # 1b) كاش لكل مصطلح
+    term_keys: Dict[str, str] = {}
+    if cache is not None:
+        term_keys = {t: prompt_key(cache, "map_terms", cfg, {"term": t, "lang": lang}) for t in remaining}
+        cached = cache.get_many(term_keys.values())
+        for t in list(remaining):
+            hit = cached.get(term_keys[t])
+            if isinstance(hit, dict):
+                out[t] = dict(hit)
+        remaining = [t for t in remaining if t not in out]
+        if not remaining:
+            return _with_status(out, with_status)
+
+    # 2) LLM mapping (few-shot) — المصطلحات الباقية على دفعات حسب ميزانية tokens
+    runner = runner or _serial_runner
+    overhead = _approx_tokens(_map_terms_prompt([], lang)) + 16
+    chunks = _split_by_budget(
+        remaining,
+        lambda t: _approx_tokens(t) + 2 + _MAP_OUTPUT_TOKENS_PER_TERM,
+        max(1, cfg.batch_token_budget - overhead),
+        max(1, cfg.batch_size),
+    )
+
+    def ask(chunk: List[str]) -> Optional[Dict]:
         raw = caller(
-            prompt,
+            _map_terms_prompt(chunk, lang),
             model_name=cfg.model_name,
             temperature=cfg.temperature,
-            max_tokens=min(cfg.max_output_tokens, 512),
+            max_tokens=max(min(cfg.max_output_tokens, 512), len(chunk) * _MAP_OUTPUT_TOKENS_PER_TERM + 64),
             timeout=cfg.timeout,
         )
         data = _parse_json_object_or_array(raw)
-        if isinstance(data, dict):
-            for k, v in data.items():
-                term = normalize_de(k)
-                if term not in remaining:
-                    continue
-                codes = ""
-                conf = 0.0
-                reason = ""
-                if isinstance(v, dict):
-                    codes = _clean_codes_str(v.get("codes", ""))
-                    try:
-                        conf = float(v.get("confidence", 0.0))
-                    except Exception:
-                        conf = 0.0
-                    reason = str(v.get("reason", "") or "")
-                out[term] = {"codes": codes, "confidence": round(conf, 3), "reason": reason or "llm"}
-        else:
-            # لو رجع شيء غير متوقع، لا نكسر التنفيذ
-            for term in remaining:
-                out.setdefault(term, {"codes": "", "confidence": 0.0, "reason": "llm_unparsed"})
-    except Exception:
-        # في حال فشل نعيد الباقي كـ unknown
-        for term in remaining:
-            out.setdefault(term, {"codes": "", "confidence": 0.0, "reason": "llm_error"})
-
-    return out
+        return data if isinstance(data, dict) else None
+
+    answered: List[str] = []
+
+    def collect(chunks: List[List[str]], retry_single: bool) -> List[str]:
+        """يملأ out من ردود الدفعات ويعيد المصطلحات التي تحتاج نداءً فرديًا."""
+        retry: List[str] = []
+        for chunk, (ok, data) in zip(chunks, runner(ask, chunks)):
+            if not ok:
+                # في حال فشل نعيد الدفعة كـ unknown
+                for term in chunk:
+                    out.setdefault(term, {"codes": "", "confidence": 0.0, "reason": "llm_error"})
+                continue
+            parsed = {}
+            if data is not None:
+                for k, v in data.items():
+                    term = normalize_de(k)
+                    if term in chunk:
+                        parsed[term] = _term_entry(v)
+            out.update(parsed)
+            answered.extend(parsed)
+            missing = [t for t in chunk if t not in parsed]
+            if retry_single and len(chunk) > 1:
+                retry.extend(missing)
+            else:
+                # لو رجع شيء غير متوقع، لا نكسر التنفيذ
+                for term in missing:
+                    out.setdefault(term, {"codes": "", "confidence": 0.0, "reason": "llm_unparsed"})
+        return retry
+
+    retry = collect(chunks, retry_single=True)
+    if retry:
+        collect([[t] for t in retry], retry_single=False)
+
+    if term_keys and answered:
+        try:
+            cache.set_many({term_keys[t]: out[t] for t in answered}, "map_terms", cfg.model_name)
+        except Exception:
+            pass
+
+    return _with_status(out, with_status)
 
 
 # ------------------------------------------------------------
 # (اختياري) LLM مباشر لإرجاع الأكواد من الاسم/الوصف
 # ------------------------------------------------------------
-def llm_map_dish_to_codes(caller: LLMCaller, cfg: LLMConfig, name: str, description: str) -> Dict[str, str]:
+def llm_map_dish_to_codes(
+    caller: LLMCaller,
+    cfg: LLMConfig,
+    name: str,
+    description: str,
+    *,
+    cache=None,
+) -> Dict[str, str]:
     """
     يطلب من LLM إرجاع الأكواد مباشرة من الاسم+الوصف.
     يعيد: {"codes": "A,C,G", "raw": "..."} — حيث codes قد تكون فارغة إن لم يجد ما يكفي من قرائن.
+    cache: الرد الخام لنفس الاسم/الوصف المُطبّع يُعاد استخدامه ("cached": True).
     """
     text = (name or "").strip()
     if description:
@@ -456,6 +719,16 @@ codes: A,C,G
 Falls nichts sicher: gib "codes: "
 """.strip()
 
+    key = None
+    if cache is not None:
+        key = prompt_key(cache, "dish_codes", cfg, {
+            "name": normalize_de(name or ""),
+            "desc": normalize_de(description or ""),
+        })
+        cached = cache.get(key)
+        if cached is not None:
+            return {**cached, "cached": True}
+
     raw = caller(
         prompt,
         model_name=cfg.model_name,
@@ -474,4 +747,7 @@ Falls nichts sicher: gib "codes: "
         tokens = re.findall(r"\b[A-R]\b", raw.upper())
         codes = ",".join(sorted(set(tokens)))
 
-    return {"codes": codes or "", "raw": (raw or "").strip()}
+    result = {"codes": codes or "", "raw": (raw or "").strip()}
+    if key:
+        cache.set(key, result, "dish_codes", cfg.model_name)
+    return result
@@ -0,0 +1,223 @@
+# core/services/negation.py
+# -----------------------------------------------------------
+# محرك نفي بنوافذ الكلمات (token windows) مبني على NegationCue
+#   - النص المُطبّع يُقسَّم إلى كلمات مرة واحدة لكل طبق
+#   - مواضع عبارات النفي تُفهرس مرة واحدة (plain + regex)
+#   - قرار النفي لكل مطابقة = O(1) عبر مصفوفات تغطية (difference arrays)
+#   - عبارة بنافذتين = 0 حدّ جملة ("mit", "aber", "with"): النوافذ لا تعبره
+#     → "ohne zwiebeln mit kaese" ينفي zwiebeln فقط. علامات الترقيم تُحذف في
+#     normalize_text (نص المطابقة/البصمة/الـmemo واحد)، لذا الحدود كلمات
+# لا يعتمد على Django: القواعد تُجمَّع من صفوف NegationCue في lexicon_cache.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# يُرفع عند أي تغيير يغيّر قرارات النفي (جزء من بصمة الطبق ومفتاح memo)
+NEGATION_VERSION = 2
+
+@dataclass(frozen=True)
+class NegationCueEntry:
+    """
+    عبارة نفي مُطبّعة:
+      - window_after: عدد الكلمات بعد العبارة التي يشملها النفي ("ohne sesam")
+      - window_before: عدد الكلمات قبل العبارة التي يشملها النفي ("sesam frei")
+      - النافذتان = 0: حدّ جملة توقف عنده نوافذ العبارات الأخرى ("mit kaese")
+    """
+    cue_norm: str
+    is_regex: bool = False
+    window_before: int = 0
+    window_after: int = 0
+    is_active: bool = True
+
+
+# عبارات افتراضية تعادل أنماط NEG_PATTERNS القديمة (de/en/ar).
+# صف NegationCue بنفس العبارة المُطبّعة يتجاوزها (أو يعطّلها إن كان غير مفعّل).
+DEFAULT_CUES: Tuple[NegationCueEntry, ...] = (
+    NegationCueEntry("ohne", window_after=6),
+    NegationCueEntry("kein", window_after=1),
+    NegationCueEntry("keine", window_after=1),
+    NegationCueEntry("keinen", window_after=1),
+    NegationCueEntry("keiner", window_after=1),
+    NegationCueEntry("no", window_after=1),
+    NegationCueEntry("without", window_after=1),
+    NegationCueEntry("frei", window_before=1),
+    NegationCueEntry("بدون", window_after=1),
+    NegationCueEntry("من غير", window_after=1),
+    # حدود الجمل: بداية جملة مثبتة بعد النفي ("ohne zwiebeln mit kaese")
+    NegationCueEntry("mit"),
+    NegationCueEntry("aber"),
+    NegationCueEntry("sowie"),
+    NegationCueEntry("dazu"),
+    NegationCueEntry("with"),
+    NegationCueEntry("but"),
+    NegationCueEntry("مع"),
+)
+
+
+class NegationScope:
+    """
+    نتيجة فهرسة نص واحد: لكل كلمة نعرف إن كانت ضمن نافذة نفي أمامية/خلفية.
+    is_negated(start, end) يعمل على إزاحات الأحرف في النص المُطبّع.
+    """
+
+    __slots__ = ("_starts", "_fwd", "_bwd")
+
+    def __init__(self, starts: List[int], fwd: List[bool], bwd: List[bool]) -> None:
+        self._starts = starts
+        self._fwd = fwd
+        self._bwd = bwd
+
+    def _token_at(self, char_pos: int) -> int:
+        return bisect_right(self._starts, char_pos) - 1
+
+    def is_negated(self, start: int, end: int) -> bool:
+        if not self._starts or end <= start:
+            return False
+        first = self._token_at(start)
+        last = self._token_at(end - 1)
+        return (0 <= first < len(self._fwd) and self._fwd[first]) or (0 <= last < len(self._bwd) and self._bwd[last])
+
+
+_EMPTY_SCOPE = NegationScope([], [], [])
+
+
+class NegationRules:
+    """
+    قواعد نفي مُجمَّعة لقاموس (owner, lang):
+      - plain: خريطة أول كلمة → قائمة (كلمات العبارة، النافذة الخلفية، النافذة الأمامية)
+      - regex: أنماط مُجمَّعة مسبقًا (الخاطئة تُتجاهل)
+      - suffix: عبارات كلمة واحدة بنافذة خلفية ("frei") — تنفي أيضًا داخل كلمة مركّبة ("sesamfrei")
+      - عبارات بنافذتين = 0 تُسجَّل بنفس الطريقة كحدود جمل (wb = wa = 0)
+    """
+
+    __slots__ = ("_plain", "_regex", "_suffix", "_has_cues")
+
+    def __init__(self, cues: Iterable[NegationCueEntry]) -> None:
+        self._plain: Dict[str, List[Tuple[Tuple[str, ...], int, int]]] = {}
+        self._regex: List[Tuple[re.Pattern, int, int]] = []
+        self._has_cues = False
+        suffix: List[str] = []
+        for cue in cues:
+            if not cue.is_active or not cue.cue_norm:
+                continue
+            wb, wa = int(cue.window_before or 0), int(cue.window_after or 0)
+            self._has_cues = self._has_cues or wb > 0 or wa > 0
+            if cue.is_regex:
+                try:
+                    self._regex.append((re.compile(cue.cue_norm, re.IGNORECASE), wb, wa))
+                except re.error:
+                    continue
+            else:
+                toks = tuple(cue.cue_norm.split())
+                self._plain.setdefault(toks[0], []).append((toks, wb, wa))
+                if len(toks) == 1 and wb > 0:
+                    suffix.append(toks[0])
+        self._suffix: Tuple[str, ...] = tuple(suffix)
+
+    def __bool__(self) -> bool:
+        return self._has_cues  # حدود الجمل وحدها لا تنفي شيئًا
+
+    def negates_within(self, token: str, pos: int) -> bool:
+        """هل تظهر عبارة نفي خلفية داخل الكلمة بعد الموضع pos؟ ("sesamfrei" بعد "sesam")"""
+        return any(token.find(cue, pos) != -1 for cue in self._suffix)
+
+    def scan(self, text_norm: str) -> NegationScope:
+        """تمريرة خطّية واحدة: كلمات النص + مواضع العبارات + مصفوفات التغطية."""
+        if not text_norm or not self:
+            return _EMPTY_SCOPE
+
+        tokens = text_norm.split(" ")
+        n = len(tokens)
+        starts: List[int] = []
+        pos = 0
+        for tok in tokens:
+            starts.append(pos)
+            pos += len(tok) + 1
+
+        # cue spans: (first_token, end_token_exclusive, window_before, window_after)
+        spans: List[Tuple[int, int, int, int]] = []
+        plain = self._plain
+        if plain:
+            for i, tok in enumerate(tokens):
+                cands = plain.get(tok)
+                if not cands:
+                    continue
+                for toks, wb, wa in cands:
+                    k = len(toks)
+                    if k == 1 or tuple(tokens[i:i + k]) == toks:
+                        spans.append((i, i + k, wb, wa))
+        for rx, wb, wa in self._regex:
+            for m in rx.finditer(text_norm):
+                if m.end() <= m.start():
+                    continue
+                first = bisect_right(starts, m.start()) - 1
+                last = bisect_right(starts, m.end() - 1) - 1
+                spans.append((first, last + 1, wb, wa))
+
+        if not spans:
+            return NegationScope(starts, [False] * n, [False] * n)
+
+        # حدود الجمل: أقرب حدّ بعد كل كلمة (للنافذة الأمامية) وآخر حدّ قبلها (للخلفية)
+        next_break = [n] * (n + 1)
+        prev_break = [0] * (n + 1)
+        breaks = [(cs, ce) for cs, ce, wb, wa in spans if not wb and not wa]
+        if breaks:
+            for bs, be in breaks:
+                next_break[bs] = bs
+                prev_break[be] = be
+            for i in range(n - 1, -1, -1):
+                next_break[i] = min(next_break[i], next_break[i + 1])
+            for i in range(1, n + 1):
+                prev_break[i] = max(prev_break[i], prev_break[i - 1])
+
+        # difference arrays: نافذة أمامية [ce, ce+wa) ونافذة خلفية [cs-wb, cs)، مقطوعتان عند الحدود
+        dfwd = [0] * (n + 1)
+        dbwd = [0] * (n + 1)
+        for cs, ce, wb, wa in spans:
+            if wa > 0 and ce < n:
+                stop = min(n, ce + wa, next_break[ce])
+                if stop > ce:
+                    dfwd[ce] += 1
+                    dfwd[stop] -= 1
+            if wb > 0 and cs > 0:
+                begin = max(0, cs - wb, prev_break[cs])
+                if begin < cs:
+                    dbwd[begin] += 1
+                    dbwd[cs] -= 1
+        fwd: List[bool] = []
+        bwd: List[bool] = []
+        a = b = 0
+        for i in range(n):
+            a += dfwd[i]
+            b += dbwd[i]
+            fwd.append(a > 0)
+            bwd.append(b > 0)
+        return NegationScope(starts, fwd, bwd)
+
+
+def merge_cues(db_cues: Iterable[NegationCueEntry], defaults: Iterable[NegationCueEntry] = DEFAULT_CUES) -> Tuple[NegationCueEntry, ...]:
+    """
+    يدمج صفوف DB (بالترتيب: المالك ثم العام) مع العبارات الافتراضية:
+    أول ظهور لكل (cue_norm, is_regex) يفوز؛ صف غير مفعّل يعطّل الافتراضي المماثل.
+    """
+    out: Dict[Tuple[str, bool], NegationCueEntry] = {}
+    for cue in list(db_cues) + list(defaults):
+        key = (cue.cue_norm, bool(cue.is_regex))
+        if cue.cue_norm and key not in out:
+            out[key] = cue
+    return tuple(out.values())
+
+
+_DEFAULT_RULES: Optional[NegationRules] = None
+
+
+def default_rules() -> NegationRules:
+    global _DEFAULT_RULES
+    if _DEFAULT_RULES is None:
+        _DEFAULT_RULES = NegationRules(DEFAULT_CUES)
+    return _DEFAULT_RULES
@@ -0,0 +1,308 @@
+# core/services/regex_guard.py
+# -----------------------------------------------------------
+# فحص أنماط Regex الخاصة بالقاموس (KeywordLexeme.is_regex) قبل الحفظ والتجميع
+#   1) التجميع: re.error → invalid
+#   2) فحص ثابت لخطر التراجع الكارثي (catastrophic backtracking):
+#        - مكمِّم غير محدود داخل مكمِّم غير محدود:  (a+)+  (\w+\s?)*
+#        - تناوب مكمَّم بفروع تبدأ بنفس الحرف:      (a|ab)*  (\w|\d)+
+#   3) فحص ديناميكي (عند الحفظ فقط): تشغيل النمط على مدخلات عدائية متزايدة الطول
+#      (تكرار حروف النمط + لاحقة لا تطابق) مع سقف زمني لكل تشغيل
+#      - الزمن = CPU time للـthread (thread_time) وليس الساعة: تحميل الجهاز لا يُحتسب
+#      - تشغيل تجاوز السقف يُعاد PROBE_ATTEMPTS مرات (GC معطّل) ويُرفض فقط إن تجاوزه كل مرة
+#      - الكاش للفحص الثابت فقط؛ نتيجة "ok" الديناميكية تُحفظ، و"risky" المبنية على الزمن لا تُحفظ أبدًا
+#   4) literal: أطول نص ثابت إلزامي في أي مطابقة (بحروف صغيرة) — مرشّح مسبق رخيص:
+#      إن لم يظهر في النص المُطبّع فلا داعي لتشغيل النمط أصلًا
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import gc
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from time import thread_time
+from typing import FrozenSet, List, Optional, Set
+
+try:  # Python 3.11+
+    import re._constants as _sre
+    import re._parser as _sre_parse
+except ImportError:  # pragma: no cover
+    import sre_constants as _sre  # type: ignore[no-redef]
+    import sre_parse as _sre_parse  # type: ignore[no-redef]
+
+REGEX_FLAGS = re.IGNORECASE
+
+# الفحص الديناميكي: أطوال المدخلات العدائية + السقف الزمني لتشغيل واحد
+PROBE_LENGTHS = (8, 12, 16, 20, 64, 256, 1024)
+PROBE_BUDGET_SECONDS = 0.025
+PROBE_MAX_CHARS = 6
+PROBE_ATTEMPTS = 3
+PROBE_OK_CACHE_SIZE = 4096
+
+_UNBOUNDED = _sre.MAXREPEAT
+_REPEATS = (_sre.MAX_REPEAT, _sre.MIN_REPEAT)
+_ATOMIC = tuple(
+    op for op in (getattr(_sre, "ATOMIC_GROUP", None), getattr(_sre, "POSSESSIVE_REPEAT", None)) if op is not None
+)
+
+
+@dataclass(frozen=True)
+class RegexVerdict:
+    """
+    نتيجة فحص نمط:
+      - status: "ok" | "invalid" | "risky"
+      - reason: سبب الرفض/التعليم (فارغ إن كان ok)
+      - literal: نص ثابت إلزامي للمرشّح المسبق ("" = يُشغَّل النمط دائمًا)
+    """
+    status: str
+    reason: str = ""
+    literal: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.status == "ok"
+
+
+# -----------------------
+# تحليل شجرة النمط (sre_parse)
+# -----------------------
+def _children(op, av) -> List:
+    """القوائم الفرعية لعقدة (op, av) في شجرة sre_parse."""
+    if op in _REPEATS or op == getattr(_sre, "POSSESSIVE_REPEAT", None):
+        return [av[2]]
+    if op == _sre.SUBPATTERN:
+        return [av[-1]]
+    if op == _sre.BRANCH:
+        return list(av[1])
+    if op in (_sre.ASSERT, _sre.ASSERT_NOT):
+        return [av[1]]
+    if op == getattr(_sre, "GROUPREF_EXISTS", None):
+        return [x for x in av[1:] if x is not None]
+    if op == getattr(_sre, "ATOMIC_GROUP", None):
+        return [av]
+    return []
+
+
+def _first_chars(items) -> Optional[FrozenSet[str]]:
+    """
+    حروف البداية الممكنة لتسلسل (بحروف صغيرة)؛ None = غير معروف/أي حرف.
+    تقدير محافظ: أي شيء غير literal واضح يُعتبر "أي حرف".
+    """
+    for op, av in items:
+        if op == _sre.AT:
+            continue
+        if op == _sre.LITERAL:
+            return frozenset({chr(av).lower()})
+        if op == _sre.IN:
+            chars = set()
+            for sub_op, sub_av in av:
+                if sub_op != _sre.LITERAL:
+                    return None
+                chars.add(chr(sub_av).lower())
+            return frozenset(chars)
+        if op == _sre.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op == _sre.BRANCH:
+            out = set()
+            for alt in av[1]:
+                first = _first_chars(alt)
+                if first is None:
+                    return None
+                out |= first
+            return frozenset(out)
+        if op in _REPEATS and av[0] > 0:
+            return _first_chars(av[2])
+        return None
+    return frozenset()
+
+
+def _overlapping_branch(items) -> bool:
+    """تناوب (مباشر) داخل التسلسل تتقاطع حروف بداية فروعه."""
+    for op, av in items:
+        if op == _sre.SUBPATTERN:
+            if _overlapping_branch(av[-1]):
+                return True
+        elif op == _sre.BRANCH:
+            seen: set = set()
+            for alt in av[1]:
+                first = _first_chars(alt)
+                if first is None or first & seen:
+                    return True
+                seen |= first
+    return False
+
+
+def _risk(items, in_unbounded: bool = False) -> str:
+    for op, av in items:
+        if op in _ATOMIC:
+            continue  # لا تراجع داخل atomic/possessive
+        if op in _REPEATS:
+            unbounded = av[1] == _UNBOUNDED
+            if unbounded and in_unbounded:
+                return "nested unbounded quantifiers"
+            if unbounded and _overlapping_branch(av[2]):
+                return "quantified alternation with overlapping branches"
+            reason = _risk(av[2], in_unbounded or unbounded)
+        else:
+            reason = ""
+            for child in _children(op, av):
+                reason = _risk(child, in_unbounded)
+                if reason:
+                    break
+        if reason:
+            return reason
+    return ""
+
+
+def _walk(items):
+    for op, av in items:
+        yield op, av
+        for child in _children(op, av):
+            yield from _walk(child)
+
+
+def _literal_char(op, av) -> str:
+    """حرف ثابت يمكن أن يظهر كما هو في نص مُطبّع (ASCII alnum/مسافة/_) أو ""."""
+    if op != _sre.LITERAL:
+        return ""
+    c = chr(av)
+    return c.lower() if c.isascii() and (c.isalnum() or c in " _") else ""
+
+
+def _flat_literal(items) -> Optional[str]:
+    """محتوى مجموعة كلها حروف ثابتة (مثل (ka)) كنص واحد، وإلا None."""
+    out = []
+    for op, av in items:
+        if op == _sre.SUBPATTERN:
+            inner = _flat_literal(av[-1])
+            if inner is None:
+                return None
+            out.append(inner)
+            continue
+        c = _literal_char(op, av)
+        if not c:
+            return None
+        out.append(c)
+    return "".join(out)
+
+
+def _required_literal(items) -> str:
+    """
+    أطول تسلسل حروف ثابتة متتالية يجب أن يظهر في أي مطابقة:
+    المستوى الأعلى + مجموعات غير اختيارية + مكمِّمات بحدّ أدنى ≥ 1.
+    التناوب/الفئات/الاختياري تقطع التسلسل (تقدير محافظ: "" = لا مرشّح).
+    """
+    best, run = "", []
+    for op, av in items:
+        c = _literal_char(op, av)
+        if c:
+            run.append(c)
+            continue
+        if op == _sre.AT:
+            continue  # مرساة بعرض صفر لا تقطع التجاور
+        if op == _sre.SUBPATTERN:
+            flat = _flat_literal(av[-1])
+            if flat is not None:
+                run.append(flat)
+                continue
+        if len(run) > len(best):
+            best = "".join(run)
+        run = []
+        if op == _sre.SUBPATTERN:
+            inner = _required_literal(av[-1])
+        elif op in _REPEATS and av[0] >= 1:
+            inner = _required_literal(av[2])
+        else:
+            inner = ""
+        if len(inner) > len(best):
+            best = inner
+    if len(run) > len(best):
+        best = "".join(run)
+    return best
+
+
+def _probe_chars(parsed) -> List[str]:
+    chars: List[str] = []
+    for op, av in _walk(parsed):
+        if op == _sre.LITERAL:
+            c = chr(av).lower()
+            if c not in chars:
+                chars.append(c)
+    for c in ("a", "1", " "):
+        if c not in chars:
+            chars.append(c)
+    return chars[:PROBE_MAX_CHARS]
+
+
+def _search_seconds(compiled: re.Pattern, text: str) -> float:
+    """CPU time لتشغيل واحد (بدون GC أثناء القياس)."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        t0 = thread_time()
+        compiled.search(text)
+        return thread_time() - t0
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _slow(compiled: re.Pattern, text: str) -> bool:
+    """يتجاوز السقف في كل المحاولات (توقّف عابر لا يكفي للرفض)."""
+    return all(_search_seconds(compiled, text) > PROBE_BUDGET_SECONDS for _ in range(PROBE_ATTEMPTS))
+
+
+def _probe(compiled: re.Pattern, parsed) -> str:
+    """مدخلات عدائية: c*n + لاحقة لا تطابق؛ يتوقّف عند أول تشغيل بطيء فعلًا."""
+    for c in _probe_chars(parsed):
+        for n in PROBE_LENGTHS:
+            for tail in ("!", ""):
+                if _slow(compiled, c * n + tail):
+                    return f"slow on adversarial input ({c!r} x {n})"
+    return ""
+
+
+# -----------------------
+# الواجهة
+# -----------------------
+@lru_cache(maxsize=4096)
+def _check_static(pattern: str) -> RegexVerdict:
+    """التجميع + الفحص الثابت (حتمي → يُخزَّن مؤقتًا لكل نص نمط)."""
+    if not pattern:
+        return RegexVerdict("invalid", "empty pattern")
+    try:
+        re.compile(pattern, REGEX_FLAGS)
+        parsed = _sre_parse.parse(pattern, REGEX_FLAGS)
+    except (re.error, RecursionError) as e:
+        return RegexVerdict("invalid", f"invalid regex: {e}")
+    reason = _risk(parsed)
+    return RegexVerdict("risky" if reason else "ok", reason, _required_literal(parsed))
+
+
+_probed_ok: Set[str] = set()
+_probed_lock = threading.Lock()
+
+
+def check_regex(pattern: str, dynamic: bool = True) -> RegexVerdict:
+    """
+    يفحص نمط lexeme. dynamic=False = التجميع + الفحص الثابت فقط (رخيص؛ يُستخدم عند
+    بناء لقطة القاموس وفي قائمة الأدمن)، dynamic=True يضيف تشغيل المدخلات العدائية (عند الحفظ).
+    """
+    pattern = (pattern or "").strip()
+    verdict = _check_static(pattern)
+    if not verdict.ok or not dynamic or pattern in _probed_ok:
+        return verdict
+    reason = _probe(compile_regex(pattern), _sre_parse.parse(pattern, REGEX_FLAGS))
+    if reason:
+        return RegexVerdict("risky", reason, verdict.literal)
+    with _probed_lock:
+        if len(_probed_ok) >= PROBE_OK_CACHE_SIZE:
+            _probed_ok.clear()
+        _probed_ok.add(pattern)
+    return verdict
+
+
+def compile_regex(pattern: str) -> re.Pattern:
+    return re.compile((pattern or "").strip(), REGEX_FLAGS)
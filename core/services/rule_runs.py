@@ -0,0 +1,245 @@
+# core/services/rule_runs.py
+# -----------------------------------------------------------
+# تشغيلات محرك القواعد المسجّلة (RuleRun + RuleRunItem)
+#   - record_run(): يغلّف generate_for_dishes/generate_per_owner ويحفظ كل العناصر
+#     عبر RunRecorder (bulk_create على دفعات) + العدّادات والأزمنة،
+#     ونقطة الاستئناف بعد كل دفعة مكتوبة (RuleRun.resume_token)
+#   - items_page(): تصفّح العناصر بمؤشّر keyset (id آخر عنصر) بدل حدّ 1000
+#   - apply_run(): يكتب قرارات dry run المخزّنة كما هي (بدون إعادة مطابقة)؛
+#     الطبق الذي تغيّرت أكواده أو مدخلاته (البصمة: النص/المكوّنات/القاموس) منذ dry run
+#     يُتخطّى كـstale، والطبق الذي فشلت كتابته يُحتسب failed لا applied
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.utils import timezone
+
+from core.models import Dish, RuleRun, RuleRunItem
+from core.services.allergen_rules import (
+    APPLY_ACTIONS,
+    DEFAULT_WRITE_CHUNK_SIZE,
+    ITEMS_LIMIT,
+    _BulkWriter,
+    dish_fingerprint,
+    dish_text_norm,
+)
+from core.services.lexicon_cache import lexicon_version
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+
+class RuleRunError(Exception):
+    """تشغيل لا يمكن تطبيقه (ليس dry run، أو طُبّق/يُطبَّق بالفعل)."""
+
+
+class RunRecorder:
+    """يجمع عناصر التشغيل ويكتبها bulk_create كل chunk_size عنصر."""
+
+    def __init__(self, run: RuleRun, chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE) -> None:
+        self.run = run
+        self.chunk_size = max(1, int(chunk_size or DEFAULT_WRITE_CHUNK_SIZE))
+        self._buffer: List[RuleRunItem] = []
+        self.count = 0
+
+    def add(self, item: Dict, fingerprint: str = "", rows: Optional[Dict] = None) -> None:
+        self._buffer.append(RuleRunItem(
+            run=self.run,
+            dish_id=item["dish_id"],
+            name=(item.get("name") or "")[:255],
+            before=item.get("before") or "",
+            after=item.get("after") or "",
+            action=item["action"],
+            fingerprint=fingerprint or "",
+            rows={code: list(src) for code, src in rows.items()} if rows else None,
+        ))
+        self.count += 1
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._buffer:
+            RuleRunItem.objects.bulk_create(self._buffer)
+            self._buffer = []
+
+    def checkpoint(self, token: str) -> None:
+        """بعد commit دفعة: عناصرها + resume_token (يبقى محفوظًا حتى لو انقطع التشغيل)."""
+        self.flush()
+        RuleRun.objects.filter(pk=self.run.pk).update(resume_token=token, item_count=self.count)
+        self.run.resume_token = token
+
+
+def record_run(
+    generate: Callable[..., Dict],
+    *args,
+    user=None,
+    lang: str = "de",
+    dry_run: bool = True,
+    params: Optional[Dict] = None,
+    **kwargs,
+) -> Dict:
+    """
+    generate(*args, lang=, dry_run=, recorder=, **kwargs) مع تسجيل RuleRun
+    (owner_id يُقرأ من kwargs إن وُجد). النتيجة نفسها + "run_id".
+    """
+    run = RuleRun.objects.create(
+        user=user if getattr(user, "pk", None) else None,
+        owner_id=kwargs.get("owner_id"),
+        lang=lang,
+        dry_run=dry_run,
+        params=params or {},
+    )
+    recorder = RunRecorder(run, kwargs.get("chunk_size") or DEFAULT_WRITE_CHUNK_SIZE)
+    try:
+        result = generate(
+            *args, lang=lang, dry_run=dry_run, recorder=recorder, checkpoint=recorder.checkpoint, **kwargs,
+        )
+        recorder.flush()
+    except Exception:
+        run.status = RuleRun.STATUS_FAILED
+        run.finished_at = timezone.now()
+        run.save(update_fields=["status", "finished_at"])
+        raise
+
+    run.status = RuleRun.STATUS_DRY_RUN if dry_run else RuleRun.STATUS_WRITTEN
+    run.stats = {
+        k: v for k, v in result.items()
+        if isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+    run.timings = result.get("timings")
+    run.item_count = recorder.count
+    run.finished_at = timezone.now()
+    run.save(update_fields=["status", "stats", "timings", "item_count", "finished_at"])
+    result["run_id"] = run.id
+    return result
+
+
+def run_summary(run: RuleRun) -> Dict:
+    return {
+        "id": run.id,
+        "status": run.status,
+        "owner_id": run.owner_id,
+        "lang": run.lang,
+        "dry_run": run.dry_run,
+        "params": run.params,
+        "stats": run.stats,
+        "timings": run.timings,
+        "item_count": run.item_count,
+        "resume_token": run.resume_token,
+        "apply_stats": run.apply_stats,
+        "created_at": run.created_at,
+        "finished_at": run.finished_at,
+        "applied_at": run.applied_at,
+    }
+
+
+def items_page(
+    run: RuleRun,
+    cursor: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    action: Optional[str] = None,
+) -> Tuple[List[Dict], Optional[int]]:
+    """صفحة عناصر بعد المؤشّر (id) → (items, next_cursor أو None في آخر صفحة)."""
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    qs = RuleRunItem.objects.filter(run=run)
+    if action:
+        qs = qs.filter(action=action)
+    if cursor:
+        qs = qs.filter(id__gt=cursor)
+    rows = list(
+        qs.order_by("id").values("id", "dish_id", "name", "before", "after", "action")[: limit + 1]
+    )
+    next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def apply_run(run: RuleRun, chunk_size: int = DEFAULT_WRITE_CHUNK_SIZE) -> Dict:
+    """
+    يطبّق قرارات dry run المخزّنة (APPLY_ACTIONS فقط) على دفعات keyset:
+      - الطبق المحذوف → missing؛ تغيّرت أكواده/صار يدويًا منذ dry run → stale (بدون كتابة)
+      - تغيّرت بصمته (اسم/وصف/مكوّنات/إضافات أو إصدار القاموس) → stale: ناتج dry run
+        لم يعد يطابق مدخلاته الحالية
+      - غير ذلك: generated_codes + codes_fingerprint + codes_updated_at
+        (+ إلغاء الأكواد اليدوية لـwould_override_manual) وصفوف DishAllergen المخزّنة
+      - الطبق الذي فشلت كتابته (savepoint في _BulkWriter) → failed + failed_dishes
+    """
+    if not run.dry_run:
+        raise RuleRunError("Only dry runs can be applied.")
+    # حجز ذرّي: تطبيق واحد فقط لكل تشغيل
+    claimed = RuleRun.objects.filter(pk=run.pk, status=RuleRun.STATUS_DRY_RUN).update(status=RuleRun.STATUS_APPLYING)
+    if not claimed:
+        raise RuleRunError("Run is already applied or being applied.")
+
+    chunk_size = max(1, int(chunk_size or DEFAULT_WRITE_CHUNK_SIZE))
+    stats = {"applied": 0, "stale": 0, "missing": 0, "failed": 0}
+    writer = _BulkWriter(chunk_size)
+    versions: Dict[Optional[int], str] = {}
+
+    def current_fingerprint(dish: Dish) -> str:
+        # owner_id فارغ = كل مالك بقاموسه (generate_per_owner)
+        owner_id = run.owner_id if run.owner_id is not None else dish.section.menu.user_id
+        if owner_id not in versions:
+            versions[owner_id] = lexicon_version(owner_id)
+        return dish_fingerprint(dish, dish_text_norm(dish), versions[owner_id])
+
+    items = RuleRunItem.objects.filter(run=run, action__in=APPLY_ACTIONS).order_by("id")
+    last_id = 0
+    try:
+        while True:
+            batch = list(items.filter(id__gt=last_id)[:chunk_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            dishes = (
+                Dish.objects.select_related("section__menu").prefetch_related("ingredients")
+                .in_bulk([it.dish_id for it in batch])
+            )
+            for it in batch:
+                dish = dishes.get(it.dish_id)
+                if dish is None:
+                    stats["missing"] += 1
+                    continue
+                current_value = (dish.generated_codes or "").strip()
+                has_manual_flag = bool(dish.has_manual_codes)
+                if current_value != it.before or (has_manual_flag and it.action != "would_override_manual"):
+                    stats["stale"] += 1
+                    continue
+                if it.fingerprint and current_fingerprint(dish) != it.fingerprint:
+                    stats["stale"] += 1
+                    continue
+
+                updated_fields = ["generated_codes", "codes_updated_at"]
+                if has_manual_flag:
+                    dish.has_manual_codes = False
+                    dish.manual_codes = None
+                    updated_fields += ["has_manual_codes", "manual_codes"]
+                dish.generated_codes = it.after
+                dish.codes_updated_at = timezone.now()
+                if it.fingerprint:
+                    dish.codes_fingerprint = it.fingerprint
+                    updated_fields.append("codes_fingerprint")
+                writer.add_dish(dish, updated_fields)
+                writer.add_row_sources(dish, {code: tuple(src) for code, src in (it.rows or {}).items()})
+                writer.maybe_flush()
+                stats["applied"] += 1
+        writer.flush()
+    except Exception:
+        RuleRun.objects.filter(pk=run.pk).update(status=RuleRun.STATUS_DRY_RUN)
+        raise
+
+    failed = writer.take_failed()
+    stats["applied"] -= len(failed)
+    stats["failed"] = len(failed)
+    if failed:
+        stats["failed_dishes"] = [
+            {"dish_id": dish_id, "error": error} for dish_id, error in list(failed.items())[:ITEMS_LIMIT]
+        ]
+    stats["dishes_written"] = writer.dishes_written
+    stats["dish_allergen_rows_created"] = writer.rows_created
+    run.status = RuleRun.STATUS_APPLIED
+    run.applied_at = timezone.now()
+    run.apply_stats = stats
+    run.save(update_fields=["status", "applied_at", "apply_stats"])
+    return stats
@@ -0,0 +1,107 @@
+# core/services/rules_memo.py
+# -----------------------------------------------------------
+# ربط memo النتائج (rules_core/memo) بـDjango:
+#   - build_memo(): EvaluationMemo لتشغيل واحد (حجمه من RULES_MEMO_MAX_ENTRIES)
+#     + loader من جدول RuleResultMemo إن كان الحفظ مفعّلًا
+#   - DbMemoStore: قراءة/كتابة مجمّعة لكل دفعة (استعلام واحد لكلٍّ منهما)
+#     وحذف صفوف إصدارات القاموس القديمة لكل لقطة مرة واحدة في التشغيل
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+
+from core.dictionary_models import RuleResultMemo
+from core.rules_core import DishEvaluation
+from core.rules_core.memo import (
+    DEFAULT_MAX_ENTRIES,
+    EvaluationMemo,
+    MemoKey,
+    from_payload,
+    key_digest,
+    to_payload,
+)
+from core.rules_core.metrics import StageTimer
+from core.services.negation import NEGATION_VERSION
+from core.services.text_normalize import NORMALIZER_VERSION
+
+
+def memo_persist_enabled(flag: Optional[bool]) -> bool:
+    """flag صريح يغلب؛ None = حسب settings.RULES_MEMO_PERSIST."""
+    if flag is not None:
+        return bool(flag)
+    return bool(getattr(settings, "RULES_MEMO_PERSIST", False))
+
+
+def engine_variant() -> str:
+    """إعدادات تغيّر ناتج المحرك لنفس اللقطة (المُطبِّع + النفي + التفكيك + التقريب) → جزء من digest."""
+    return "n{}.g{}.d{}.f{}".format(
+        NORMALIZER_VERSION,
+        NEGATION_VERSION,
+        int(bool(getattr(settings, "RULES_DECOMPOUND", True))),
+        int(getattr(settings, "RULES_FUZZY_MAX_DISTANCE", 0) or 0),
+    )
+
+
+class DbMemoStore:
+    """تخزين دائم لنتائج memo في RuleResultMemo (مفتاح = digest)."""
+
+    def __init__(self, timer: Optional[StageTimer] = None) -> None:
+        self.timer = timer
+        self.variant = engine_variant()
+        self._pruned: Set[Tuple] = set()
+
+    def _stage(self, name: str):
+        return self.timer.stage(name) if self.timer is not None else nullcontext()
+
+    def prune_stale(self, snapshot_key: Tuple) -> int:
+        """يحذف صفوف نفس owner/lang بإصدار قاموس مختلف (مرة واحدة لكل لقطة)."""
+        if snapshot_key in self._pruned:
+            return 0
+        self._pruned.add(snapshot_key)
+        owner_id, lang, version = snapshot_key
+        qs = RuleResultMemo.objects.filter(lang=lang)
+        qs = qs.filter(owner_id__isnull=True) if owner_id is None else qs.filter(owner_id=owner_id)
+        deleted, _ = qs.exclude(lexicon_version=version).delete()
+        return deleted
+
+    def load(self, keys: List[MemoKey]) -> Dict[MemoKey, DishEvaluation]:
+        with self._stage("memo_db_load"):
+            for snapshot_key in {k[0] for k in keys}:
+                self.prune_stale(snapshot_key)
+            by_digest = {key_digest(k, self.variant): k for k in keys}
+            rows = RuleResultMemo.objects.filter(digest__in=list(by_digest)).values_list("digest", "payload")
+            found = {by_digest[d]: from_payload(0, payload) for d, payload in rows}
+        if self.timer is not None:
+            self.timer.incr("memo_db_hits", len(found))
+        return found
+
+    def save(self, keys: Sequence[MemoKey], evaluations: Sequence[DishEvaluation]) -> None:
+        if not keys:
+            return
+        with self._stage("memo_db_save"):
+            RuleResultMemo.objects.bulk_create(
+                [
+                    RuleResultMemo(
+                        digest=key_digest(k, self.variant),
+                        owner_id=k[0][0],
+                        lang=k[0][1],
+                        lexicon_version=k[0][2],
+                        payload=to_payload(ev),
+                    )
+                    for k, ev in zip(keys, evaluations)
+                ],
+                ignore_conflicts=True,
+            )
+
+
+def build_memo(persist: Optional[bool] = None, timer: Optional[StageTimer] = None) -> Tuple[EvaluationMemo, Optional[DbMemoStore]]:
+    store = DbMemoStore(timer) if memo_persist_enabled(persist) else None
+    memo = EvaluationMemo(
+        max_entries=getattr(settings, "RULES_MEMO_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+        loader=store.load if store is not None else None,
+    )
+    return memo, store
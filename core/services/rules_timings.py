@@ -0,0 +1,113 @@
+# core/services/rules_timings.py
+# -----------------------------------------------------------
+# قياس اختياري لتشغيل محرك القواعد (generate_for_dishes / generate_per_owner)
+#   - RunTimings: StageTimer (rules_core) + عدد استعلامات DB (كلي ولكل مرحلة)
+#     + فروق كاش لقطات القاموس و memo التطبيع خلال التشغيل
+#   - emit_timings: يمرّر الناتج إلى settings.RULES_TIMINGS_HOOK (dotted path) إن وُجد
+# الناتج يُعاد تحت مفتاح "timings" في نتيجة المحرك.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from core.rules_core import StageTimer
+from core.services.lexicon_cache import cache_stats
+from core.services.text_normalize import memo_info
+
+
+class RunTimings(StageTimer):
+    """
+    StageTimer لتشغيل كامل في العملية الأم:
+      - stage(): الزمن + الاستعلامات المنفّذة داخل المرحلة
+      - run(): يلفّ التشغيل كله (الزمن الكلي + عدّاد الاستعلامات عبر execute_wrapper)
+    أزمنة مراحل العمليات الفرعية تُدمج بالجمع (زمن CPU مجمّع، ليس زمنًا حائطيًا).
+    """
+
+    __slots__ = ("queries", "stage_queries", "total_seconds")
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.queries = 0
+        self.stage_queries: Dict[str, int] = {}
+        self.total_seconds = 0.0
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        q0 = self.queries
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - t0)
+            if self.queries != q0:
+                self.stage_queries[name] = self.stage_queries.get(name, 0) + self.queries - q0
+
+    @contextmanager
+    def run(self) -> Iterator["RunTimings"]:
+        cache0 = cache_stats()
+        memo0 = memo_info()
+        t0 = perf_counter()
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            self.total_seconds += perf_counter() - t0
+            cache1 = cache_stats()
+            memo1 = memo_info()
+            # memo التطبيع مشترك بين الخيوط: الفروق تقريبية تحت الحمل
+            self.incr("lexicon_cache_hits", cache1["hits"] - cache0["hits"])
+            self.incr("lexicon_cache_misses", cache1["misses"] - cache0["misses"])
+            self.incr("normalize_memo_hits", memo1.hits - memo0.hits)
+            self.incr("normalize_memo_misses", memo1.misses - memo0.misses)
+            self.incr("queries", self.queries)
+
+    def as_dict(self) -> Dict:
+        data = super().as_dict()
+        for name, n in self.stage_queries.items():
+            data["stages"].setdefault(name, {"ms": 0.0, "calls": 0})["queries"] = n
+        data["total_ms"] = round(self.total_seconds * 1000, 3)
+        return data
+
+
+def timings_enabled(flag: Optional[bool]) -> bool:
+    """flag صريح يغلب؛ None = مفعّل فقط إذا كان RULES_TIMINGS_HOOK مضبوطًا."""
+    if flag is not None:
+        return bool(flag)
+    return bool(getattr(settings, "RULES_TIMINGS_HOOK", ""))
+
+
+def _resolve_hook() -> Optional[Callable[[Dict, Dict], None]]:
+    hook = getattr(settings, "RULES_TIMINGS_HOOK", "")
+    if not hook:
+        return None
+    if callable(hook):
+        return hook
+    try:
+        return import_string(hook)
+    except ImportError:
+        return None
+
+
+def emit_timings(timings: Dict, context: Dict) -> None:
+    """
+    يرسل القياسات إلى hook(timings, context) المضبوط في الإعدادات.
+    أي خطأ في الـhook لا يُفشل تشغيل المحرك.
+    """
+    hook = _resolve_hook()
+    if hook is None:
+        return
+    try:
+        hook(timings, context)
+    except Exception:
+        pass
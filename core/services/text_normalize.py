@@ -0,0 +1,114 @@
+# core/services/text_normalize.py
+# -----------------------------------------------------------
+# المُطبِّع الوحيد للنصوص في المشروع (قاموس، محرك القواعد، LLM)
+#   1) lowercase
+#   2) تبسيط الألمانية قبل NFKD: ä→ae, ö→oe, ü→ue, ß→ss (+ œ→oe, æ→ae)
+#      (سابقًا كان NFKD يحذف النقطتين أولًا فيصبح "käse" → "kase" في مكان و"kaese" في آخر)
+#   3) NFKD + حذف العلامات المركّبة (accents + التشكيل العربي) عبر جدول translate
+#   4) الرموز غير الألفانوميرية → مسافة، ثم دمج المسافات
+# مع memo (LRU محدود) للنصوص القصيرة المتكرّرة، وواجهة دفعات normalize_many.
+# normalize_term: نفس الخطوات لكن الشرطة بين حرفين تبقى ("brioche-bun") — لمصطلحات
+# LLM (IngredientSuggestion ومفاتيح الكاش)؛ المطابقة مع القاموس تمرّ دائمًا بـnormalize_text.
+# لا يعتمد على Django.
+# -----------------------------------------------------------
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+# يُرفع عند أي تغيير يغيّر ناتج normalize_text؛ أمر renormalize_lexicon يقارن به.
+NORMALIZER_VERSION = 2
+
+# أطول نص يُخزَّن في الـmemo (الأوصاف الطويلة نادرًا ما تتكرّر حرفيًا)
+MEMO_MAX_LEN = 512
+MEMO_SIZE = 65536
+
+_FOLD_TABLE = str.maketrans({
+    "ä": "ae",
+    "ö": "oe",
+    "ü": "ue",
+    "ß": "ss",
+    "ẞ": "ss",
+    "œ": "oe",
+    "æ": "ae",
+})
+
+
+def _combining_table() -> Dict[int, None]:
+    """العلامات المركّبة الشائعة (Latin/Arabic/Hebrew/...) بعد NFKD → حذف."""
+    ranges = (range(0x0300, 0x3100), range(0xFE20, 0xFE30))
+    return {cp: None for r in ranges for cp in r if unicodedata.combining(chr(cp))}
+
+
+_STRIP_TABLE = _combining_table()
+_NON_ALNUM_RE = re.compile(r"[^\w\s]", flags=re.UNICODE)
+_NON_TERM_RE = re.compile(r"[^\w\s-]", flags=re.UNICODE)
+_HYPHENS_RE = re.compile(r"-{2,}")
+_LOOSE_HYPHEN_RE = re.compile(r"(?<!\w)-|-(?!\w)")  # شرطة ليست بين حرفين
+
+
+def _fold(s: str) -> str:
+    x = s.lower().translate(_FOLD_TABLE)
+    if not x.isascii():
+        x = unicodedata.normalize("NFKD", x).translate(_STRIP_TABLE)
+    return x
+
+
+def _normalize(s: str) -> str:
+    x = _NON_ALNUM_RE.sub(" ", _fold(s))
+    return " ".join(x.split())
+
+
+def _normalize_term(s: str) -> str:
+    x = _NON_TERM_RE.sub(" ", _fold(s))
+    x = _LOOSE_HYPHEN_RE.sub(" ", _HYPHENS_RE.sub("-", x))
+    return " ".join(x.split())
+
+
+_normalize_memo = lru_cache(maxsize=MEMO_SIZE)(_normalize)
+_normalize_term_memo = lru_cache(maxsize=MEMO_SIZE)(_normalize_term)
+
+
+def normalize_text(s: str) -> str:
+    """
+    تطبيع قوي وموحّد للنص (انظر رأس الملف).
+    النصوص القصيرة تمرّ عبر memo محدود (LRU)؛ الطويلة تُحسب مباشرة.
+    """
+    if not s:
+        return ""
+    s = str(s)
+    if len(s) <= MEMO_MAX_LEN:
+        return _normalize_memo(s)
+    return _normalize(s)
+
+
+def normalize_term(s: str) -> str:
+    """normalize_text مع إبقاء الشرطة داخل الكلمة المركّبة ("Brioche-Bun" → "brioche-bun")."""
+    if not s:
+        return ""
+    s = str(s)
+    if len(s) <= MEMO_MAX_LEN:
+        return _normalize_term_memo(s)
+    return _normalize_term(s)
+
+
+def normalize_many(texts: Iterable[str]) -> List[str]:
+    """تطبيع دفعة نصوص في نداء واحد (مع إزالة التكرار داخل الدفعة)."""
+    seen: Dict[str, str] = {}
+    out: List[str] = []
+    for t in texts:
+        key = str(t) if t else ""
+        norm = seen.get(key)
+        if norm is None:
+            norm = normalize_text(key)
+            seen[key] = norm
+        out.append(norm)
+    return out
+
+
+def memo_info():
+    """إحصائيات الـmemo (hits/misses/currsize) للتشخيص."""
+    return _normalize_memo.cache_info()
@@ -1,3 +1,1143 @@
-from django.test import TestCase
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.llm_clients import openai_client
+from core.llm_clients.rate_limiter import CircuitOpen, ModelLimiter
+from core.models import Allergen, Dish, DishAllergen, Ingredient, IngredientSuggestion, Menu, RuleRun, Section, User
+from core.dictionary_models import KeywordLexeme, LexiconVersion, LLMResponseCache, NegationCue
+from core.services.allergen_rules import (
+    COMPACT_ITEM_KEYS,
+    _BulkWriter,
+    explain_dish,
+    generate_for_dishes,
+    parse_resume_token,
+    resume_token,
+)
+from core.services.dish_index import LexiconChange, affected_dishes
+from core.services.fuzzy_index import FuzzyIndex, allowed_distance, osa_distance
+from core.rules_core.engine import evaluate_many
+from core.rules_core.types import DishRecord, IngredientRecord
+from core.services.lexicon_cache import clear_lexicon_cache, get_lexicon_snapshot
+from core.services.lexicon_matcher import LexemeEntry, LexiconMatcher, PhraseIndex
+from core.services.llm_cache import DbLLMStore, LLMCache, get_llm_cache
+from core.services.llm_fanout import fan_out, max_in_flight
+from core.services.llm_ingest import (
+    LLMConfig,
+    _approx_tokens,
+    _split_by_budget,
+    llm_extract_terms,
+    llm_extract_terms_batch,
+    llm_map_terms_to_codes,
+)
+from core.services import regex_guard, text_normalize
+from core.services.rules_engine import infer_codes_from_text
+from core.services.rule_runs import RuleRunError, apply_run, record_run
+
+BATCH_URL = "/api/dishes/batch-generate-allergen-codes/"
+
+
+def make_owner(username="owner"):
+    user = User.objects.create(username=username, role="owner")
+    if user.pk == settings.GLOBAL_LEXICON_OWNER_ID:  # هذا المالك = القاموس العام
+        user = User.objects.create(username=f"{username}-1", role="owner")
+    menu = Menu.objects.create(user=user, name="M")
+    section = Section.objects.create(menu=menu, user=user, name="S")
+    return user, section
+
+
+def make_lexeme(term, codes, owner=None, is_regex=False, lang="de"):
+    for code in codes:
+        Allergen.objects.get_or_create(code=code, defaults={"label_de": code})
+    lexeme = KeywordLexeme.objects.create(term=term, owner=owner, lang=lang, is_regex=is_regex)
+    lexeme.allergens.set(Allergen.objects.filter(code__in=codes))
+    return lexeme
+
+
+class RulesTestCase(TestCase):
+    """لقطات القاموس مخزّنة في العملية ومفتاحها LexiconVersion (يُلغى مع rollback كل اختبار)."""
+
+    def setUp(self):
+        clear_lexicon_cache()
+        self.addCleanup(clear_lexicon_cache)
+        self.user, self.section = make_owner()
+
+    def dish(self, name, description=""):
+        return Dish.objects.create(section=self.section, name=name, description=description)
+
+    def generate(self, *dishes, **kwargs):
+        qs = Dish.objects.filter(pk__in=[d.pk for d in dishes]).order_by("id")
+        return generate_for_dishes(qs, owner_id=self.user.id, **kwargs)
+
+
+@contextmanager
+def failing_writes(*dish_ids):
+    """DatabaseError لأي كتابة تشمل هذه الأطباق (الدفعة ثم savepoint الطبق)."""
+    real_write = _BulkWriter._write
+
+    def write(writer, dishes, rows, fields):
+        if any(d.pk in dish_ids for d in dishes) or any(pk in rows for pk in dish_ids):
+            raise DatabaseError("simulated write failure")
+        return real_write(writer, dishes, rows, fields)
+
+    with mock.patch.object(_BulkWriter, "_write", write):
+        yield
+
+
+def fake_llm(prompt, **kwargs):
+    """رد LLM صالح لبرومبتات الاستخراج (فردي/دفعة) والتخمين."""
+    if "DISHES:" in prompt:
+        dishes = json.loads(prompt.split("DISHES:")[1].split("Return ONLY")[0])
+        return json.dumps({k: ["wunderkraut"] for k in dishes})
+    if "term extractor" in prompt:
+        return '["wunderkraut"]'
+    if "allergen labeler" in prompt:
+        terms = json.loads(prompt.split("Terms (language=de):")[1].split("Return ONLY")[0])
+        return json.dumps({t: {"codes": "", "confidence": 0.1, "reason": "generic"} for t in terms})
+    return ""
+
+
+# ------------------------------------------------------------
+# Text normalization
+# ------------------------------------------------------------
+class TextNormalizeTests(SimpleTestCase):
+    def test_german_folding_before_accent_stripping(self):
+        normalize = text_normalize.normalize_text
+        self.assertEqual(normalize("Käse"), "kaese")
+        self.assertEqual(normalize("Weißwurst mit SÜẞEM Senf"), "weisswurst mit suessem senf")
+        self.assertEqual(normalize("Crêpe (Œufs), Æbleskiver!"), "crepe oeufs aebleskiver")
+
+    def test_hyphens(self):
+        self.assertEqual(text_normalize.normalize_text("Brioche-Bun"), "brioche bun")
+        self.assertEqual(text_normalize.normalize_term("Brioche-Bun"), "brioche-bun")
+        self.assertEqual(text_normalize.normalize_term("Sesam- und Mohn--Brötchen -"), "sesam und mohn-broetchen")
+
+    def test_llm_terms_keep_compound_hyphens(self):
+        terms = llm_extract_terms(lambda *a, **k: '["Brioche-Bun", "Käse"]', LLMConfig(), "Burger", "")
+        self.assertEqual(terms, ["brioche-bun", "kaese"])
+        fallback = llm_extract_terms(lambda *a, **k: "", LLMConfig(), "Brioche-Bun mit Käse", "")
+        self.assertEqual(fallback, ["brioche-bun", "kaese"])
+
+    def test_memo_is_limited_to_short_texts(self):
+        text_normalize.normalize_text("kurzer Text")
+        before = text_normalize.memo_info()
+        self.assertEqual(text_normalize.normalize_text("kurzer Text"), "kurzer text")
+        self.assertEqual(text_normalize.memo_info().hits, before.hits + 1)
+
+        long_text = "Ä" * (text_normalize.MEMO_MAX_LEN + 1)
+        self.assertEqual(text_normalize.normalize_text(long_text), "ae" * (text_normalize.MEMO_MAX_LEN + 1))
+        after = text_normalize.memo_info()
+        self.assertEqual((after.misses, after.currsize), (before.misses, before.currsize))
+
+
+# ------------------------------------------------------------
+# Rules engine: Aho-Corasick lexicon matcher
+# ------------------------------------------------------------
+def _old_match_plain(text_norm, term_norm):
+    """المطابقة القديمة (regex لكل مصطلح) كمرجع."""
+    pat = rf"(?:(?<=\s)|^){re.escape(term_norm)}(?:(?=\s)|$)"
+    return re.search(pat, text_norm, flags=re.IGNORECASE) is not None
+
+
+class LexiconMatcherTests(SimpleTestCase):
+    WORDS = ("ei", "eier", "butter", "erdnuss", "nuss", "milch", "reis", "milchreis", "brot")
+
+    def _compile(self, terms):
+        matcher, phrases = LexiconMatcher(), PhraseIndex()
+        for i, term in enumerate(terms):
+            entry = LexemeEntry(id=i, term=term, term_norm=term)
+            if matcher.add(term, entry):
+                phrases.add(term, entry)
+        return matcher.build(), phrases
+
+    def _brute_force(self, text, terms):
+        """كل المواضع بحدود كلمات، ثم حذف المحتواة داخل أطول منها."""
+        spans = [
+            (i, i + len(t), t) for t in terms for i in range(len(text))
+            if text.startswith(t, i) and (i == 0 or text[i - 1] == " ")
+            and (i + len(t) == len(text) or text[i + len(t)] == " ")
+        ]
+        kept = [s for s in spans if not any(o[0] <= s[0] and s[1] <= o[1] and o[:2] != s[:2] for o in spans)]
+        return sorted(set(kept)), {t for _, _, t in spans}
+
+    def test_longest_match_wins(self):
+        matcher, _ = self._compile(["butter", "erdnuss", "erdnuss butter"])
+        hits = matcher.find("erdnuss butter kekse mit butter")
+        self.assertEqual([(h.start, h.end, h.term_norm) for h in hits], [(0, 14, "erdnuss butter"), (25, 31, "butter")])
+
+    def test_word_boundaries(self):
+        matcher, _ = self._compile(["ei", "reis"])
+        self.assertEqual([h.start for h in matcher.find("eier brei ei reisig reis")], [10, 20])
+
+    def test_agrees_with_regex_reference_on_random_texts(self):
+        rng = random.Random(1)
+        pool = self.WORDS + ("erdnuss butter", "milch reis", "ei ei")
+        for _ in range(300):
+            terms = rng.sample(pool, rng.randint(1, len(pool)))
+            text = " ".join(rng.choice(self.WORDS + ("xx", "kuchen")) for _ in range(rng.randint(0, 12)))
+            matcher, phrases = self._compile(terms)
+            expected, found_terms = self._brute_force(text, terms)
+
+            hits = [(h.start, h.end, h.term_norm) for h in matcher.find(text)]
+            self.assertEqual(hits, expected, (text, terms))
+            self.assertEqual(found_terms, {t for t in terms if _old_match_plain(text, t)}, (text, terms))
+            self.assertEqual(
+                [(h.start, h.end, h.term_norm) for h in phrases.find_many([text])[0]], hits, (text, terms),
+            )
+
+
+# ------------------------------------------------------------
+# Rules engine: shared lexicon snapshot (LexiconVersion)
+# ------------------------------------------------------------
+class LexiconSnapshotTests(RulesTestCase):
+    def _terms(self):
+        return {e.term_norm for e in get_lexicon_snapshot(self.user.id).entries}
+
+    def test_lexeme_and_cue_changes_bump_the_version_and_rebuild(self):
+        first = get_lexicon_snapshot(self.user.id)
+        self.assertIs(get_lexicon_snapshot(self.user.id), first)  # نفس الإصدار → من الكاش
+
+        lexeme = make_lexeme("senf", ["J"], owner=self.user)
+        self.assertNotEqual(LexiconVersion.current(self.user.id), first.version)
+        self.assertIn("senf", self._terms())
+
+        version = LexiconVersion.current(self.user.id)
+        lexeme.allergens.set(Allergen.objects.filter(code="J"))
+        lexeme.allergens.add(Allergen.objects.create(code="M", label_de="Senf"))
+        self.assertNotEqual(LexiconVersion.current(self.user.id), version)
+        self.assertEqual(get_lexicon_snapshot(self.user.id).rules.lexeme_codes, (("senf", False, frozenset("JM")),))
+
+        version = LexiconVersion.current(self.user.id)
+        NegationCue.objects.create(owner=self.user, lang="de", cue="frei von", window_after=2)
+        self.assertNotEqual(LexiconVersion.current(self.user.id), version)
+
+        lexeme.delete()
+        self.assertNotIn("senf", self._terms())
+
+    def test_other_owner_changes_keep_the_snapshot(self):
+        Allergen.objects.create(code="J", label_de="Senf")  # Allergen يرفع الإصدار العام
+        first = get_lexicon_snapshot(self.user.id)
+        other, _ = make_owner("other")
+        make_lexeme("senf", ["J"], owner=other)
+        self.assertIs(get_lexicon_snapshot(self.user.id), first)
+
+    def test_legacy_engine_uses_the_same_scope_as_the_rules_engine(self):
+        global_id = settings.GLOBAL_LEXICON_OWNER_ID
+        global_owner = User.objects.filter(pk=global_id).first() or User.objects.create(pk=global_id, username="global")
+        make_lexeme("senf", ["J"], owner=global_owner)
+        make_lexeme("weizen", ["A"])
+        make_lexeme("sesam", ["N"], owner=self.user)
+
+        text = "Wurst mit Senf, Weizen und Sesam"
+        self.assertEqual(infer_codes_from_text(self.user.id, text), {"A", "J", "N"})
+        self.assertEqual(self.generate(self.dish(text))["items"][0]["after"], "(A,J,N)")
+
+
+# ------------------------------------------------------------
+# Rules engine: negation cues (token windows)
+# ------------------------------------------------------------
+class NegationTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("sesam", ["N"])
+        make_lexeme("käse", ["G"])
+
+    def _codes(self, text):
+        return self.generate(self.dish(text))["items"][0]["after"]
+
+    def test_ohne_negates_following_words_up_to_the_clause_boundary(self):
+        self.assertEqual(self._codes("Brot ohne Sesam und Käse"), "")
+        self.assertEqual(self._codes("Brot ohne Zwiebeln, mit Käse und Sesam"), "(G,N)")
+        self.assertEqual(self._codes("Brot ohne Sesam, aber Käse"), "(G)")
+
+    def test_kein_negates_the_next_word_only(self):
+        self.assertEqual(self._codes("Brot, keinen Sesam"), "")
+        self.assertEqual(self._codes("Brot, kein Zucker Sesam"), "(N)")
+
+    def test_frei_negates_the_previous_word_and_compounds(self):
+        self.assertEqual(self._codes("Sesam-frei gebacken"), "")
+        self.assertEqual(self._codes("sesamfreies Brot mit Käse"), "(G)")
+
+    def test_owner_cue_rows_override_defaults(self):
+        NegationCue.objects.create(owner=self.user, lang="de", cue="ohne", window_before=0, window_after=1)
+        NegationCue.objects.create(owner=self.user, lang="de", cue="plus", window_before=0, window_after=0)
+        self.assertEqual(self._codes("Brot ohne Zwiebeln Sesam"), "(N)")
+        NegationCue.objects.filter(owner=self.user, cue="ohne").update(window_after=6)
+        NegationCue.objects.create(owner=self.user, lang="de", cue="mit", is_active=False)
+        clear_lexicon_cache()  # update() لا يطلق الإشارات → لا رفع لإصدار القاموس
+        self.assertEqual(self._codes("Brot ohne Zwiebeln mit Sesam plus Käse"), "(G)")
+
+
+# ------------------------------------------------------------
+# Rules engine: bulk write path (_BulkWriter)
+# ------------------------------------------------------------
+def legacy_write(dish):
+    """مرجع: مسار الكتابة القديم — save() لكل طبق ثم DishAllergen.objects.create لكل كود ناقص."""
+    ex = explain_dish(dish)
+    if ex["has_manual_codes"]:
+        return
+    dish.codes_updated_at = timezone.now()
+    fields = ["codes_updated_at"]
+    if ex["after"] != ex["before"]:
+        dish.generated_codes = ex["after"]
+        fields.append("generated_codes")
+    dish.save(update_fields=fields)
+
+    details = ex["details"]
+    prov_ing, prov_lex = details["provenance"]["ingredient"], details["provenance"]["lexeme"]
+    existed = set(dish.allergen_rows.values_list("allergen__code", flat=True))
+    for code in sorted(set(details["letters_from_ingredients"]) | set(details["letters_from_lexemes"])):
+        allergen = Allergen.objects.filter(code=code).first()
+        if code in existed or allergen is None:
+            continue
+        if prov_ing.get(code):
+            source, confidence, rationale = DishAllergen.Source.INGREDIENT, 0.98, "; ".join(prov_ing[code][:3])
+        elif prov_lex.get(code):
+            source, confidence, rationale = DishAllergen.Source.REGEX, 0.90, "; ".join(prov_lex[code][:3])
+        else:
+            source, confidence, rationale = DishAllergen.Source.REGEX, 0.50, ""
+        DishAllergen.objects.create(
+            dish=dish, allergen=allergen, source=source, confidence=confidence, rationale=rationale,
+            is_confirmed=False, created_by=None,
+        )
+
+
+class BulkWriteTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("käse", ["G"])
+        make_lexeme("butter", ["G"])
+        make_lexeme("erdnuss butter", ["E"])
+        make_lexeme("weizenmehl", ["A"])
+        self.legacy_user, self.legacy_section = make_owner("legacy")
+
+    def _menu(self, user, section):
+        flour = Ingredient.objects.create(owner=user, name="Mehl", synonyms=["Mehl"])
+        flour.allergens.set(Allergen.objects.filter(code="A"))
+        make = lambda name, **kw: Dish.objects.create(section=section, name=name, **kw)  # noqa: E731
+        make("Käsespätzle")
+        make("Brot").ingredients.add(flour)
+        make("Erdnuss Butter Keks")
+        make("Salat")
+        make("Fondue mit Käse", has_manual_codes=True, manual_codes="(G)")
+        pizza = make("Pizza mit Käse und Weizenmehl")
+        DishAllergen.objects.create(
+            dish=pizza, allergen=Allergen.objects.get(code="G"), source=DishAllergen.Source.MANUAL, confidence=1.0,
+        )
+
+    def _state(self, user):
+        dishes = Dish.objects.filter(section__menu__user=user).order_by("name")
+        return {
+            d.name: (
+                d.generated_codes,
+                d.codes_updated_at is not None,
+                sorted(d.allergen_rows.values_list("allergen__code", "source", "confidence", "rationale")),
+            )
+            for d in dishes
+        }
+
+    def test_bulk_write_matches_per_dish_save(self):
+        self._menu(self.legacy_user, self.legacy_section)
+        self._menu(self.user, self.section)
+        for dish in Dish.objects.filter(section__menu__user=self.legacy_user).order_by("id"):
+            legacy_write(dish)
+
+        qs = Dish.objects.filter(section__menu__user=self.user).order_by("id")
+        res = generate_for_dishes(qs, owner_id=self.user.id, dry_run=False, chunk_size=2)
+
+        expected = self._state(self.legacy_user)
+        self.assertEqual(self._state(self.user), expected)
+        self.assertEqual(expected["Erdnuss Butter Keks"][0], "(E)")
+        self.assertEqual([r[:2] for r in expected["Pizza mit Käse und Weizenmehl"][2]], [("A", "regex"), ("G", "manual")])
+        self.assertEqual(expected["Brot"][2], [("A", "ingredient", 0.98, "Ingredient: Mehl → A")])
+        self.assertEqual(res["failed"], 0)
+
+    def test_failed_chunk_falls_back_to_per_dish_savepoints(self):
+        ok1, bad, ok2 = self.dish("Käsebrot"), self.dish("Butterkeks"), self.dish("Käsekuchen")
+        calls = []
+        with failing_writes(bad.pk):
+            write = _BulkWriter._write
+
+            def spy(writer, dishes, rows, fields):
+                calls.append(sorted({d.pk for d in dishes} | set(rows)))
+                return write(writer, dishes, rows, fields)
+
+            with mock.patch.object(_BulkWriter, "_write", spy):
+                res = self.generate(ok1, bad, ok2, dry_run=False, chunk_size=10)
+
+        # محاولة الدفعة كاملة ثم طبق طبق (savepoint لكل واحد)
+        self.assertEqual(calls, [sorted([ok1.pk, bad.pk, ok2.pk]), [ok1.pk], [bad.pk], [ok2.pk]])
+        self.assertEqual(res["failed"], 1)
+        self.assertEqual(res["changed"], 2)
+        self.assertEqual([f["dish_id"] for f in res["failed_dishes"]], [bad.pk])
+        self.assertIn("simulated write failure", res["failed_dishes"][0]["error"])
+        actions = {item["dish_id"]: item["action"] for item in res["items"]}
+        self.assertEqual(actions[bad.pk], "failed")
+
+        for d in (ok1, bad, ok2):
+            d.refresh_from_db()
+        self.assertEqual((ok1.generated_codes, ok2.generated_codes), ("(G)", "(G)"))
+        self.assertEqual(ok1.allergen_rows.count(), 1)
+        self.assertFalse(bad.generated_codes)
+        self.assertFalse(bad.allergen_rows.exists())
+
+
+# ------------------------------------------------------------
+# Rules engine: incremental mode (Dish.codes_fingerprint)
+# ------------------------------------------------------------
+class IncrementalTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("käse", ["G"])
+        make_lexeme("sesam", ["N"])
+        self.d = self.dish("Käsebrot")
+        self.generate(self.d, dry_run=False)
+        self.d.refresh_from_db()
+        self.stamp = self.d.codes_updated_at
+
+    def _run(self, **kwargs):
+        res = self.generate(self.d, dry_run=False, incremental=True, **kwargs)
+        self.d.refresh_from_db()
+        return res, res["items"][0]["action"]
+
+    def test_unchanged_fingerprint_is_skipped(self):
+        self.assertTrue(self.d.codes_fingerprint)
+        res, action = self._run()
+        self.assertEqual(action, "unchanged_fingerprint")
+        self.assertEqual(res["unchanged_fingerprint"], 1)
+        self.assertEqual(self.d.codes_updated_at, self.stamp)
+
+        _, action = self._run(force=True)
+        self.assertEqual(action, "unchanged")
+
+    def test_name_change_recomputes(self):
+        old = self.d.codes_fingerprint
+        Dish.objects.filter(pk=self.d.pk).update(name="Sesambrot")
+        self.d.refresh_from_db()
+
+        res, action = self._run()
+        self.assertEqual(action, "changed")
+        self.assertEqual(res["unchanged_fingerprint"], 0)
+        self.assertEqual(self.d.generated_codes, "(N)")
+        self.assertNotEqual(self.d.codes_fingerprint, old)
+
+    def test_description_change_with_same_result_refreshes_fingerprint(self):
+        old = self.d.codes_fingerprint
+        Dish.objects.filter(pk=self.d.pk).update(description="frisch gebacken")
+        self.d.refresh_from_db()
+
+        _, action = self._run()
+        self.assertEqual(action, "unchanged")
+        self.assertNotEqual(self.d.codes_fingerprint, old)
+        self.assertEqual(self.d.codes_updated_at, self.stamp)
+        _, action = self._run()
+        self.assertEqual(action, "unchanged_fingerprint")
+
+    def test_lexicon_version_bump_recomputes(self):
+        before = LexiconVersion.current(self.user.id)
+        make_lexeme("brot", ["A"])
+        self.assertNotEqual(LexiconVersion.current(self.user.id), before)
+
+        _, action = self._run()
+        self.assertEqual(action, "changed")
+        self.assertEqual(self.d.generated_codes, "(A,G)")
+
+
+# ------------------------------------------------------------
+# Rules engine: dry run → apply (RuleRun) + resume tokens
+# ------------------------------------------------------------
+class ApplyRunTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("butter", ["G"])
+        self.fresh = self.dish("Butterbrot")
+        self.stale = self.dish("Butterkuchen")
+
+    def _dry_run(self):
+        qs = Dish.objects.filter(section__menu__user=self.user).order_by("id")
+        result = record_run(generate_for_dishes, qs, user=self.user, owner_id=self.user.id, dry_run=True)
+        return RuleRun.objects.get(pk=result["run_id"])
+
+    def test_stale_dish_is_skipped(self):
+        run = self._dry_run()
+        self.assertEqual(run.status, RuleRun.STATUS_DRY_RUN)
+        self.assertFalse(Dish.objects.exclude(generated_codes="").exists())  # dry run لا يكتب
+        Dish.objects.filter(pk=self.stale.pk).update(generated_codes="X")  # تغيّر بعد dry run
+
+        stats = apply_run(run)
+
+        self.assertEqual((stats["applied"], stats["stale"], stats["missing"]), (1, 1, 0))
+        self.fresh.refresh_from_db()
+        self.stale.refresh_from_db()
+        self.assertEqual(self.fresh.generated_codes, "(G)")
+        self.assertEqual(self.stale.generated_codes, "X")
+        run.refresh_from_db()
+        self.assertEqual(run.status, RuleRun.STATUS_APPLIED)
+
+    def test_edited_text_makes_dish_stale(self):
+        run = self._dry_run()
+        Dish.objects.filter(pk=self.stale.pk).update(name="Apfelkuchen")  # الأكواد لم تتغيّر، النص تغيّر
+
+        stats = apply_run(run)
+
+        self.assertEqual((stats["applied"], stats["stale"]), (1, 1))
+        self.stale.refresh_from_db()
+        self.assertEqual((self.stale.generated_codes, self.stale.codes_fingerprint), ("", ""))
+
+    def test_failed_write_is_reported_not_applied(self):
+        run = self._dry_run()
+        with failing_writes(self.stale.pk):
+            stats = apply_run(run)
+
+        self.assertEqual((stats["applied"], stats["failed"]), (1, 1))
+        self.assertEqual([f["dish_id"] for f in stats["failed_dishes"]], [self.stale.pk])
+        self.fresh.refresh_from_db()
+        self.assertEqual(self.fresh.generated_codes, "(G)")
+
+    def test_double_apply_is_rejected(self):
+        run = self._dry_run()
+        apply_run(run)
+        with self.assertRaises(RuleRunError):
+            apply_run(RuleRun.objects.get(pk=run.pk))
+
+    def test_resume_token_round_trip(self):
+        self.assertEqual(parse_resume_token(resume_token(self.user.id, 42)), (self.user.id, 42))
+        self.assertEqual(parse_resume_token(resume_token(None, 7)), (None, 7))
+        for bad in ("", "r1.5", "r0.5.42", "r1.x.42"):
+            with self.assertRaises(ValueError):
+                parse_resume_token(bad)
+
+
+# ------------------------------------------------------------
+# Rules engine: targeted recomputation (DishToken index)
+# ------------------------------------------------------------
+class AffectedDishesTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.compound = self.dish("Sesambrötchen")
+        self.plain = self.dish("Brot", "mit Sesam")
+        self.other = self.dish("Apfelstrudel")
+
+    def _affected(self, term):
+        change = LexiconChange(owner_id=self.user.id)
+        change.add_lexeme(make_lexeme(term, ["N"], owner=self.user))
+        return set(affected_dishes(change).values_list("id", flat=True))
+
+    def test_compound_dish_is_selected_when_decompounding(self):
+        affected = self._affected("sesam")
+        self.assertEqual(affected, {self.compound.id, self.plain.id})
+        self.assertEqual(self.generate(self.compound)["items"][0]["after"], "(N)")
+
+    @override_settings(RULES_DECOMPOUND=False)
+    def test_exact_tokens_only_without_decompounding(self):
+        self.assertEqual(self._affected("sesam"), {self.plain.id})
+
+    @override_settings(RULES_FUZZY_MAX_DISTANCE=1)
+    def test_fuzzy_matching_selects_whole_owner_scope(self):
+        self.assertEqual(self._affected("sesam"), {self.compound.id, self.plain.id, self.other.id})
+
+
+# ------------------------------------------------------------
+# Rules engine: fuzzy matching (SymSpell + OSA)
+# ------------------------------------------------------------
+class FuzzyIndexTests(SimpleTestCase):
+    def test_osa_distance_counts_transposition_once_and_stops_at_limit(self):
+        self.assertEqual(osa_distance("sesam", "sesam", 1), 0)
+        self.assertEqual(osa_distance("seasm", "sesam", 1), 1)
+        self.assertEqual(osa_distance("mozarella", "mozzarella", 2), 1)
+        self.assertEqual(osa_distance("sellrie", "sellerie", 1), 1)
+        self.assertEqual(osa_distance("selerei", "sellerie", 1), 2)
+        self.assertEqual(osa_distance("sesam", "senf", 1), 2)
+
+    def test_allowed_distance_by_length(self):
+        self.assertEqual([allowed_distance(n) for n in (3, 4, 5, 8, 9, 12)], [0, 0, 1, 1, 2, 2])
+        self.assertEqual(allowed_distance(12, cap=1), 1)
+
+    def test_lookup_respects_distance_and_min_length(self):
+        index = FuzzyIndex(max_distance=2)
+        for term in ("sesam", "mozzarella", "brot", "senf"):
+            index.add(term, term)
+        self.assertEqual(len(index), 2)  # brot/senf أقصر من 5 → لا تُفهرس
+
+        self.assertEqual(index.lookup("sesamm"), ("sesam", "sesam", 1))
+        self.assertEqual(index.lookup("mozarrella"), ("mozzarella", "mozzarella", 2))
+        self.assertIsNone(index.lookup("mozarela"))  # 8 أحرف → مسافة 1 فقط
+        self.assertIsNone(index.lookup("sesamxx"))
+        self.assertIsNone(index.lookup("boot"))
+        self.assertIsNone(index.lookup("sesam"))  # مطابقة تامة ليست fuzzy
+
+        capped = FuzzyIndex(max_distance=1)
+        capped.add("mozzarella", "mozzarella")
+        self.assertIsNone(capped.lookup("mozarrella"))
+        self.assertEqual(capped.lookup("mozarella"), ("mozzarella", "mozzarella", 1))
+
+
+class FuzzyMatchingTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("sesam", ["N"])
+
+    def _codes(self, name):
+        clear_lexicon_cache()
+        return self.generate(self.dish(name))["items"][0]["after"]
+
+    def test_fuzzy_is_off_by_default(self):
+        self.assertEqual(settings.RULES_FUZZY_MAX_DISTANCE, 0)
+        self.assertEqual(self._codes("Sesamm Brötchen"), "")
+
+    @override_settings(RULES_FUZZY_MAX_DISTANCE=1)
+    def test_fuzzy_matches_typos_within_limit(self):
+        self.assertEqual(self._codes("Sesamm Brötchen"), "(N)")
+        self.assertEqual(self._codes("Sesmmx Brötchen"), "")
+
+
+# ------------------------------------------------------------
+# Rules engine: batch matching (evaluate_many batch=True)
+# ------------------------------------------------------------
+class BatchMatchingTests(RulesTestCase):
+    WORDS = [
+        "käse", "butter", "erdnuss", "erdnussbutter", "weizen", "mehl", "sesam", "ohne", "mit",
+        "und", "brot", "salat", "frei", "von", "milch", "ei", "eier", "nüsse", "walnuss", "senf",
+        "schoko", "kuchen", "suppe", "laktosefrei", "glutenfrei",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        for term, codes in [
+            ("käse", ["G"]), ("butter", ["G"]), ("erdnuss butter", ["E"]), ("weizen", ["A"]),
+            ("sesam", ["N"]), ("milch", ["G"]), ("eier", ["C"]), ("senf", ["M"]),
+        ]:
+            make_lexeme(term, codes)
+        make_lexeme(r"\bwal\w*nuss\b", ["H"], is_regex=True)
+        NegationCue.objects.create(owner=self.user, lang="de", cue="ohne", window_before=0, window_after=2)
+        NegationCue.objects.create(owner=self.user, lang="de", cue="frei von", window_after=2)
+
+    def _corpus(self, n, seed):
+        rnd = random.Random(seed)
+        ing = IngredientRecord(name="Weizenmehl", letters=("A",))
+        return [
+            DishRecord(
+                dish_id=i,
+                name=" ".join(rnd.choices(self.WORDS, k=rnd.randint(1, 6))).title(),
+                description=" ".join(rnd.choices(self.WORDS, k=rnd.randint(0, 8))),
+                ingredients=(ing,) if rnd.random() < 0.2 else (),
+            )
+            for i in range(n)
+        ]
+
+    def test_batch_equals_per_dish(self):
+        rules = get_lexicon_snapshot(self.user.id, "de").rules
+        self.assertIsNotNone(rules.lexicon.phrases)
+        for seed in range(5):
+            records = self._corpus(80, seed)
+            per_dish = evaluate_many(records, rules)
+            batched = evaluate_many(records, rules, batch=True)
+            self.assertEqual(batched, per_dish, f"seed={seed}")
+            self.assertTrue(any(ev.codes for ev in per_dish))
+
+    def test_generate_with_batch_matching_equals_default(self):
+        dishes = [self.dish(r.name, r.description) for r in self._corpus(30, 99)]
+        default = self.generate(*dishes)["items"]
+        batched = self.generate(*dishes, batch_matching=True)["items"]
+        self.assertEqual(batched, default)
+
+
+# ------------------------------------------------------------
+# API: compact batch payload + explain-codes (طبق واحد)
+# ------------------------------------------------------------
+class ExplainCodesApiTests(RulesTestCase):
+    def setUp(self):
+        super().setUp()
+        make_lexeme("käse", ["G"])
+        self.d = self.dish("Käsebrot", "mit Butter")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _explain_url(self, dish):
+        return f"/api/dishes/{dish.pk}/explain-codes/"
+
+    def test_batch_items_are_compact_by_default(self):
+        res = self.client.post(BATCH_URL, {}, format="json")
+        self.assertEqual(res.status_code, 200)
+        items = res.json()["rules"]["items"]
+        self.assertEqual(items, [{"dish_id": self.d.pk, "before": "", "after": "(G)", "action": "would_change"}])
+        self.assertEqual(tuple(items[0]), COMPACT_ITEM_KEYS)
+
+        res = self.client.post(BATCH_URL, {"include_details": True}, format="json")
+        self.assertIn("details", res.json()["rules"]["items"][0])
+
+    def test_explain_returns_provenance_without_writing(self):
+        res = self.client.get(self._explain_url(self.d))
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertEqual(body["after"], "(G)")
+        self.assertIn("G", body["details"]["provenance"]["lexeme"])
+        self.d.refresh_from_db()
+        self.assertFalse(self.d.generated_codes)
+
+    def test_explain_hides_other_owners_dish(self):
+        _, other_section = make_owner("other")
+        other = Dish.objects.create(section=other_section, name="Käse")
+        self.assertEqual(self.client.get(self._explain_url(other)).status_code, 404)
+
+        admin = User.objects.create(username="admin", role="admin")
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.client.get(self._explain_url(other)).status_code, 200)
+        res = self.client.get(self._explain_url(other), {"owner_id": "x"})
+        self.assertEqual(res.status_code, 400)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self._explain_url(self.d)).status_code, 401)
+
+
+# ------------------------------------------------------------
+# Rules engine: regex lexeme guard
+# ------------------------------------------------------------
+class RegexGuardTests(SimpleTestCase):
+    PATTERN = r"sesam\w*"
+
+    def setUp(self):
+        patcher = mock.patch.object(regex_guard, "_probed_ok", set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_static_verdicts(self):
+        self.assertEqual(regex_guard.check_regex("(").status, "invalid")
+        self.assertEqual(regex_guard.check_regex(r"(a+)+$").reason, "nested unbounded quantifiers")
+        verdict = regex_guard.check_regex(r"\bk(ae|ä)se", dynamic=False)
+        self.assertTrue(verdict.ok)
+        self.assertEqual(verdict.literal, "se")
+
+    def test_transient_slow_run_is_retried(self):
+        timings = iter([1.0] + [0.0] * 10_000)  # توقّف عابر (GC/حمل) في أول تشغيل فقط
+        with mock.patch.object(regex_guard, "_search_seconds", side_effect=lambda *a: next(timings)):
+            self.assertTrue(regex_guard.check_regex(self.PATTERN).ok)
+
+    def test_risky_timing_verdict_is_not_cached(self):
+        with mock.patch.object(regex_guard, "_search_seconds", return_value=1.0):
+            self.assertEqual(regex_guard.check_regex(self.PATTERN).status, "risky")
+        self.assertTrue(regex_guard.check_regex(self.PATTERN).ok)
+
+    def test_ok_dynamic_verdict_is_cached_and_static_check_never_probes(self):
+        with mock.patch.object(regex_guard, "_probe", return_value="") as probe:
+            regex_guard.check_regex(self.PATTERN, dynamic=False)
+            probe.assert_not_called()
+            regex_guard.check_regex(self.PATTERN)
+            regex_guard.check_regex(self.PATTERN)
+            self.assertEqual(probe.call_count, 1)
+
+
+# ------------------------------------------------------------
+# Rules engine: bench_rules على بيانات اصطناعية صغيرة (تشغيل فعلي لكود القياس)
+# ------------------------------------------------------------
+class BenchRulesBenchmarkTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def _bench(self, **opts):
+        out = self.tmp / "bench.json"
+        call_command(
+            "bench_rules", dishes=60, lexemes=80, owners=1, chunk_size=25, seed=7,
+            output=str(out), stdout=StringIO(), **opts,
+        )
+        return json.loads(out.read_text(encoding="utf-8"))
+
+    def test_core_and_dry_scenarios(self):
+        report = self._bench(scenarios="core,dry")
+        core, dry = report["scenarios"]["core"], report["scenarios"]["dry"]
+        self.assertEqual(core["dishes"], 60)
+        self.assertEqual(dry["dishes"], 60)
+        self.assertGreater(core["dishes_per_sec"], 0)
+        self.assertGreater(dry["dishes_per_sec"], 0)
+        self.assertIsNotNone(core["p50_ms"])
+        self.assertIsNotNone(core["peak_memory_kb"])
+        self.assertGreater(dry["queries"], 0)
+        self.assertFalse(Dish.objects.exists())  # البيانات الاصطناعية تُلغى (rollback)
+
+    def test_baseline_regression_fails_the_command(self):
+        baseline = self.tmp / "baseline.json"
+        baseline.write_text(json.dumps({"scenarios": {"dry": {"dishes_per_sec": 1e12}}}), encoding="utf-8")
+        with self.assertRaises(CommandError):
+            self._bench(scenarios="dry", no_memory=True, baseline=str(baseline), max_regression=50)
+
+
+# ------------------------------------------------------------
+# LLM: rate limiter / circuit breaker
+# ------------------------------------------------------------
+class CircuitBreakerProbeTests(SimpleTestCase):
+    def _half_open(self, limiter: ModelLimiter) -> None:
+        limiter.failures = 5
+        limiter.open_until = time.monotonic() - 1  # انتهت مدة cooldown
+
+    def _acquire_in_thread(self, limiter: ModelLimiter):
+        outcome = {}
+
+        def run():
+            try:
+                outcome["wait"] = limiter.acquire(10)
+            except CircuitOpen as e:
+                outcome["error"] = e
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        return outcome
+
+    def test_other_threads_rejected_while_probe_in_flight(self):
+        limiter = ModelLimiter("m")
+        self._half_open(limiter)
+        limiter.acquire(10)
+        self.assertIn("error", self._acquire_in_thread(limiter))
+
+    def test_probe_released_when_caller_gives_up_before_sending(self):
+        limiter = ModelLimiter("probe-model")
+        self._half_open(limiter)
+        limiter.observe({"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "60"})
+        level_before = limiter.requests.level
+        limiter.blocked_until = time.monotonic() + 10_000  # تجميد 429 طويل → wait > MAX_WAIT
+
+        with mock.patch.object(openai_client, "get_client"), \
+                mock.patch.object(openai_client, "get_limiter", return_value=limiter):
+            with self.assertRaises(openai_client.LLMRateLimit):
+                openai_client.openai_caller("hi", model_name="probe-model")
+
+        self.assertIsNone(limiter.probing)
+        self.assertAlmostEqual(limiter.requests.level, level_before, delta=0.01)
+        limiter.blocked_until = 0.0
+        self.assertNotIn("error", self._acquire_in_thread(limiter))
+
+    def test_probe_counted_as_failure_on_unexpected_exit_after_send(self):
+        limiter = ModelLimiter("probe-model-2")
+        self._half_open(limiter)
+        client = mock.Mock()
+        client.chat.completions.with_raw_response.create.side_effect = KeyboardInterrupt
+
+        with mock.patch.object(openai_client, "get_client", return_value=client), \
+                mock.patch.object(openai_client, "get_limiter", return_value=limiter):
+            with self.assertRaises(KeyboardInterrupt):
+                openai_client.openai_caller("hi", model_name="probe-model-2")
+
+        self.assertIsNone(limiter.probing)
+        self.assertGreater(limiter.open_until, time.monotonic())
+
+
+# ------------------------------------------------------------
+# LLM: prompt-hash response cache
+# ------------------------------------------------------------
+class LLMCacheTTLTests(TestCase):
+    @contextmanager
+    def _later(self, seconds):
+        """ساعة LRU وساعة DB (cutoff) معًا بعد seconds."""
+        with mock.patch("core.services.llm_cache.time.time", return_value=time.time() + seconds), \
+                mock.patch("core.services.llm_cache.timezone.now", return_value=timezone.now() + timedelta(seconds=seconds)):
+            yield
+
+    def test_lru_entry_expires_with_store_ttl(self):
+        cache = LLMCache(store=DbLLMStore(ttl_seconds=60))
+        cache.set("d1", {"raw": "x"}, "extract_terms")
+        self.assertEqual(cache.get("d1"), {"raw": "x"})
+        with self._later(61):
+            self.assertIsNone(cache.get("d1"))
+        self.assertNotIn("d1", cache._lru)
+
+    def test_entry_loaded_from_store_expires_with_its_row(self):
+        cache = LLMCache(store=DbLLMStore(ttl_seconds=60))
+        cache.set("d2", {"raw": "x"}, "extract_terms")
+        LLMResponseCache.objects.filter(digest="d2").update(created_at=timezone.now() - timedelta(seconds=50))
+        cache.clear()
+        self.assertEqual(cache.get("d2"), {"raw": "x"})  # من DB، بقي ~10s
+        with self._later(15):
+            self.assertIsNone(cache.get("d2"))
+
+    def test_memory_only_cache_without_ttl_keeps_entries(self):
+        cache = LLMCache()
+        cache.set("d3", [1], "map_terms")
+        with self._later(10 ** 6):
+            self.assertEqual(cache.get("d3"), [1])
+
+
+# ------------------------------------------------------------
+# LLM fallback: IngredientSuggestion reuse (prompt_hash)
+# ------------------------------------------------------------
+class SuggestionReuseTests(TestCase):
+    def setUp(self):
+        get_llm_cache().clear()
+        self.user, section = make_owner()
+        self.dish = Dish.objects.create(section=section, name="Zauberteller", description="mit Wunderkraut")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _run(self, caller, batch):
+        get_llm_cache().clear()
+        with mock.patch("core.views.openai_caller", side_effect=caller) as llm:
+            res = self.client.post(BATCH_URL, {"use_llm": True, "llm_batch": batch}, format="json")
+        self.assertEqual(res.status_code, 200)
+        return res.json()["llm"]["items"], llm.call_count
+
+    def _assert_error_not_saved(self, batch):
+        items, calls = self._run(openai_client.LLMError("boom"), batch)
+        self.assertGreater(calls, 0)
+        self.assertFalse(items[0]["reused"])
+        self.assertEqual(IngredientSuggestion.objects.count(), 0)
+
+        items, calls = self._run(fake_llm, batch)
+        self.assertGreater(calls, 0)
+        self.assertFalse(items[0]["reused"])
+        self.assertEqual(IngredientSuggestion.objects.filter(dish=self.dish).count(), 1)
+
+        items, calls = self._run(fake_llm, batch)
+        self.assertEqual(calls, 0)
+        self.assertTrue(items[0]["reused"])
+        self.assertEqual([c["term"] for c in items[0]["candidates"]], ["wunderkraut"])
+
+    def test_llm_error_is_not_saved_and_next_run_asks_again(self):
+        self._assert_error_not_saved(batch=False)
+
+    def test_llm_error_is_not_saved_in_batch_mode(self):
+        self._assert_error_not_saved(batch=True)
+
+    def test_failed_code_mapping_is_not_saved(self):
+        def extract_only(prompt, **kwargs):
+            if "allergen labeler" in prompt:
+                raise openai_client.LLMError("boom")
+            return fake_llm(prompt)
+
+        items, _ = self._run(extract_only, batch=True)
+        self.assertEqual(items[0]["candidates"][0]["reason"], "llm_error")
+        self.assertEqual(IngredientSuggestion.objects.count(), 0)
+
+
+# ------------------------------------------------------------
+# LLM: batched prompts (token budget + single-prompt fallback)
+# ------------------------------------------------------------
+class LLMBatchPromptTests(SimpleTestCase):
+    DISHES = [(i, f"Zauberteller {i}", "mit Wunderkraut " * 20) for i in range(1, 7)]
+
+    def _caller(self, batch_reply):
+        """يسجّل البرومبتات؛ الدفعة → batch_reply(dishes)، الفردي → ["einzeln"]."""
+        calls = {"batch": [], "single": []}
+
+        def call(prompt, **kwargs):
+            if "DISHES:" in prompt:
+                dishes = json.loads(prompt.split("DISHES:")[1].split("Return ONLY")[0])
+                calls["batch"].append((prompt, kwargs, dishes))
+                return batch_reply(dishes)
+            calls["single"].append(prompt)
+            return '["einzeln"]'
+
+        return call, calls
+
+    def test_split_by_budget_keeps_order_and_limits(self):
+        self.assertEqual(_split_by_budget([3, 3, 3, 10, 1], lambda x: x, 6, 5), [[3, 3], [3], [10], [1]])
+        self.assertEqual(_split_by_budget([1] * 5, lambda x: x, 100, 2), [[1, 1], [1, 1], [1]])
+        self.assertEqual(_split_by_budget([], lambda x: x, 10, 2), [])
+
+    def test_extract_batches_respect_token_budget(self):
+        reply = lambda dishes: json.dumps({k: ["wunderkraut"] for k in dishes})  # noqa: E731
+        call, calls = self._caller(reply)
+        out = llm_extract_terms_batch(call, LLMConfig(max_terms=4), self.DISHES)
+        self.assertEqual(len(calls["batch"]), 1)
+        self.assertEqual(sorted(out), [k for k, _, _ in self.DISHES])
+
+        cfg = LLMConfig(max_terms=4, batch_token_budget=700)
+        call, calls = self._caller(reply)
+        out = llm_extract_terms_batch(call, cfg, self.DISHES)
+        self.assertGreater(len(calls["batch"]), 1)
+        self.assertEqual(calls["single"], [])
+        names = [d["name"] for _, _, dishes in calls["batch"] for d in dishes.values()]
+        self.assertEqual(names, [name for _, name, _ in self.DISHES])
+        for prompt, kwargs, _ in calls["batch"]:
+            self.assertLessEqual(_approx_tokens(prompt) + kwargs["max_tokens"], cfg.batch_token_budget)
+        self.assertEqual({terms[0] for terms, _, _ in out.values()}, {"wunderkraut"})
+
+        call, calls = self._caller(reply)
+        llm_extract_terms_batch(call, LLMConfig(max_terms=4, batch_size=4), self.DISHES)
+        self.assertEqual([len(dishes) for _, _, dishes in calls["batch"]], [4, 2])
+
+    def test_malformed_batch_reply_falls_back_to_single_prompts(self):
+        call, calls = self._caller(lambda dishes: "Sorry, here are the terms: wunderkraut")
+        out = llm_extract_terms_batch(call, LLMConfig(), self.DISHES[:3])
+        self.assertEqual(len(calls["batch"]), 1)
+        self.assertEqual(len(calls["single"]), 3)
+        self.assertEqual(out[1], (["einzeln"], '["einzeln"]', True))
+
+    def test_missing_or_invalid_keys_fall_back_per_dish(self):
+        call, calls = self._caller(lambda dishes: json.dumps({"1": ["wunderkraut"], "2": "wunderkraut"}))
+        out = llm_extract_terms_batch(call, LLMConfig(), self.DISHES[:3])
+        self.assertEqual(len(calls["single"]), 2)
+        self.assertIn("NAME: Zauberteller 2", calls["single"][0])
+        self.assertIn("NAME: Zauberteller 3", calls["single"][1])
+        self.assertEqual(out[1][0], ["wunderkraut"])
+        self.assertEqual((out[2][0], out[3][0]), (["einzeln"], ["einzeln"]))
+
+    def test_map_terms_retries_missing_terms_singly(self):
+        prompts = []
+
+        def call(prompt, **kwargs):
+            terms = json.loads(prompt.split("Terms (language=de):")[1].split("Return ONLY")[0])
+            prompts.append(terms)
+            if len(terms) > 1:
+                return json.dumps({"zauberblatt": {"codes": "G", "confidence": 0.8, "reason": "dairy"}})
+            if terms == ["wunderkraut"]:
+                return "no idea"
+            return json.dumps({t: {"codes": "", "confidence": 0.0, "reason": "generic"} for t in terms})
+
+        out, failed = llm_map_terms_to_codes(
+            call, LLMConfig(), ["Zauberblatt", "Wunderkraut", "Feenstaub"], with_status=True,
+        )
+        self.assertEqual(prompts, [["zauberblatt", "wunderkraut", "feenstaub"], ["wunderkraut"], ["feenstaub"]])
+        self.assertEqual(out["zauberblatt"]["codes"], "G")
+        self.assertEqual(out["feenstaub"]["reason"], "generic")
+        self.assertEqual(out["wunderkraut"]["reason"], "llm_unparsed")
+        self.assertEqual(set(failed), {"wunderkraut"})
+
+
+# ------------------------------------------------------------
+# LLM: concurrent fan-out (LLM_MAX_IN_FLIGHT)
+# ------------------------------------------------------------
+class LLMFanOutTests(SimpleTestCase):
+    def test_fan_out_bounds_in_flight_and_keeps_order(self):
+        lock = threading.Lock()
+        state = {"now": 0, "peak": 0}
+
+        def call(i):
+            with lock:
+                state["now"] += 1
+                state["peak"] = max(state["peak"], state["now"])
+            try:
+                time.sleep(0.002 * (12 - i))  # العناصر الأخيرة تنتهي أولًا
+                if i == 5:
+                    raise ValueError("boom")
+                return i * 10
+            finally:
+                with lock:
+                    state["now"] -= 1
+
+        out = fan_out(call, range(12), limit=3)
+        self.assertEqual(state["peak"], 3)
+        self.assertEqual([r for ok, r in out if ok], [i * 10 for i in range(12) if i != 5])
+        self.assertFalse(out[5][0])
+        self.assertIsInstance(out[5][1], ValueError)
+
+    def test_single_worker_runs_inline(self):
+        caller = threading.get_ident()
+        out = fan_out(lambda i: threading.get_ident(), range(3), limit=1)
+        self.assertEqual(out, [(True, caller)] * 3)
+
+    @override_settings(LLM_MAX_IN_FLIGHT=4)
+    def test_request_can_only_lower_the_limit(self):
+        self.assertEqual(max_in_flight(), 4)
+        self.assertEqual(max_in_flight(2), 2)
+        self.assertEqual(max_in_flight(50), 4)
+
+
+class LLMConcurrencyApiTests(TestCase):
+    def setUp(self):
+        get_llm_cache().clear()
+        self.user, section = make_owner()
+        self.dishes = [Dish.objects.create(section=section, name=f"Zauberteller{c}") for c in "abcdef"]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_llm_concurrency_lowers_limit_and_items_keep_dish_order(self):
+        lock = threading.Lock()
+        state = {"now": 0, "peak": 0}
+        limits = []
+
+        def caller(prompt, **kwargs):
+            with lock:
+                state["now"] += 1
+                state["peak"] = max(state["peak"], state["now"])
+            try:
+                time.sleep(0.01)
+                if "NAME:" in prompt:
+                    name = prompt.split("NAME:")[1].split("\n")[0].strip()
+                    return json.dumps([name.lower()])
+                return fake_llm(prompt)
+            finally:
+                with lock:
+                    state["now"] -= 1
+
+        def spy(fn, items, limit):
+            limits.append(limit)
+            return fan_out(fn, items, limit)
+
+        with mock.patch("core.views.openai_caller", side_effect=caller), mock.patch("core.views.fan_out", spy):
+            res = self.client.post(
+                BATCH_URL, {"use_llm": True, "llm_batch": False, "llm_concurrency": 2}, format="json",
+            )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(limits, [2])
+        self.assertEqual(state["peak"], 2)
+        items = res.json()["llm"]["items"]
+        self.assertEqual([it["dish_id"] for it in items], [d.id for d in self.dishes])
+        self.assertEqual([it["candidates"][0]["term"] for it in items], [d.name.lower() for d in self.dishes])
+
+
+# ------------------------------------------------------------
+# LLM: shared OpenAI clients (keep-alive pool, fork-safe)
+# ------------------------------------------------------------
+class OpenAIClientRegistryTests(SimpleTestCase):
+    KEY = "sk-test"
+
+    def setUp(self):
+        openai_client.close_clients()
+        self.addCleanup(openai_client.close_clients)
+
+    def test_clients_are_reused_per_timeout_and_share_one_pool(self):
+        get = openai_client.get_client
+        c60, c30 = get(60, api_key=self.KEY), get(30, api_key=self.KEY)
+        self.assertIs(get(60, api_key=self.KEY), c60)
+        self.assertIs(get(60.0, api_key=self.KEY), c60)
+        self.assertIsNot(c30, c60)
+        self.assertEqual((c60.timeout, c30.timeout), (60.0, 30.0))
+        self.assertIs(c30._client, c60._client)
+        self.assertEqual(c60.max_retries, 0)
+        self.assertIsNot(get(60, api_key="sk-other"), c60)
+
+    def test_missing_api_key_raises(self):
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""}):
+            with self.assertRaises(openai_client.LLMError):
+                openai_client.get_client(60)
+
+    def test_registry_resets_when_pid_changes(self):
+        parent = openai_client.get_client(60, api_key=self.KEY)
+        with mock.patch.object(openai_client.os, "getpid", return_value=os.getpid() + 1):
+            child = openai_client.get_client(60, api_key=self.KEY)
+        self.assertIsNot(child, parent)
+        self.assertIsNot(child._client, parent._client)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "يتطلب os.fork")
+    def test_forked_child_starts_with_empty_registry(self):
+        parent = openai_client.get_client(60, api_key=self.KEY)
+        pid = os.fork()
+        if pid == 0:  # العملية الابنة: لا نرجع إلى test runner أبدًا
+            code = 1
+            try:
+                fresh = not openai_client._clients
+                child = openai_client.get_client(60, api_key=self.KEY)
+                code = 0 if fresh and child is not parent else 2
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(openai_client.get_client(60, api_key=self.KEY), parent)
@@ -53,6 +53,7 @@ urlpatterns = [
     path("sections/", views.SectionListCreateView.as_view(), name="section-list-create"),   # ?menu=<id>
     path("dishes/",   views.DishListCreateView.as_view(),   name="dish-list-create"),       # ?section=<id>
     path("dishes/<int:pk>/", views.DishDetailView.as_view(), name="dish-detail"),
+    path("dishes/<int:pk>/explain-codes/", views.explain_dish_codes, name="dish-explain-codes"),
 
     # ---------- التوليد والقاموس ----------
     path(
@@ -60,6 +61,9 @@ urlpatterns = [
         views.batch_generate_allergen_codes,
         name="batch-generate-allergen-codes",
     ),
+    path("rule-runs/<int:pk>/", views.rule_run_detail, name="rule-run-detail"),
+    path("rule-runs/<int:pk>/items/", views.rule_run_items, name="rule-run-items"),
+    path("rule-runs/<int:pk>/apply/", views.rule_run_apply, name="rule-run-apply"),
     path(  # حفظ مقترحات LLM في القاموس (المستخدم في الواجهة الأمامية)
         "lexicon/llm-add/",
         views.llm_add_terms_to_lexicon,
@@ -70,6 +74,11 @@ urlpatterns = [
         views.dictionary_batch_upsert_lexemes,
         name="dictionary-batch-upsert-lexemes",
     ),
+    path(  # معاينة/تطبيق أثر تعديل القاموس على الأطباق المتأثّرة فقط
+        "dictionary/impact-preview/",
+        views.dictionary_impact_preview,
+        name="dictionary-impact-preview",
+    ),
 
     # ---------- Public menu ----------
     path("public/menus/<slug:public_slug>/", views.PublicMenuView.as_view(), name="public-menu"),
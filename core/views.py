@@ -6,8 +6,9 @@
 from typing import Iterable, List, Dict
 import re
 
-from django.db import transaction, IntegrityError
-from django.db.models import Prefetch
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Prefetch, Q
 from django.shortcuts import get_object_or_404
 
 from rest_framework import generics, status, viewsets, permissions
@@ -28,6 +29,8 @@ from .models import (
     Ingredient,
     Allergen,   # لاستخدام M2M الأكواد
     DishAllergen,  # ⬅️ سجلات التتبّع لكل كود
+    RuleRun,
+    IngredientSuggestion,
 )
 from .serializers import (
     RegisterSerializer,
@@ -44,7 +47,12 @@ from .serializers import (
 
 # محرك القواعد
 from core.services.allergen_rules import generate_for_dishes as rule_generate_for_dishes
+from core.services.allergen_rules import generate_per_owner as rule_generate_per_owner
 from core.services.allergen_rules import normalize_text as _norm
+from core.services.allergen_rules import SKIPPED_ACTIONS, explain_dish
+from core.services.dish_stream import with_rule_prefetch
+from core.services.rule_runs import RuleRunError, apply_run, items_page, record_run, run_summary
+from core.services.dish_index import LexiconChange, changes_for_lexemes, recompute_affected
 
 # LLM
 # LLM
@@ -53,7 +61,11 @@ from core.services.llm_ingest import (
     llm_extract_terms,
     llm_map_terms_to_codes,
     llm_map_dish_to_codes,   # ← جديد: وضع LLM مباشر للأكواد
+    llm_extract_terms_batch,
+    suggestion_key,
 )
+from core.services.llm_cache import get_llm_cache
+from core.services.llm_fanout import fan_out, max_in_flight
 from core.llm_clients.openai_client import openai_caller
 
 # نموذج القاموس
@@ -104,45 +116,6 @@ def _split_letter_codes(codes_str: str) -> List[str]:
     return uniq
 
 
-@transaction.atomic
-def _sync_dish_allergen_rows_from_codes(dish: Dish, codes_str: str, *, source: str = DishAllergen.Source.REGEX, force: bool = False) -> int:
-    """
-    يزامن سجلات DishAllergen من سلسلة أكواد حرفية (A,G,K).
-    - لا يحذف السجلات اليدوية أو المؤكّدة.
-    - إن لم يكن force: لا يلمس الأطباق ذات has_manual_codes=True.
-    - يعيد عدد السجلات المُنشأة (الجديدة).
-    """
-    if (not force) and getattr(dish, "has_manual_codes", False):
-        return 0
-
-    codes = _split_letter_codes(codes_str)
-    if not codes:
-        return 0
-
-    existing = set(DishAllergen.objects.filter(dish=dish).values_list("allergen__code", flat=True))
-    to_add = [c for c in codes if c not in existing]
-    if not to_add:
-        return 0
-
-    alls = {a.code: a for a in Allergen.objects.filter(code__in=to_add)}
-    created = 0
-    for code in to_add:
-        allergen = alls.get(code)
-        if not allergen:
-            continue
-        DishAllergen.objects.create(
-            dish=dish,
-            allergen=allergen,
-            source=source,
-            confidence=0.0,          # لاحقًا: نعبّيها من محرك القواعد
-            rationale="",
-            is_confirmed=False,
-            created_by=None,
-        )
-        created += 1
-    return created
-
-
 # ============================================================
 # Auth / Users
 # ============================================================
@@ -428,7 +401,18 @@ def batch_generate_allergen_codes(request):
       1) تشغيل محرك القواعد (قاموس DB).
       2) للأطباق التي بقيت بلا أكواد: LLM لاستخراج مصطلحات Zutaten،
          ويمكن (اختياريًا) تخمين أكواد لكل مصطلح. لا كتابة تلقائيّة.
-      3) إن كان dry_run=false: نزامن سجلات DishAllergen بشكل محافظ من ناتج القواعد.
+      3) إن كان dry_run=false: محرك القواعد نفسه يكتب الأطباق وسجلات DishAllergen
+         على دفعات (bulk) — لا تمريرة مزامنة ثانية على نفس الأطباق.
+    timings=true: أزمنة/عدّادات مراحل المحرك تحت rules.timings.
+    العناصر افتراضيًا مضغوطة (dish_id, before, after, action)؛ include_details=true
+    يعيد الشرح الكامل لكل طبق (أبطأ)، والأفضل GET dishes/<id>/explain-codes/ لطبق بعينه.
+    record_run=true: كل النتائج تُحفظ في RuleRun (rules.run_id) وتُتصفّح عبر
+    GET rule-runs/<id>/items/?cursor= ؛ وdry run المسجّل يُطبَّق عبر POST rule-runs/<id>/apply/.
+    وضع الكتابة يُكتب دفعةً دفعة (transaction لكل دفعة)؛ rules.resume_token (أو RuleRun.resume_token)
+    يُمرَّر كـresume_token لإكمال تشغيل منقطع بعد آخر دفعة مكتوبة.
+    نداءات LLM للأطباق تُرسل متزامنة بحد أقصى LLM_MAX_IN_FLIGHT (llm_concurrency يخفّضه).
+    llm_batch (افتراضيًا LLM_BATCH_PROMPTS): عدة أطباق في برومبت استخراج واحد، وتخمين أكواد
+    واحد لمصطلحات كل الأطباق المميّزة (بدل نداءين لكل طبق)؛ false = البرومبت الفردي لكل طبق.
     """
     user = request.user
 
@@ -436,7 +420,12 @@ def batch_generate_allergen_codes(request):
     force = bool(request.data.get("force", False))
     dry_run = bool(request.data.get("dry_run", True))
     lang = (request.data.get("lang") or "de").lower()
-    include_details = bool(request.data.get("include_details", True))
+    include_details = bool(request.data.get("include_details", False))
+    incremental = bool(request.data.get("incremental", False))
+    timings = request.data.get("timings")
+    timings = bool(timings) if timings is not None else None
+    record = bool(request.data.get("record_run", False))
+    resume_from = (request.data.get("resume_token") or "").strip() or None
 
     # خيارات LLM
     use_llm = bool(request.data.get("use_llm", False))
@@ -449,17 +438,20 @@ def batch_generate_allergen_codes(request):
         llm_temperature = 0.2
     llm_debug = bool(request.data.get("llm_debug", False))
     llm_guess_codes = bool(request.data.get("llm_guess_codes", True))
+    try:
+        llm_concurrency = int(request.data.get("llm_concurrency") or 0) or None
+    except Exception:
+        llm_concurrency = None
+    llm_batch = bool(request.data.get("llm_batch", getattr(settings, "LLM_BATCH_PROMPTS", True)))
 
-    # نطاق الأطباق
-    base = Dish.objects.select_related("section__menu__user")
+    # نطاق الأطباق (لا نحمّلها كلها: المحرك يمرّ عليها بدفعات keyset)
+    base = Dish.objects.all()
     qs = base if is_admin(user) else base.filter(section__menu__user=user)
 
     dish_ids = request.data.get("dish_ids")
     if isinstance(dish_ids, list) and dish_ids:
         qs = qs.filter(id__in=dish_ids)
 
-    dishes = list(qs)
-
     # تحديد القاموس المستخدم (مالك واحد أو المستخدم الحالي)
     explicit_owner_id = request.data.get("owner_id")
     owner_id = None
@@ -469,58 +461,55 @@ def batch_generate_allergen_codes(request):
         except Exception:
             owner_id = None
 
-    if owner_id is None:
-        if not is_admin(user):
-            owner_id = user.id
-        else:
-            owner_ids = {getattr(d.section.menu, "user_id", None) for d in dishes}
-            owner_ids.discard(None)
-            owner_id = next(iter(owner_ids)) if len(owner_ids) == 1 else None
+    if owner_id is None and not is_admin(user):
+        owner_id = user.id
 
     # 1) محرك القواعد
-    rules_res = rule_generate_for_dishes(
-        dishes,
-        owner_id=owner_id,
+    rule_opts = dict(
         lang=lang,
         force=force,
         dry_run=dry_run,
         include_details=include_details,
+        incremental=incremental,
+        timings=timings,
+        compact=not include_details,
+        resume_from=resume_from,
     )
-
-    # 1.b) مزامنة سجلات DishAllergen من ناتج القواعد (إن لم يكن dry_run)
-    if not dry_run and isinstance(rules_res, dict):
-        items = rules_res.get("items", []) or []
-        by_id = {d.id: d for d in dishes}
-        created_rows = 0
-        for it in items:
-            try:
-                did = int(it.get("dish_id"))
-            except Exception:
-                continue
-            dish = by_id.get(did)
-            if not dish or bool(it.get("skipped")):
-                continue
-            after = (it.get("after") or "").strip()
-            if not after:
-                continue
-            created_rows += _sync_dish_allergen_rows_from_codes(
-                dish, after, source=DishAllergen.Source.REGEX, force=force
+    if owner_id is not None:
+        generate, gen_kwargs = rule_generate_for_dishes, dict(owner_id=owner_id)
+    else:
+        # أدمن بدون owner_id: كل مالك بقاموسه؛ التوزيع على عمليات داخل عامل الويب اختياري
+        # (RULES_WEB_MAX_WORKERS، افتراضيًا 1 = تسلسلي) — الأوامر تستخدم كل الأنوية
+        web_workers = int(getattr(settings, "RULES_WEB_MAX_WORKERS", 1) or 1)
+        generate, gen_kwargs = rule_generate_per_owner, dict(parallel=web_workers > 1, max_workers=web_workers)
+    try:
+        if record:
+            params = {k: v for k, v in rule_opts.items() if k not in ("lang", "dry_run")}
+            if isinstance(dish_ids, list) and dish_ids:
+                params["dish_ids"] = len(dish_ids)
+            rules_res = record_run(
+                generate, qs, user=user, params=params, **gen_kwargs, **rule_opts,
             )
-        rules_res["dish_allergen_rows_created"] = created_rows
+        else:
+            rules_res = generate(qs, **gen_kwargs, **rule_opts)
+    except ValueError as e:
+        # resume_token بصيغة خاطئة أو لمالك خارج هذا التشغيل
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     # 2) LLM fallback
     missing_ids: List[int] = []
     for it in rules_res.get("items", []):
         after = (it.get("after") or "").strip()
         before = (it.get("before") or "").strip()
-        if bool(it.get("skipped")):
+        if bool(it.get("skipped")) or it.get("action") in SKIPPED_ACTIONS:
             continue
         if after == "" or ((after == before) and (before == "")):
             missing_ids.append(int(it["dish_id"]))
 
     llm_payload = None
     if use_llm and missing_ids:
-        by_id: Dict[int, Dish] = {d.id: d for d in dishes}
+        # نجلب فقط الأطباق الناقصة (بعد كتابة المحرك)
+        by_id: Dict[int, Dish] = {d.id: d for d in qs.filter(id__in=missing_ids)}
         cfg = LLMConfig(
             model_name=llm_model,
             lang=lang,
@@ -529,6 +518,71 @@ def batch_generate_allergen_codes(request):
             dry_run=llm_dry_run,
             max_output_tokens=512,
         )
+        llm_cache = get_llm_cache()
+
+        # اقتراح محفوظ لنفس الطبق ونفس البرومبت (prompt_hash) → يُعاد بدون أي نداء LLM
+        sugg_keys = {
+            did: suggestion_key(llm_cache, cfg, d.name or "", d.description or "", llm_guess_codes)
+            for did, d in by_id.items()
+        }
+        saved = {
+            (sg.dish_id, sg.prompt_hash): sg
+            for sg in IngredientSuggestion.objects.filter(
+                dish_id__in=list(sugg_keys),
+                prompt_hash__in=set(sugg_keys.values()),
+                model_name=cfg.model_name,
+                lang=lang,
+            )
+        }
+        new_suggestions: List[IngredientSuggestion] = []
+
+        # LLM لكل طبق بلا اقتراح محفوظ: استخراج + تخمين الأكواد، موزّعة بحد أقصى متزامن
+        pending = [
+            by_id[did] for did in missing_ids
+            if did in by_id and (did, sugg_keys[did]) not in saved
+        ]
+
+        # llm_ok: المصطلحات والتخمين جاءا فعلًا من LLM (لا fallback محلي ولا llm_error)؛
+        # غير ذلك لا يُحفظ كاقتراح، وإلا أُعيد استخدامه للأبد بدل سؤال LLM من جديد
+        def _ask(d: Dish):
+            terms, raw, llm_ok = llm_extract_terms(
+                openai_caller, cfg, d.name or "", d.description or "", cache=llm_cache, with_status=True  # type: ignore
+            )
+
+            # تخمين أكواد لكل term (اختياريًا)
+            codes_lookup = {}
+            if llm_guess_codes and terms:
+                try:
+                    codes_lookup, failed = llm_map_terms_to_codes(
+                        openai_caller, cfg, terms, lang=lang, cache=llm_cache, with_status=True,  # type: ignore
+                    )
+                    llm_ok = llm_ok and not failed
+                except Exception:
+                    codes_lookup, llm_ok = {}, False
+            return terms, raw if llm_debug else "", codes_lookup, llm_ok
+
+        limit = max_in_flight(llm_concurrency)
+        if llm_batch and pending:
+            # برومبتات دفعات: عدة أطباق لكل استخراج، والمصطلحات المميّزة لكل الأطباق في تخمين واحد
+            def runner(fn, chunks):
+                return fan_out(fn, chunks, limit)
+
+            extracted = llm_extract_terms_batch(
+                openai_caller, cfg, [(d.id, d.name or "", d.description or "") for d in pending],  # type: ignore
+                cache=llm_cache, runner=runner,
+            )
+            codes_lookup, failed = {}, set()
+            if llm_guess_codes:
+                all_terms = [t for terms, _, _ in extracted.values() for t in terms]
+                codes_lookup, failed = llm_map_terms_to_codes(
+                    openai_caller, cfg, all_terms, lang=lang, cache=llm_cache, runner=runner, with_status=True,  # type: ignore
+                )
+            answers = {
+                did: (True, (terms, raw if llm_debug else "", codes_lookup, extracted_ok and failed.isdisjoint(terms)))
+                for did, (terms, raw, extracted_ok) in extracted.items()
+            }
+        else:
+            answers = dict(zip([d.id for d in pending], fan_out(_ask, pending, limit)))
 
         items = []
         for did in missing_ids:
@@ -536,31 +590,29 @@ def batch_generate_allergen_codes(request):
             if not d:
                 continue
 
-            try:
-                if llm_debug:
-                    terms, raw = llm_extract_terms(
-                        openai_caller, cfg, d.name or "", d.description or "", return_raw=True  # type: ignore
-                    )
-                else:
-                    terms = llm_extract_terms(openai_caller, cfg, d.name or "", d.description or "")  # type: ignore
-                    raw = ""
-            except Exception as e:
+            sg = saved.get((did, sugg_keys[did]))
+            if sg is not None:
+                items.append({
+                    "dish_id": did,
+                    "status": "ok" if sg.candidates else "empty",
+                    "reused": True,
+                    "suggestion_id": sg.id,
+                    "suggestion_status": sg.status,
+                    "candidates": sg.candidates,
+                })
+                continue
+
+            ok, answer = answers[did]
+            if not ok:
                 items.append({
                     "dish_id": did,
                     "status": "error",
-                    "error": str(e),
+                    "error": str(answer),
                     "reused": False,
                     "candidates": [],
                 })
                 continue
-
-            # تخمين أكواد لكل term (اختياريًا)
-            codes_lookup = {}
-            if llm_guess_codes and terms:
-                try:
-                    codes_lookup = llm_map_terms_to_codes(openai_caller, cfg, terms, lang=lang)
-                except Exception:
-                    codes_lookup = {}
+            terms, raw, codes_lookup, llm_ok = answer
 
             candidates = []
             for term in terms:
@@ -594,6 +646,18 @@ def batch_generate_allergen_codes(request):
             if llm_debug:
                 item["raw"] = raw
             items.append(item)
+            if terms and llm_ok:
+                new_suggestions.append(IngredientSuggestion(
+                    dish_id=did,
+                    lang=lang,
+                    text_snapshot=_norm(f"{d.name or ''} {d.description or ''}"),
+                    candidates=candidates,
+                    model_name=cfg.model_name,
+                    prompt_hash=sugg_keys[did],
+                ))
+
+        if new_suggestions:
+            IngredientSuggestion.objects.bulk_create(new_suggestions, ignore_conflicts=True)
 
         llm_payload = {
             "count": len(items),
@@ -607,6 +671,85 @@ def batch_generate_allergen_codes(request):
     return Response({"rules": rules_res, "llm": llm_payload}, status=status.HTTP_200_OK)
 
 
+# ============================================================
+#  Explain Allergen Codes (طبق واحد عند الطلب)
+#  GET /api/dishes/<id>/explain-codes/?lang=de&owner_id=<id>
+# ============================================================
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def explain_dish_codes(request, pk: int):
+    """
+    provenance كاملة لطبق واحد (نصوص المطابقة، hits، أسباب كل كود، شرح ألماني)
+    بلقطة القاموس المخزّنة — بدون كتابة.
+    owner_id (للأدمن فقط): قاموس مالك آخر؛ الافتراضي مالك قائمة الطبق.
+    """
+    user = request.user
+    lang = (request.query_params.get("lang") or "de").lower().strip()
+
+    base = with_rule_prefetch(Dish.objects.all())
+    qs = base if is_admin(user) else base.filter(section__menu__user=user)
+    dish = get_object_or_404(qs, pk=pk)
+
+    owner_id = None
+    if is_admin(user) and request.query_params.get("owner_id") is not None:
+        try:
+            owner_id = int(request.query_params.get("owner_id"))
+        except Exception:
+            return Response({"detail": "owner_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(explain_dish(dish, owner_id=owner_id, lang=lang), status=status.HTTP_200_OK)
+
+
+# ============================================================
+#  Rule Runs (نتائج مسجّلة: ملخّص + تصفّح + تطبيق)
+#  GET  /api/rule-runs/<id>/
+#  GET  /api/rule-runs/<id>/items/?cursor=<id>&limit=200&action=would_change
+#  POST /api/rule-runs/<id>/apply/
+# ============================================================
+
+def _rule_run_for(request, pk: int) -> RuleRun:
+    qs = RuleRun.objects.all()
+    if not is_admin(request.user):
+        qs = qs.filter(user=request.user)
+    return get_object_or_404(qs, pk=pk)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def rule_run_detail(request, pk: int):
+    return Response(run_summary(_rule_run_for(request, pk)), status=status.HTTP_200_OK)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def rule_run_items(request, pk: int):
+    """صفحة عناصر بمؤشّر keyset؛ next_cursor=None في آخر صفحة."""
+    run = _rule_run_for(request, pk)
+    try:
+        cursor = int(request.query_params.get("cursor") or 0)
+        limit = int(request.query_params.get("limit") or 0)
+    except Exception:
+        return Response({"detail": "cursor and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+    items, next_cursor = items_page(run, cursor=cursor, limit=limit, action=request.query_params.get("action"))
+    return Response(
+        {"run_id": run.id, "count": run.item_count, "results": items, "next_cursor": next_cursor},
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def rule_run_apply(request, pk: int):
+    """يكتب قرارات dry run المخزّنة بدون إعادة حساب (الأطباق التي تغيّرت منذها تُتخطّى كـstale)."""
+    run = _rule_run_for(request, pk)
+    try:
+        stats = apply_run(run)
+    except RuleRunError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({"run_id": run.id, "status": run.status, "apply_stats": stats}, status=status.HTTP_200_OK)
+
+
 # ============================================================
 # Dictionary: Batch Upsert (آمن)
 # POST /api/dictionary/batch-upsert-lexemes/
@@ -624,6 +767,7 @@ def dictionary_batch_upsert_lexemes(request):
     lang = (data.get("lang") or "de").lower()
     items = data.get("items") or []
     as_ingredient = bool(data.get("as_ingredient", True))
+    recompute = bool(data.get("recompute", False))
 
     if not isinstance(items, list):
         return Response({"detail": "items must be a list."}, status=status.HTTP_400_BAD_REQUEST)
@@ -645,6 +789,7 @@ def dictionary_batch_upsert_lexemes(request):
     created = 0
     updated = 0
     out_items = []
+    touched: List[KeywordLexeme] = []
 
     for raw in items:
         term = (raw.get("term") or "").strip()
@@ -710,6 +855,7 @@ def dictionary_batch_upsert_lexemes(request):
                 alls = list(Allergen.objects.filter(code__in=sorted(existing | codes_set)))
                 lx.allergens.set(alls)
 
+        touched.append(lx)
         out_items.append({
             "id": lx.id,
             "term": lx.term,
@@ -717,13 +863,16 @@ def dictionary_batch_upsert_lexemes(request):
             "codes": ",".join(sorted(lx.allergens.values_list("code", flat=True))),
         })
 
-    return Response({
+    payload = {
         "owner_id": eff_owner_id,
         "lang": lang,
         "created": created,
         "updated": updated,
         "items": out_items,
-    }, status=status.HTTP_200_OK)
+    }
+    if recompute and touched:
+        payload["recompute"] = _recompute_for_lexicon_change(request.user, changes_for_lexemes(touched), lang)
+    return Response(payload, status=status.HTTP_200_OK)
 
 
 # ============================================================
@@ -745,8 +894,10 @@ def llm_add_terms_to_lexicon(request):
     lang = (data.get("lang") or "de").lower().strip()
     items = data.get("items") or []
     as_global = bool(data.get("as_global", False)) if is_admin_user else False
+    recompute = bool(data.get("recompute", False))
 
     results = []
+    touched: List[KeywordLexeme] = []
     created = 0
     updated = 0
     skipped = 0
@@ -776,6 +927,7 @@ def llm_add_terms_to_lexicon(request):
                     obj.is_active = True
                     obj.save(update_fields=["is_active"])
                     updated += 1
+                    touched.append(obj)
                     results.append({"term": term, "id": obj.id, "status": "updated"})
                 else:
                     skipped += 1
@@ -803,9 +955,10 @@ def llm_add_terms_to_lexicon(request):
             obj.allergens.set(alls)
 
         created += 1
+        touched.append(obj)
         results.append({"term": term, "id": obj.id, "status": "created"})
 
-    return Response({
+    payload = {
         "ok": True,
         "lang": lang,
         "as_global": as_global,
@@ -814,7 +967,74 @@ def llm_add_terms_to_lexicon(request):
         "skipped": skipped,
         "items": results[:1000],
         "note": "Saved into user's private lexicon unless admin + as_global=true.",
-    }, status=status.HTTP_200_OK)
+    }
+    if recompute and touched:
+        payload["recompute"] = _recompute_for_lexicon_change(user, changes_for_lexemes(touched), lang)
+    return Response(payload, status=status.HTTP_200_OK)
+
+
+# ============================================================
+# إعادة حساب موجّهة بعد تعديل القاموس
+# ============================================================
+
+def _recompute_for_lexicon_change(user, changes: List[LexiconChange], lang: str, dry_run: bool = False) -> Dict:
+    """
+    يعيد حساب الأطباق المتأثّرة فقط (فهرس DishToken + المكوّنات المرتبطة).
+    المستخدم العادي: أطباقه فقط حتى لو كان التغيير عامًا.
+    """
+    restrict = None if is_admin(user) else Dish.objects.filter(section__menu__user=user)
+    res = recompute_affected(changes, lang=lang, dry_run=dry_run, restrict_to=restrict)
+    return {
+        "dry_run": dry_run,
+        "affected": res["affected"],
+        "changed": res["changed"],
+        "items": [
+            {"dish_id": it["dish_id"], "name": it["name"], "before": it["before"], "after": it["after"]}
+            for it in res["items"]
+        ],
+    }
+
+
+# POST /api/dictionary/impact-preview/
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def dictionary_impact_preview(request):
+    """
+    معاينة أثر تعديل القاموس بدون مسح كل الأطباق:
+      - lexeme_ids: مصطلحات محفوظة (تشمل regex والمكوّن المرتبط)
+      - terms: مصطلحات ثابتة إضافية في قاموس owner_id (أو المستخدم الحالي)
+    يرجّع الأطباق التي سيتغيّر ناتجها (before/after) بالقاموس الحالي.
+    apply=true يكتب النتائج لنفس الأطباق فقط.
+    """
+    data = request.data or {}
+    user = request.user
+    lang = (data.get("lang") or "de").lower().strip()
+    apply = bool(data.get("apply", False))
+    lexeme_ids = data.get("lexeme_ids") or []
+    terms = data.get("terms") or []
+
+    if not isinstance(lexeme_ids, list) or not isinstance(terms, list):
+        return Response({"detail": "lexeme_ids and terms must be lists."}, status=status.HTTP_400_BAD_REQUEST)
+
+    owner_id = user.id
+    if is_admin(user) and data.get("owner_id") is not None:
+        try:
+            owner_id = int(data.get("owner_id"))
+        except Exception:
+            return Response({"detail": "owner_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+    lx_qs = KeywordLexeme.objects.filter(id__in=[i for i in lexeme_ids if str(i).isdigit()])
+    if not is_admin(user):
+        lx_qs = lx_qs.filter(Q(owner=user) | Q(owner__isnull=True))
+    changes = changes_for_lexemes(lx_qs)
+
+    plain_terms = {str(t).strip() for t in terms if str(t).strip()}
+    if plain_terms:
+        changes.append(LexiconChange(owner_id=owner_id, terms=plain_terms))
+
+    result = _recompute_for_lexicon_change(user, changes, lang, dry_run=not apply)
+    result["lang"] = lang
+    return Response(result, status=status.HTTP_200_OK)
 
 
 # ============================================================
@@ -997,7 +1217,7 @@ def llm_direct_codes(request):
     )
 
     try:
-        res = llm_map_dish_to_codes(openai_caller, cfg, name, description)  # type: ignore
+        res = llm_map_dish_to_codes(openai_caller, cfg, name, description, cache=get_llm_cache())  # type: ignore
         return Response({"ok": True, **res}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"ok": False, "error": str(e)}, status=status.HTTP_200_OK)